@@ -1,5 +1,4 @@
 import os
-import io
 import discord
 import asyncio
 from typing import List
@@ -10,8 +9,10 @@ from app.settings import (
 )
 from app.sd_apis.api_handler import Sd
 from app.utils.async_task_queue import AsyncTaskQueue
+from app.utils.image_storage import ImageStorage
 from app.utils.image_file import ImageFile
-from app.views.view_helpers import upscale_image, idler_message
+from app.utils.attachment_ingest import AttachmentIngest, IngestError
+from app.views.view_helpers import upscale_image, idler_message, wait_for_task
 from .abstract_command import AbstractCommand
 
 
@@ -53,43 +54,36 @@ class Img2ImageCommands(AbstractCommand):
         )
         itask = asyncio.create_task(idler_message("Upscaling image...", response))
 
-        image_props = image_in.to_dict()
-        content_type = image_props["content_type"]
-        if (
-            not "image" in content_type
-            or not content_type.split("/")[1] in Settings.files.image_types
-        ):
-            itask.cancel()
-            await response.edit_original_response(
-                content=f"Please provide an image file. Provided type was '{content_type}'",
-                delete_after=4,
-            )
-            return
-
-        with io.BytesIO() as f:
-            await image_in.save(f)
-            f.seek(0)
-            image = ImageFile(image_bytes=f.read())
-            image.save()
-
         model_def: UpscalerSingleModel = Settings.upscaler.models[model]
-
-        width, height = image.size
-        max_size = (
-            (model_def.max_width or model_def.max_height or (width + 1)) *  # fmt: skip
-            (model_def.max_height or model_def.max_width or (height + 1))  # fmt: skip
-        )
-
-        if width * height > max_size:
-            itask.cancel()
-            await response.edit_original_response(
-                content=f"Input image is too large to upscale. W,H= {width},{height}",
-                delete_after=4,
+        try:
+            image, _ = await AttachmentIngest.ingest(
+                image_in,
+                max_width=model_def.max_width,
+                max_height=model_def.max_height,
             )
+        except IngestError as e:
+            itask.cancel()
+            await response.edit_original_response(content=str(e), delete_after=4)
             return
 
+        try:
+            await self._upscale_image(ctx, response, itask, image, model_def)
+        finally:
+            ImageStorage.release(image.image_filename)
+
+    async def _upscale_image(
+        self,
+        ctx: discord.ApplicationContext,
+        response: discord.Interaction,
+        itask: asyncio.Task,
+        image: ImageFile,
+        model_def: UpscalerSingleModel,
+    ):
         task = await AsyncTaskQueue.create_and_add_task(
-            upscale_image, ctx.author.id, args=(image, model_def, Sd.api)
+            upscale_image,
+            ctx.author.id,
+            args=(image, model_def, Sd.api),
+            affinity_key=model_def.sd_model,
         )
         if task is None:
             itask.cancel()
@@ -99,7 +93,9 @@ class Img2ImageCommands(AbstractCommand):
             )
             return
 
-        upscaled_image: ImageFile = await task.wait_result()
+        upscaled_image: ImageFile = await wait_for_task(task, response, itask)
+        if upscaled_image is None:
+            return
         if upscaled_image.file_size > 25 * 2**20:
             itask.cancel()
             await response.edit_original_response(
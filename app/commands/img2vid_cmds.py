@@ -1,5 +1,4 @@
 import os
-import io
 import discord
 import asyncio
 from typing import List
@@ -10,9 +9,11 @@ from app.settings import (
 )
 from app.sd_apis.api_handler import Sd
 from app.utils.async_task_queue import AsyncTaskQueue, Task
+from app.utils.image_storage import ImageStorage
 from app.utils.image_file import ImageFile, VideoContainer
+from app.utils.attachment_ingest import AttachmentIngest, IngestError
 from app.utils.helpers import random_seed, load_workflow_and_map
-from app.views.view_helpers import idler_message, create_video
+from app.views.view_helpers import idler_message, create_video, wait_for_task, LivePreview
 from app.views.generate_video import GenerateVideoView
 from .abstract_command import AbstractCommand
 
@@ -86,41 +87,50 @@ class Img2VideoCommands(AbstractCommand):
             idler_message("Creating video...", response, interval=2)
         )
 
-        image_props = image_in.to_dict()
-        content_type = image_props["content_type"]
-        if (
-            not "image" in content_type
-            or not content_type.split("/")[1] in Settings.files.image_types
-        ):
-            itask.cancel()
-            await response.edit_original_response(
-                content=f"Please provide an image file. Provided type was '{content_type}'",
-                delete_after=4,
+        model_def: Img2VidSingleModel = Settings.img2vid.models[model]
+        try:
+            image, _ = await AttachmentIngest.ingest(
+                image_in,
+                max_width=model_def.max_width,
+                max_height=model_def.max_height,
             )
+        except IngestError as e:
+            itask.cancel()
+            await response.edit_original_response(content=str(e), delete_after=4)
             return
 
-        with io.BytesIO() as f:
-            await image_in.save(f)
-            f.seek(0)
-            image = ImageFile(image_bytes=f.read())
-            image.save()
-
-        model_def: Img2VidSingleModel = Settings.img2vid.models[model]
-
-        width, height = image.size
-        max_size = (
-            (model_def.max_width or model_def.max_height or (width + 1)) *  # fmt: skip
-            (model_def.max_height or model_def.max_width or (height + 1))  # fmt: skip
-        )
-
-        if width * height > max_size:
-            itask.cancel()
-            await response.edit_original_response(
-                content=f"Input image is too large for SVD. W,H= {width},{height}",
-                delete_after=4,
+        try:
+            await self._image2video_svd(
+                ctx,
+                response,
+                itask,
+                image,
+                model=model,
+                model_def=model_def,
+                motion_amount=motion_amount,
+                video_format=video_format,
+                number_of_frames=number_of_frames,
+                frame_rate=frame_rate,
+                use_ping_pong=use_ping_pong,
             )
-            return
+        finally:
+            ImageStorage.release(image.image_filename)
 
+    async def _image2video_svd(
+        self,
+        ctx: discord.ApplicationContext,
+        response: discord.Interaction,
+        itask: asyncio.Task,
+        image: ImageFile,
+        *,
+        model: str,
+        model_def: Img2VidSingleModel,
+        motion_amount: int,
+        video_format: str,
+        number_of_frames: int,
+        frame_rate: int,
+        use_ping_pong: bool,
+    ):
         workflow, workflow_map = load_workflow_and_map(model_def=model_def)
 
         video_container = VideoContainer(
@@ -140,19 +150,30 @@ class Img2VideoCommands(AbstractCommand):
             workflow=workflow,
             workflow_map=workflow_map,
         )
+        preview = LivePreview.create(response)
         task = await AsyncTaskQueue.create_and_add_task(
-            create_video, ctx.author.id, args=(video_container, Sd.api)
+            create_video,
+            ctx.author.id,
+            args=(video_container, Sd.api),
+            kwargs={"on_preview": preview},
+            affinity_key=model_def.sd_model,
         )
         # video_output = create_video(video_container)  # for synchronous testing
         if task is None:
             itask.cancel()
+            if preview is not None:
+                preview.close()
             await response.edit_original_response(
                 content="Task queue is full. Please try again later.",
                 delete_after=4,
             )
             return
 
-        video_container.image: ImageFile = await task.wait_result()
+        video_container.image: ImageFile = await wait_for_task(task, response, itask)
+        if preview is not None:
+            preview.close()
+        if video_container.image is None:
+            return
         if video_container.image.file_size > 25 * 2**20:
             itask.cancel()
             await response.edit_original_response(
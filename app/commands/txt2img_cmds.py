@@ -137,6 +137,8 @@ class Txt2ImageCommands(TxtCommandsMixin):
             workflow_api_map_file=model_def.workflow_api_map,
             orientation=orientation,
         )
+        if images is None:
+            return
 
         command_name = (
             f"{Settings.server.bot_command}.{GroupCommands.txt2img.name}.image"
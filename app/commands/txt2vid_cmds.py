@@ -148,6 +148,8 @@ class Txt2Video1StepCommands(TxtCommandsMixin):
             workflow_api_map_file=model_def.workflow_api_map,
             orientation=orientation,
         )
+        if images is None:
+            return
 
         command_name = f"{Settings.server.bot_command}.{GroupCommands.txt2vid1step.name}.{ctx.command.name}"
 
@@ -307,6 +309,8 @@ class Txt2Video2StepCommands(TxtCommandsMixin):
             workflow_api_map_file=model_def.preview_workflow_api_map,
             orientation=orientation,
         )
+        if images is None:
+            return
 
         command_name = (
             f"{Settings.server.bot_command}.{GroupCommands.txt2img.name}.image"
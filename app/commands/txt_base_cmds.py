@@ -1,11 +1,13 @@
 import os
 import discord
 import asyncio
-from typing import List, Tuple, Optional, cast
+from typing import List, Tuple, Optional
 from app.sd_apis.api_handler import Sd
-from app.utils.async_task_queue import AsyncTaskQueue, Task
+from app.utils.async_task_queue import AsyncTaskQueue
 from app.utils.helpers import random_seed, load_workflow_and_map, CARDINALS
 from app.utils import GeneratePrompt, Orientation, ImageCount, PromptConstants
+from app.utils.content_filter import ContentFilter
+from app.utils.prompt_pool import PromptPool
 from app.settings import (
     Settings,
     Txt2ImgSingleModel,
@@ -14,7 +16,16 @@ from app.settings import (
 )
 from app.utils.image_file import ImageFile, ImageContainer, VideoContainer
 from app.views.generate_image import GenerateImageView
-from app.views.view_helpers import create_image, create_animation
+from app.views.view_helpers import (
+    create_image,
+    create_image_batch,
+    image_batch_key,
+    create_animation,
+    wait_for_tasks,
+    IncrementalDelivery,
+    LivePreview,
+)
+from app.sd_apis.abstract_api import PreviewCallback
 from .abstract_command import AbstractCommand
 
 
@@ -29,37 +40,45 @@ async def process_image(
     response: discord.ApplicationContext,
 ) -> ImageContainer:
     image.image: ImageFile = await asyncio.to_thread(create_image, image, Sd.api)
+    await report_progress(i, n_images, response)
+    return image
+
+
+# batch version of process_image, compatible tasks merged by the task queue
+async def process_image_batch(calls: List[tuple]) -> List[ImageContainer]:
+    images = [image for _, image, _, _ in calls]
+    image_files = await asyncio.to_thread(create_image_batch, images, Sd.api)
+    for (i, image, n_images, response), image_file in zip(calls, image_files):
+        image.image = image_file
+        await report_progress(i, n_images, response)
+    return images
+
 
+async def report_progress(
+    i: int, n_images: int, response: discord.ApplicationContext, kind: str = "image"
+):
     cardinal = CARDINALS[min(i, len(CARDINALS) - 1)]
     percent = int((i + 1) / n_images * 100)
     try:
         await response.edit_original_response(
-            content=f"Generated the {cardinal} image...({percent}%)"
+            content=f"Generated the {cardinal} {kind}...({percent}%)"
         )
     except discord.errors.NotFound:
         pass
 
-    return image
-
 
 async def process_animation(
     i: int,
     image: ImageContainer | VideoContainer,
     n_images: int,
     response: discord.ApplicationContext,
+    on_preview: PreviewCallback = None,
 ) -> ImageContainer:
-    # image.image: ImageFile = await asyncio.to_thread(create_animation, image, Sd.api)
-    image.image: ImageFile = create_animation(image, Sd.api)
-
-    cardinal = CARDINALS[min(i, len(CARDINALS) - 1)]
-    percent = int((i + 1) / n_images * 100)
-    try:
-        await response.edit_original_response(
-            content=f"Generated the {cardinal} animation...({percent}%)"
-        )
-    except discord.errors.NotFound:
-        pass
-
+    # in a thread, the event loop sends the previews while the animation is generated
+    image.image: ImageFile = await asyncio.to_thread(
+        create_animation, image, Sd.api, on_preview
+    )
+    await report_progress(i, n_images, response, "animation")
     return image
 
 
@@ -68,6 +87,27 @@ async def process_animation(
 # -------------------------------
 class TxtCommandsMixin(AbstractCommand):
 
+    # -------------------------------
+    # _filter_prompt
+    # -------------------------------
+    # returns the prompt, without the disallowed words (content_filter_action
+    # "remove"), or (None, response) when the prompt was rejected
+    async def _filter_prompt(
+        self, ctx: discord.ApplicationContext, prompt: str
+    ) -> Tuple[Optional[str], Optional[discord.ApplicationContext]]:
+        found = ContentFilter.check(prompt)
+        if not found:
+            return prompt, None
+        if Settings.server.content_filter_action == "remove":
+            return ContentFilter.remove(prompt), None
+
+        response = await ctx.respond(
+            f"Your prompt contains words that are not allowed: {', '.join(found)}",
+            ephemeral=True,
+            delete_after=30,
+        )
+        return None, response
+
     # -------------------------------
     # _random_image
     # -------------------------------
@@ -91,6 +131,7 @@ class TxtCommandsMixin(AbstractCommand):
         )
 
         n_images = model_def.n_images
+        random_prompts = await asyncio.to_thread(PromptPool.take, n_images)
         title_prompts: List[str] = []
         tasks = []
         for i in range(n_images):
@@ -102,7 +143,7 @@ class TxtCommandsMixin(AbstractCommand):
                 workflow=workflow,
                 workflow_map=workflow_map,
             )
-            image.prompt, image.negative_prompt = GeneratePrompt().make_random_prompt()
+            image.prompt, image.negative_prompt = random_prompts[i]
 
             if model_def.width == model_def.height:
                 image.width, image.height = Orientation.make_orientation(
@@ -115,6 +156,9 @@ class TxtCommandsMixin(AbstractCommand):
                 process_image,
                 args=(i, image, n_images, response),
                 task_owner=ctx.author.id,
+                affinity_key=model_def.sd_model,
+                batch_key=image_batch_key(image, workflow_api_file),
+                batch_func=process_image_batch,
             )
             if task is not None:
                 tasks.append(task)
@@ -126,17 +170,15 @@ class TxtCommandsMixin(AbstractCommand):
                 return None, None, response
 
         # wait for all tasks to complete
-        images: List[ImageContainer] = []
-        for task in tasks:
-            task = cast(Task, task)
-            image: ImageContainer = await task.wait_result()
+        images: List[ImageContainer] = await wait_for_tasks(
+            tasks, response, delivery=IncrementalDelivery.create(response, n_images)
+        )
+        if images is None:
+            return None, None, response
+        for image in images:
             title_prompts.append(
                 image.prompt if len(image.prompt) < 150 else image.prompt[:150] + "..."
             )
-            images.append(image)
-            self.logger.info(
-                f"Generated Image {ImageCount.increment()}: {os.path.basename(image.image.image_filename)}"
-            )
 
         return images, title_prompts, response
 
@@ -163,9 +205,11 @@ class TxtCommandsMixin(AbstractCommand):
         )
 
         n_images = model_def.n_images
+        random_prompts = await asyncio.to_thread(PromptPool.take, n_images)
         title_prompts: List[str] = []
         tasks = []
         # anis = []
+        preview = LivePreview.create(response)
         for i in range(n_images):
             in_animation = VideoContainer(
                 model_def=model_def,
@@ -175,9 +219,7 @@ class TxtCommandsMixin(AbstractCommand):
                 workflow=workflow,
                 workflow_map=workflow_map,
             )
-            in_animation.prompt, in_animation.negative_prompt = (
-                GeneratePrompt().make_random_prompt()
-            )
+            in_animation.prompt, in_animation.negative_prompt = random_prompts[i]
 
             if model_def.width == model_def.height or orientation is not None:
                 in_animation.width, in_animation.height = Orientation.make_orientation(
@@ -192,12 +234,16 @@ class TxtCommandsMixin(AbstractCommand):
             task = await AsyncTaskQueue.create_and_add_task(
                 process_animation,
                 args=(i, in_animation, n_images, response),
+                kwargs={"on_preview": preview},
                 task_owner=ctx.author.id,
+                affinity_key=model_def.sd_model,
             )
             if task is not None:
                 tasks.append(task)
             else:
                 self.logger.error(f"Failed to create task {i+1}, queue full")
+                if preview is not None:
+                    preview.close()  # for the tasks already queued
                 await response.edit_original_response(
                     content=f"Failed to create task {i+1}, queue full", delete_after=4
                 )
@@ -206,20 +252,17 @@ class TxtCommandsMixin(AbstractCommand):
             # anis.append(ani)
 
         # wait for all tasks to complete
-        animations: List[VideoContainer] = []
-        for task in tasks:
-            task = cast(Task, task)
-            animation: VideoContainer = await task.wait_result()
+        animations: List[VideoContainer] = await wait_for_tasks(tasks, response, "Video")
+        if preview is not None:
+            preview.close()
+        if animations is None:
+            return None, None, response
+        for animation in animations:
             title_prompts.append(
                 animation.prompt
                 if len(animation.prompt) < 150
                 else animation.prompt[:150] + "..."
             )
-            animations.append(animation)
-            self.logger.info(
-                f"Generated Video {ImageCount.increment()}: {os.path.basename(animation.image.image_filename)}"
-            )
-
         return animations, title_prompts, response
 
     # -------------------------------
@@ -237,6 +280,11 @@ class TxtCommandsMixin(AbstractCommand):
         negative_prompt: str,
     ) -> Tuple[ImageContainer, discord.ApplicationContext]:
 
+        # disallowed prompts are refused before they take a queue slot
+        prompt, response = await self._filter_prompt(ctx, prompt)
+        if prompt is None:
+            return None, response
+
         response = await ctx.respond(
             f"Generating {model_def.n_images} images...waiting to start",
             ephemeral=True,
@@ -248,16 +296,6 @@ class TxtCommandsMixin(AbstractCommand):
             workflow_api_map_file=workflow_api_map_file,
         )
 
-        banned_words = [
-            "nude",
-            "naked",
-            "nsfw",
-            "porn",
-        ]  # The most professional nsfw filter lol
-        prompt = " ".join(
-            [w for w in prompt.split(" ") if w.lower() not in banned_words]
-        )
-
         if model_def.width == model_def.height:
             width, height = Orientation.make_orientation(orientation, model_def.width)
         else:
@@ -290,6 +328,9 @@ class TxtCommandsMixin(AbstractCommand):
                 process_image,
                 args=(i, image, n_images, response),
                 task_owner=ctx.author.id,
+                affinity_key=model_def.sd_model,
+                batch_key=image_batch_key(image, workflow_api_file),
+                batch_func=process_image_batch,
             )
             if task is not None:
                 tasks.append(task)
@@ -301,15 +342,9 @@ class TxtCommandsMixin(AbstractCommand):
                 return None, response
 
         # wait for all tasks to complete
-        images: List[ImageContainer] = []
-        for task in tasks:
-            task = cast(Task, task)
-            image: ImageContainer = await task.wait_result()
-            images.append(image)
-            self.logger.info(
-                f"Generated Image {ImageCount.increment()}: {os.path.basename(image.image.image_filename)}"
-            )
-
+        images: List[ImageContainer] = await wait_for_tasks(
+            tasks, response, delivery=IncrementalDelivery.create(response, n_images)
+        )
         return images, response
 
     # -------------------------------
@@ -327,6 +362,11 @@ class TxtCommandsMixin(AbstractCommand):
         negative_prompt: str,
     ) -> Tuple[ImageContainer, discord.ApplicationContext]:
 
+        # disallowed prompts are refused before they take a queue slot
+        prompt, response = await self._filter_prompt(ctx, prompt)
+        if prompt is None:
+            return None, response
+
         response = await ctx.respond(
             f"Generating {model_def.n_images} animations...waiting to start",
             ephemeral=True,
@@ -338,16 +378,6 @@ class TxtCommandsMixin(AbstractCommand):
             workflow_api_map_file=workflow_api_map_file,
         )
 
-        banned_words = [
-            "nude",
-            "naked",
-            "nsfw",
-            "porn",
-        ]  # The most professional nsfw filter lol
-        prompt = " ".join(
-            [w for w in prompt.split(" ") if w.lower() not in banned_words]
-        )
-
         if model_def.width == model_def.height:
             width, height = Orientation.make_orientation(orientation, model_def.width)
         else:
@@ -362,6 +392,7 @@ class TxtCommandsMixin(AbstractCommand):
 
         tasks = []
         n_images = model_def.n_images
+        preview = LivePreview.create(response)
         for i in range(model_def.n_images):
             animation = VideoContainer(
                 model_def=model_def,
@@ -381,25 +412,23 @@ class TxtCommandsMixin(AbstractCommand):
             task = await AsyncTaskQueue.create_and_add_task(
                 process_animation,
                 args=(i, animation, n_images, response),
+                kwargs={"on_preview": preview},
                 task_owner=ctx.author.id,
+                affinity_key=model_def.sd_model,
             )
             if task is not None:
                 tasks.append(task)
             else:
                 self.logger.error(f"Failed to create task {i+1}, queue full")
+                if preview is not None:
+                    preview.close()  # for the tasks already queued
                 await response.edit_original_response(
                     content=f"Failed to create task {i+1}, queue full", delete_after=4
                 )
                 return None, response
 
         # wait for all tasks to complete
-        animations: List[VideoContainer] = []
-        for task in tasks:
-            task = cast(Task, task)
-            animation: ImageContainer = await task.wait_result()
-            animations.append(animation)
-            self.logger.info(
-                f"Generated Image {ImageCount.increment()}: {os.path.basename(animation.image.image_filename)}"
-            )
-
+        animations: List[VideoContainer] = await wait_for_tasks(tasks, response)
+        if preview is not None:
+            preview.close()
         return animations, response
@@ -1,5 +1,14 @@
 from .abstract_api import AbstractAPI
 from .a1111_api import A1111API
 from .comfyUI_api import ComfyUIAPI
+from .backend_pool import BackendPool
+from .backend_health import BackendHealth, BackendUnavailableError
 
-__all__ = ["AbstractAPI", "A1111API", "ComfyUIAPI"]
+__all__ = [
+    "AbstractAPI",
+    "A1111API",
+    "ComfyUIAPI",
+    "BackendPool",
+    "BackendHealth",
+    "BackendUnavailableError",
+]
@@ -1,26 +1,259 @@
 import io
-import requests
+import json
 import base64
-from typing import List, Tuple
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+import aiohttp
 from PIL import Image, PngImagePlugin
 
 from . import AbstractAPI
-from app.settings import Settings
+from .abstract_api import PreviewCallback
+from app.settings import Settings, ModelType
 from app.utils.image_file import ImageFile
+from .backend_health import is_backend_error
+from .timeouts import Deadline, DeadlineExceededError, job_budget, retry_call
 
 
 # Defines the SD API handler for A1111
+# - requests go through one pooled aiohttp session per host, running on a private
+#   event loop thread (the api methods are called from the task queue threads)
+# - the generation parameters are read from the `info` field of the txt2img
+#   response (no png-info round trip re-uploading the image)
+# - while a job runs, /progress is polled for the step and the live preview image
+#   (only with an on_preview callback), the job is interrupted on the host when
+#   the bot gives up on it (deadline, cancelled request)
 class A1111API(AbstractAPI):
+    def __init__(self, webui_url: str, *args, **kwargs):
+        super().__init__(webui_url, *args, **kwargs)
+        self._loop: asyncio.AbstractEventLoop = None
+        self._loop_thread: threading.Thread = None
+        self._session: aiohttp.ClientSession = None
+        self._loop_lock = threading.Lock()
+        self._upscaler_model: Optional[str] = None
+
+    # ---------------------------------------
+    # pooled async session
+    # ---------------------------------------
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name=f"a1111-{self.webui_url}",
+                    daemon=True,
+                )
+                self._loop_thread.start()
+            return self._loop
+
+    def _run(self, coro):
+        # runs a coroutine on the session loop, blocking the calling thread
+        return asyncio.run_coroutine_threadsafe(coro, self._event_loop()).result()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=f"http://{self.webui_url}",
+                connector=aiohttp.TCPConnector(limit=Settings.server.http_pool_size or 0),
+            )
+        return self._session
+
+    @staticmethod
+    def _timeout(read_timeout: Optional[float]) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            sock_connect=Settings.server.request_timeout or None,
+            sock_read=read_timeout,
+        )
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> Any:
+        session = await self._get_session()
+        timeout = timeout or self._timeout(Settings.server.request_timeout or None)
+        async with session.request(method, path, json=payload, timeout=timeout) as res:
+            res.raise_for_status()
+            return await res.json()
+
+    def _get(self, path: str, deadline: Optional[Deadline] = None) -> Any:
+        # GET requests are idempotent, retried on transient host errors
+        deadline = deadline or Deadline(None)
+        return retry_call(
+            lambda: self._run(
+                self._request("GET", path, timeout=self._timeout(deadline.timeout()))
+            ),
+            retry_on=is_backend_error,
+            deadline=deadline,
+            what=f"GET {self.webui_url}{path}",
+        )
+
+    def _post(self, path: str, payload: Dict, deadline: Deadline) -> Any:
+        # not retried: the host may be generating already (read timeout=the job deadline)
+        return self._run(
+            self._request("POST", path, payload, self._timeout(deadline.remaining))
+        )
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            self._run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(10)
+        self._loop = self._session = None
+
+    # ---------------------------------------
+    # progress / interrupt
+    # ---------------------------------------
+    def get_status(self, request=None) -> Dict:
+        # progress of the running job (without the preview image)
+        return self._get("/sdapi/v1/progress?skip_current_image=true")
+
+    async def _interrupt(self):
+        # A1111 runs one job at a time, the interrupt stops the running one
+        try:
+            await self._request("POST", "/sdapi/v1/interrupt")
+        except Exception as e:
+            self._logger.warning(f"Could not interrupt the job on {self.webui_url}: {e}")
+
+    def interrupt(self):
+        self._run(self._interrupt())
+
+    async def _poll_progress(self, on_preview: PreviewCallback):
+        # adaptive rate: fast while the steps advance (about ten polls over the
+        # remaining time), slowing down while the job waits or loads a model
+        server = Settings.server
+        poll_min = server.progress_poll_min or 0.1
+        poll_max = max(server.progress_poll_max or poll_min, poll_min)
+        loop = asyncio.get_running_loop()
+        interval, last_step, last_image = poll_min, None, None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                progress = await self._request(
+                    "GET", "/sdapi/v1/progress?skip_current_image=false"
+                )
+            except Exception:
+                interval = poll_max
+                continue
+
+            state = progress.get("state") or {}
+            step = (state.get("sampling_step"), state.get("sampling_steps"))
+            image = progress.get("current_image")
+            if image and image != last_image:
+                last_image = image
+                # decoded (and passed on) in a thread, not on the session loop
+                await loop.run_in_executor(None, self._send_preview, on_preview, image, step)
+
+            if step != last_step and step[0]:
+                eta = progress.get("eta_relative") or 0
+                interval = min(max(eta / 10, poll_min), poll_max)
+            else:
+                interval = min(interval * 1.5, poll_max)
+            last_step = step
+
+    def _send_preview(self, on_preview: PreviewCallback, image_b64: str, step: tuple):
+        try:
+            on_preview(base64.b64decode(image_b64.split(",", 1)[-1]), "png", step)
+        except Exception as e:
+            self._logger.warning(f"Preview callback failed: {e}")
+
+    async def _txt2img(
+        self, payload: Dict, deadline: Deadline, on_preview: Optional[PreviewCallback]
+    ) -> Dict:
+        poll = asyncio.ensure_future(self._poll_progress(on_preview)) if on_preview else None
+        try:
+            return await self._request(
+                "POST", "/sdapi/v1/txt2img", payload, self._timeout(deadline.remaining)
+            )
+        except asyncio.TimeoutError:
+            # the read timeout is the job deadline (else a connect timeout)
+            if not deadline.expired:
+                raise
+            await self._interrupt()
+            raise DeadlineExceededError(
+                f"Job on SD host {self.webui_url} exceeded its deadline of "
+                f"{deadline.seconds:.0f}s"
+            )
+        except asyncio.CancelledError:
+            await self._interrupt()
+            raise
+        finally:
+            if poll is not None:
+                poll.cancel()
+
+    # ---------------------------------------
+    # models
+    # ---------------------------------------
+    @staticmethod
+    def _checkpoint_names(models: List[Dict]) -> List[str]:
+        # the title is "<file name> [<hash>]", sub-folders are kept
+        return [m["title"].split(" [")[0] for m in models]
+
+    @staticmethod
+    def _lora_names(loras: List[Dict]) -> List[str]:
+        return [l["name"] for l in loras]
+
+    @staticmethod
+    def _upscaler_names(upscalers: List[Dict]) -> List[str]:
+        return [u["name"] for u in upscalers if u.get("name") not in (None, "None")]
+
     def get_checkpoint_names(self) -> List[str]:
-        raise NotImplementedError("API function incomplete") 
+        return self._checkpoint_names(self._get("/sdapi/v1/sd-models"))
 
     def get_lora_names(self) -> List[str]:
-        raise NotImplementedError("API function incomplete")
+        return self._lora_names(self._get("/sdapi/v1/loras"))
 
     def get_upscaler_names(self) -> List[str]:
-        raise NotImplementedError("API function incomplete")
+        return self._upscaler_names(self._get("/sdapi/v1/upscalers"))
 
-    def generate_image(
+    def get_model_names(self) -> Dict[str, List[str]]:
+        # the three lists are fetched concurrently
+        async def get_all():
+            return await asyncio.gather(
+                self._request("GET", "/sdapi/v1/sd-models"),
+                self._request("GET", "/sdapi/v1/loras"),
+                self._request("GET", "/sdapi/v1/upscalers"),
+            )
+
+        models, loras, upscalers = retry_call(
+            lambda: self._run(get_all()),
+            retry_on=is_backend_error,
+            what=f"GET {self.webui_url} models",
+        )
+        return {
+            ModelType.checkpoint.value: self._checkpoint_names(models),
+            ModelType.lora.value: self._lora_names(loras),
+            ModelType.upscaler.value: self._upscaler_names(upscalers),
+        }
+
+    # ---------------------------------------
+    # generation
+    # ---------------------------------------
+    @staticmethod
+    def _save_image(image_b64: str, infotext: Optional[str]) -> ImageFile:
+        image_bytes = base64.b64decode(image_b64.split(",", 1)[-1])
+        image = ImageFile()
+        filename = image.create_file_name()
+        with Image.open(io.BytesIO(image_bytes)) as pil_image:
+            has_info = "parameters" in pil_image.info
+            if has_info or not infotext:
+                # the host already wrote the parameters, store the file as is
+                with open(filename, "wb") as f:
+                    f.write(image_bytes)
+            else:
+                pnginfo = PngImagePlugin.PngInfo()
+                pnginfo.add_text("parameters", infotext)
+                pil_image.save(filename, format="PNG", pnginfo=pnginfo)
+        image.load()
+        return image
+
+    def generate_images(
         self,
         prompt: str,
         negativeprompt: str,
@@ -29,8 +262,12 @@ class A1111API(AbstractAPI):
         variation_strength: float = 0.0,
         width: int = 512,
         height: int = 512,
-        sd_model: str = "v1-5-pruned-emaonly.ckpt",
-    ) -> Tuple[ImageFile, PngImagePlugin.PngInfo]:
+        sd_model: Optional[str] = None,
+        n_iter: int = 1,
+        batch_size: int = 1,
+        on_preview: Optional[PreviewCallback] = None,
+    ) -> List[ImageFile]:
+        # n_iter batches of batch_size images, the seeds increase per image
         payload = {
             "prompt": prompt,
             "negative_prompt": negativeprompt,
@@ -40,56 +277,80 @@ class A1111API(AbstractAPI):
             "cfg_scale": 7,
             "sampler_name": "Euler",
             "seed": seed,
+            "subseed": sub_seed,
+            "subseed_strength": variation_strength or 0.0,
+            "n_iter": n_iter,
+            "batch_size": batch_size,
             "tiling": False,
             "restore_faces": True,
-            "variation_strength": variation_strength,
         }
+        if sd_model:
+            payload["override_settings"] = {"sd_model_checkpoint": sd_model}
 
-        response = requests.post(
-            url=f"http://{self.webui_url}/sdapi/v1/txt2img", json=payload
-        )
-        img_json = response.json()["images"][0]
-        pil_image_object = Image.open(
-            io.BytesIO(base64.b64decode(img_json.split(",", 1)[0]))
-        )
-        png_payload = {"image": "data:image/png;base64," + img_json}
-        response = requests.post(
-            url=f"http://{self.webui_url}/sdapi/v1/png-info", json=png_payload
-        )
-        pnginfo = PngImagePlugin.PngInfo()
-        pnginfo.add_text("parameters", response.json().get("info"))
-        image = ImageFile()
-        pil_image_object.save(image.create_file_name(), format="PNG", pnginfo=pnginfo)
-        image.load()
+        n_images = max(n_iter, 1) * max(batch_size, 1)
+        deadline = Deadline(job_budget(width, height, n_images))
+        response = self._run(self._txt2img(payload, deadline, on_preview))
 
-        return image
+        try:
+            infotexts = json.loads(response.get("info") or "{}").get("infotexts", [])
+        except ValueError:
+            infotexts = []
+        # a grid of the batch is returned first (if enabled on the host)
+        images = response["images"]
+        skip = max(len(images) - n_images, 0)
+        return [
+            self._save_image(
+                image_b64, infotexts[i] if i < len(infotexts) else None
+            )
+            for i, image_b64 in enumerate(images)
+            if i >= skip
+        ]
+
+    def generate_image(
+        self,
+        *,
+        prompt: Optional[str] = None,
+        negativeprompt: Optional[str] = None,
+        seed: Optional[int] = None,
+        sub_seed: Optional[int] = None,
+        variation_strength: Optional[float] = None,
+        width: Optional[int] = 512,
+        height: Optional[int] = 512,
+        sd_model: Optional[str] = None,
+        image_file: Optional[str] = None,
+        video_format: Optional[str] = None,
+        on_preview: Optional[PreviewCallback] = None,
+        **kwargs,  # ComfyUI workflow settings, not used by A1111
+    ) -> ImageFile:
+        if image_file is not None or video_format is not None:
+            raise NotImplementedError("A1111 backend supports txt2img only")
+        return self.generate_images(
+            prompt=prompt,
+            negativeprompt=negativeprompt,
+            seed=seed,
+            sub_seed=sub_seed,
+            variation_strength=variation_strength,
+            width=width or 512,
+            height=height or 512,
+            sd_model=sd_model,
+            on_preview=on_preview,
+        )[0]
 
     def set_upscaler_model(self, upscaler_model: str) -> bool:
         try:
-            res = requests.get(f"http://{self.webui_url}/sdapi/v1/upscalers")
-            if res.status_code == 200:
-                upscalers = [r["name"] for r in res.json()]
-                if upscaler_model in upscalers:
-                    self._upscaler_model = upscaler_model
-                    self._logger.info(f"Using upscaler model: '{upscaler_model}'")
-                    return True
-                else:
-                    self._upscaler_model = Settings.txt2img.upscaler_model
-                    self._logger.warn(
-                        f"Specified upscaler model '{upscaler_model}' not found, using '{Settings.txt2img.upscaler_model}'"
-                    )
-                    return True
-            else:
-                self._logger.error(
-                    f"Did not receive correct response from SD host: {self.webui_url}\n"
-                    f"Response code={res.status_code}"
-                )
-                return False
-        except requests.ConnectionError as e:
-            self._logger.error(
-                f"Failed to connect to SD host; possibly incorrect URL:\n", e
-            )
+            upscalers = self.get_upscaler_names()
+        except Exception as e:
+            self._logger.error(f"Failed to read the upscalers of SD host {self.webui_url}: {e}")
             return False
+        if upscaler_model in upscalers or not upscalers:
+            self._upscaler_model = upscaler_model
+            self._logger.info(f"Using upscaler model: '{upscaler_model}'")
+        else:
+            self._upscaler_model = upscalers[0]
+            self._logger.warning(
+                f"Specified upscaler model '{upscaler_model}' not found, using '{upscalers[0]}'"
+            )
+        return True
 
     def upscale_image(self, image: ImageFile):
         image_b64 = image.to_b64()
@@ -100,20 +361,15 @@ class A1111API(AbstractAPI):
             "gfpgan_visibility": 0.6,
             "codeformer_visibility": 0,
             "codeformer_weight": 0,
-            "upscaler_1": Settings.txt2img.upscaler_model,
+            "upscaler_1": self._upscaler_model,
             "image": image_b64,
         }
-        response_upscaled = requests.post(
-            url=f"http://{self.webui_url}/sdapi/v1/extra-single-image",
-            json=upscale_payload,
+        r_u = self._post(
+            "/sdapi/v1/extra-single-image", upscale_payload, Deadline(job_budget())
         )
-        r_u = response_upscaled.json()
         image_upscaled = ImageFile()
         image_upscaled.from_b64(r_u["image"])
         file_path = image.image_filename.replace(".png", "-upscaled.png")
         image_upscaled.save(file_path)
 
         return image_upscaled
-
-    def get_status(self, request):
-        pass
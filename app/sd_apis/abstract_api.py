@@ -2,16 +2,21 @@
 import requests
 import logging
 from abc import ABC, abstractmethod
-from typing import Tuple, List, Optional, Dict
+from typing import Callable, Tuple, List, Optional, Dict
 from PIL import Image, PngImagePlugin
 
-from app.settings import Settings
+from app.settings import Settings, ModelType
 from app.utils.image_file import ImageFile
 from app.utils.image_count import ImageCount
 from app.utils.log_helper import LogOnce
 from app.utils.logger import logger
 
 
+# called from the api thread with (image bytes, extension, (step, steps) or None)
+# for the previews of a running job
+PreviewCallback = Callable[[bytes, str, Optional[Tuple[int, int]]], None]
+
+
 class AbstractAPI(ABC):
 
     def __init__(self, webui_url: str, logger: logging.Logger = logger):
@@ -30,6 +35,15 @@ class AbstractAPI(ABC):
     def get_upscaler_names(self) -> List[str]:
         pass
 
+    def get_model_names(self) -> Dict[str, List[str]]:
+        # all model names of the host, keyed by ModelType value
+        # (apis can override this to fetch the lists in a single request)
+        return {
+            ModelType.checkpoint.value: self.get_checkpoint_names(),
+            ModelType.lora.value: self.get_lora_names(),
+            ModelType.upscaler.value: self.get_upscaler_names(),
+        }
+
     @abstractmethod
     def set_upscaler_model(self, upscaler_model: str) -> bool:
         pass
@@ -56,9 +70,15 @@ class AbstractAPI(ABC):
         workflow: Optional[Dict] = None,
         workflow_map: Optional[Dict] = None,
         animation_model: Optional[str] = None,
+        on_preview: Optional[PreviewCallback] = None,
     ) -> ImageFile:
         pass
 
+    def generate_image_batch(self, requests: List[Dict]) -> List[ImageFile]:
+        # one image per request (generate_image keyword arguments), used for
+        # batches of compatible jobs (apis can override this to run them at once)
+        return [self.generate_image(**kwargs) for kwargs in requests]
+
     @abstractmethod
     def upscale_image(self, image: ImageFile) -> ImageFile:
         pass
@@ -67,23 +87,26 @@ class AbstractAPI(ABC):
     def get_status(self, request):
         pass
 
-    def check_sd_host(self) -> bool:
-        # check SD URL
+    def check_sd_host(self, timeout: Optional[float] = None, log: bool = True) -> bool:
+        # check SD URL (log=False for periodic health probes)
         try:
-            res = requests.get(f"http://{self.webui_url}")
+            res = requests.get(f"http://{self.webui_url}", timeout=timeout)
             if res.status_code == 200:
-                self._logger.info(f"Connected to SD host on URL: {self.webui_url}")
+                if log:
+                    self._logger.info(f"Connected to SD host on URL: {self.webui_url}")
                 return True
             else:
+                if log:
+                    self._logger.error(
+                        f"Did not receive correct response from SD host: {self.webui_url}\n"
+                        f"Response code={res.status_code}"
+                    )
+                return False
+        except requests.RequestException as e:
+            if log:
                 self._logger.error(
-                    f"Did not receive correct response from SD host: {self.webui_url}\n"
-                    f"Response code={res.status_code}"
+                    f"Failed to connect to SD host; possibly incorrect URL:\n{e}"
                 )
-                return False
-        except requests.ConnectionError as e:
-            self._logger.error(
-                f"Failed to connect to SD host; possibly incorrect URL:\n", e
-            )
             return False
 
     def save_image(self, image_file: ImageFile, pnginfo: PngImagePlugin.PngInfo):
@@ -1,7 +1,10 @@
 from .abstract_api import AbstractAPI
 from .a1111_api import A1111API
 from .comfyUI_api import ComfyUIAPI
-from typing import Optional
+from .model_inventory import ModelInventory
+from .backend_pool import BackendPool
+from app.settings import Settings, BackendModel, ModelType
+from typing import Dict, List, Optional
 
 __all__ = ["Sd"]
 
@@ -17,27 +20,52 @@ class _Sd:
         if webui_url and api_type:
             self.api_configure(webui_url, api_type)
 
+    @staticmethod
+    def create_api(webui_url: str, api_type: str) -> AbstractAPI:
+        if api_type == "a1111":
+            return A1111API(webui_url)
+        elif api_type == "comfyUI":
+            return ComfyUIAPI(webui_url)
+        else:
+            raise ValueError(f"Invalid SD_API: {api_type}")
+
     def api_configure(self, webui_url: str, api_type: str):
         self.webui_url = webui_url
         self.api_type = api_type
+        self.api: AbstractAPI = self.create_api(webui_url, api_type)
+        self.apis: Dict[str, AbstractAPI] = {webui_url: self.api}
 
-        if self.api_type == "a1111":
-            self.api: AbstractAPI = A1111API(webui_url)
-        elif self.api_type == "comfyUI":
-            self.api: AbstractAPI = ComfyUIAPI(webui_url)
-        else:
-            raise ValueError(f"Invalid SD_API: {api_type}")
+    def configure_backends(self, backends: List[BackendModel]):
+        # one api per SD host, with multiple hosts (or health checks) `api` routes
+        # the requests over all hosts (BackendPool, skips hosts that are down)
+        if not backends:
+            raise ValueError("No SD backends defined")
+        self.api_configure(backends[0].url, backends[0].sd_api_type)
+        for backend in backends[1:]:
+            if backend.url not in self.apis:
+                self.apis[backend.url] = self.create_api(
+                    backend.url, backend.sd_api_type
+                )
+        if len(self.apis) > 1 or Settings.server.health_check_interval:
+            self.api = BackendPool(self.apis)
 
     def get_api_list(self):
         return ["a1111", "comfyUI"]
 
+    # model names of all discovered hosts (falls back to querying the default host)
     def get_valid_checkpoints(self):
+        if len(ModelInventory):
+            return ModelInventory.names(ModelType.checkpoint)
         return self.api.get_checkpoint_names()
 
     def get_valid_loras(self):
+        if len(ModelInventory):
+            return ModelInventory.names(ModelType.lora)
         return self.api.get_lora_names()
 
     def get_valid_upscalers(self):
+        if len(ModelInventory):
+            return ModelInventory.names(ModelType.upscaler)
         return self.api.get_upscaler_names()
 
 
@@ -0,0 +1,270 @@
+import time
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import aiohttp
+import requests
+import websocket
+
+from app.settings import Settings
+from app.utils.logger import logger
+from .abstract_api import AbstractAPI
+from .timeouts import DeadlineExceededError
+
+__all__ = [
+    "CircuitState",
+    "BackendUnavailableError",
+    "CircuitBreaker",
+    "BackendHealth",
+    "is_backend_error",
+]
+
+
+class CircuitState:
+    CLOSED = "CLOSED"  # healthy, all jobs pass
+    OPEN = "OPEN"  # down, no jobs pass
+    HALF_OPEN = "HALF_OPEN"  # recovering, a growing number of jobs pass
+
+
+class BackendUnavailableError(ConnectionError):
+    # raised when no SD host with the model is healthy (circuit open)
+    pass
+
+
+def is_backend_error(e: Exception) -> bool:
+    # connection level errors count against the host, errors of the job
+    # itself (e.g. HTTP 4xx for an invalid workflow, a job past its deadline) do not
+    if isinstance(e, DeadlineExceededError):
+        return False
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code >= 500
+    if isinstance(e, requests.HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(
+        e,
+        (
+            OSError,
+            requests.RequestException,
+            websocket.WebSocketException,
+            aiohttp.ClientError,
+        ),
+    )
+
+
+# Circuit breaker of a single SD host
+# - CLOSED -> OPEN after `failure_threshold` consecutive failures (jobs or probes)
+# - OPEN: jobs are not sent to the host; after `open_seconds` (or a successful
+#   health probe) the host is HALF_OPEN
+# - HALF_OPEN: the host gets 1, 2, 4, ... jobs in flight with each success, it is
+#   CLOSED after `ramp_successes` successes; a failure opens it again with twice
+#   the open time (up to `max_open_seconds`)
+class CircuitBreaker:
+    def __init__(
+        self,
+        url: str,
+        failure_threshold: int = 3,
+        open_seconds: float = 5.0,
+        max_open_seconds: float = 120.0,
+        ramp_successes: int = 3,
+    ):
+        self.url = url
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self.ramp_successes = max(1, ramp_successes)
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._successes = 0
+        self._opened_at = 0.0
+        self._open_for = open_seconds
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<CircuitBreaker {self.url} state={self.state}>"
+
+    @classmethod
+    def from_settings(cls, url: str) -> "CircuitBreaker":
+        server = Settings.server
+        return cls(
+            url,
+            failure_threshold=server.breaker_failure_threshold or 1,
+            open_seconds=server.breaker_open_seconds or 0.0,
+            max_open_seconds=server.breaker_max_open_seconds or 0.0,
+            ramp_successes=server.breaker_ramp_successes or 1,
+        )
+
+    def _update(self, now: Optional[float] = None):
+        # OPEN -> HALF_OPEN once the open time passed (lock held)
+        now = now or time.monotonic()
+        if self._state == CircuitState.OPEN and now - self._opened_at >= self._open_for:
+            self._state = CircuitState.HALF_OPEN
+            self._successes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update()
+            return self._state
+
+    @property
+    def capacity(self) -> Optional[int]:
+        # jobs in flight allowed on the host, None=unlimited
+        with self._lock:
+            self._update()
+            if self._state == CircuitState.CLOSED:
+                return None
+            if self._state == CircuitState.OPEN:
+                return 0
+            return 2**self._successes
+
+    def allow(self, in_flight: int = 0) -> bool:
+        capacity = self.capacity
+        return capacity is None or in_flight < capacity
+
+    def _open(self, now: float):
+        self._state = CircuitState.OPEN
+        self._opened_at = now
+        self._failures = 0
+        self._successes = 0
+
+    def record_success(self):
+        with self._lock:
+            self._update()
+            self._failures = 0
+            if self._state == CircuitState.HALF_OPEN:
+                self._successes += 1
+                if self._successes >= self.ramp_successes:
+                    self._state = CircuitState.CLOSED
+                    self._open_for = self.open_seconds
+                    logger.info(f"SD host {self.url} recovered, circuit closed")
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._update(now)
+            if self._state == CircuitState.HALF_OPEN:
+                self._open_for = min(self._open_for * 2, self.max_open_seconds)
+                self._open(now)
+                logger.warning(
+                    f"SD host {self.url} failed while recovering, "
+                    f"circuit opened for {self._open_for:.0f}s"
+                )
+            elif self._state == CircuitState.CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open(now)
+                    logger.warning(
+                        f"SD host {self.url} failed {self.failure_threshold} times, "
+                        f"circuit opened"
+                    )
+
+    def probe_succeeded(self):
+        # a healthy probe shortens the open time (jobs ramp up again)
+        with self._lock:
+            if self._state == CircuitState.OPEN:
+                self._state = CircuitState.HALF_OPEN
+                self._successes = 0
+                logger.info(f"SD host {self.url} answers again, circuit half-open")
+
+
+# Health of all SD hosts (one circuit breaker per host)
+# - `start` probes the hosts every `health_check_interval` seconds in a daemon
+#   thread (a short request with `health_check_timeout`), so a dead host is
+#   detected without sending jobs to it, and a recovered one is found early
+# - `wait` blocks until a breaker changed state (used to hold jobs while all
+#   hosts with the model are down)
+class _BackendHealth:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._probe_thread: threading.Thread = None
+        self._stop = threading.Event()
+        self.logger = logger
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        with self._lock:
+            if url not in self._breakers:
+                self._breakers[url] = CircuitBreaker.from_settings(url)
+            return self._breakers[url]
+
+    def states(self) -> Dict[str, str]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {url: b.state for url, b in breakers.items()}
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+    def allow(self, url: str, in_flight: int = 0) -> bool:
+        return self.breaker(url).allow(in_flight)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def record_success(self, url: str):
+        self.breaker(url).record_success()
+        self._notify()
+
+    def record_failure(self, url: str):
+        self.breaker(url).record_failure()
+        self._notify()
+
+    def wait(self, timeout: float):
+        with self._changed:
+            self._changed.wait(timeout)
+
+    # ---------------------------------------
+    # probes
+    # ---------------------------------------
+    def probe(self, apis: Dict[str, AbstractAPI]) -> Dict[str, bool]:
+        timeout = Settings.server.health_check_timeout or None
+
+        def probe_one(api: AbstractAPI) -> bool:
+            try:
+                return api.check_sd_host(timeout=timeout, log=False)
+            except Exception:
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(len(apis), 1)) as executor:
+            results = dict(zip(apis.keys(), executor.map(probe_one, apis.values())))
+
+        for url, ok in results.items():
+            if ok:
+                self.breaker(url).probe_succeeded()
+            else:
+                self.breaker(url).record_failure()
+        self._notify()
+        return results
+
+    def start(self, apis: Dict[str, AbstractAPI], interval: Optional[float] = None):
+        interval = interval or Settings.server.health_check_interval
+        if self._probe_thread is not None or not interval:
+            return
+
+        def _probe_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.probe(apis)
+                except Exception as e:
+                    self.logger.error(f"SD host health check failed: {e}")
+
+        self._stop.clear()
+        self._probe_thread = threading.Thread(
+            target=_probe_loop, name="backend-health", daemon=True
+        )
+        self._probe_thread.start()
+        self.logger.info(f"SD host health checks started, interval={interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self._probe_thread = None
+
+
+BackendHealth = _BackendHealth()  # singleton instance
@@ -0,0 +1,236 @@
+import time
+import logging
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from app.settings import Settings, ModelType
+from app.utils.image_file import ImageFile
+from app.utils.logger import logger
+from .abstract_api import AbstractAPI
+from .model_inventory import ModelInventory, _ModelInventory
+from .backend_health import (
+    BackendHealth,
+    BackendUnavailableError,
+    _BackendHealth,
+    is_backend_error,
+)
+
+__all__ = ["ModelNotAvailableError", "BackendPool"]
+
+T = TypeVar("T")
+
+
+class ModelNotAvailableError(ValueError):
+    # raised when no (reachable) SD host has the requested model
+    pass
+
+
+# Routes the requests over multiple SD hosts (backends)
+# - jobs only go to hosts whose inventory has the requested model,
+#   the host with the fewest jobs in flight is chosen, preferring hosts that
+#   ran the same checkpoint last (a model swap costs seconds to minutes)
+# - a model that no host has is looked up once more (inventory refresh)
+#   before the job fails, e.g. for hosts still loading their model folders; at
+#   most once per `model_miss_refresh_interval`, in between the cached inventory
+#   is used (jobs for a missing model do not query all hosts each)
+# - hosts whose circuit breaker is open (down) are skipped, a job that fails with
+#   a connection error is re-routed to another host with the model; when all of
+#   them are down the job is held up to `backend_hold_seconds` for one to recover
+class BackendPool(AbstractAPI):
+
+    def __init__(
+        self,
+        apis: Dict[str, AbstractAPI],
+        inventory: _ModelInventory = ModelInventory,
+        health: _BackendHealth = BackendHealth,
+        logger: logging.Logger = logger,
+    ):
+        super().__init__(",".join(apis.keys()), logger)
+        self.apis = apis
+        self.inventory = inventory
+        self.health = health
+        self._in_flight: Dict[str, int] = {url: 0 for url in apis}
+        self._backend_locks: Dict[str, threading.Lock] = {
+            url: threading.Lock() for url in apis
+        }
+        self._loaded: Dict[str, Optional[str]] = {url: None for url in apis}
+        self._refreshed_at: Optional[float] = None  # last refresh on a model miss
+        self._lock = threading.Lock()
+        # set_upscaler_model + upscale_image are called from the same worker thread
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self.apis)
+
+    @property
+    def in_flight(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._in_flight)
+
+    @property
+    def loaded_models(self) -> Dict[str, Optional[str]]:
+        # checkpoint each host ran last (assumed to be still loaded)
+        with self._lock:
+            return dict(self._loaded)
+
+    # ---------------------------------------
+    # routing
+    # ---------------------------------------
+    def candidates(
+        self,
+        model_name: Optional[str],
+        model_type: ModelType = ModelType.checkpoint,
+        exclude: Sequence[str] = (),
+    ) -> List[str]:
+        backends = self.inventory.backends
+        return [
+            url
+            for url in self.apis
+            if url in backends
+            and url not in exclude
+            and (model_name is None or backends[url].has_model(model_name, model_type))
+        ]
+
+    def select(
+        self,
+        model_name: Optional[str],
+        model_type: ModelType = ModelType.checkpoint,
+        exclude: Sequence[str] = (),
+    ) -> str:
+        urls = self.candidates(model_name, model_type, exclude)
+        if not urls and not exclude and self._may_refresh():
+            self.inventory.refresh(self.apis)
+            urls = self.candidates(model_name, model_type, exclude)
+        if not urls:
+            raise ModelNotAvailableError(
+                f"No SD host available for {model_type.value}: '{model_name}'"
+            )
+
+        # hosts with the model loaded (warm) are preferred, unless they are busier
+        # than a cold host by more than model_swap_penalty jobs
+        swap_penalty = Settings.server.model_swap_penalty or 0.0
+
+        def cost(url: str) -> float:
+            warm = model_name is None or self._loaded[url] == model_name
+            return self._in_flight[url] + (0 if warm else swap_penalty)
+
+        # hold the job while all hosts with the model are down
+        deadline = time.monotonic() + (Settings.server.backend_hold_seconds or 0)
+        while True:
+            with self._lock:
+                healthy = [u for u in urls if self.health.allow(u, self._in_flight[u])]
+                if healthy:
+                    return min(healthy, key=cost)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise BackendUnavailableError(
+                    f"All SD hosts for {model_type.value} '{model_name}' are down: {urls}"
+                )
+            self.health.wait(min(remaining, 1.0))
+
+    def _may_refresh(self) -> bool:
+        interval = Settings.server.model_miss_refresh_interval or 0
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshed_at is not None and now - self._refreshed_at < interval:
+                return False
+            self._refreshed_at = now
+            return True
+
+    @contextlib.contextmanager
+    def _use(self, url: str):
+        with self._lock:
+            self._in_flight[url] += 1
+        try:
+            yield self.apis[url]
+        finally:
+            with self._lock:
+                self._in_flight[url] -= 1
+
+    def _run(
+        self,
+        model_name: Optional[str],
+        model_type: ModelType,
+        call: Callable[[str, AbstractAPI], T],
+    ) -> Tuple[str, T]:
+        # run the call on a selected host, re-routed on connection errors
+        failed: List[str] = []
+        while True:
+            url = self.select(model_name, model_type, exclude=failed)
+            try:
+                with self._use(url) as api:
+                    result = call(url, api)
+            except Exception as e:
+                if not is_backend_error(e):
+                    raise
+                self.health.record_failure(url)
+                failed.append(url)
+                if not self.candidates(model_name, model_type, exclude=failed):
+                    raise
+                self._logger.warning(f"SD host {url} failed: {e}, re-routing job")
+                continue
+            self.health.record_success(url)
+            return url, result
+
+    # ---------------------------------------
+    # AbstractAPI
+    # ---------------------------------------
+    def get_checkpoint_names(self) -> List[str]:
+        return self.inventory.names(ModelType.checkpoint) or []
+
+    def get_lora_names(self) -> List[str]:
+        return self.inventory.names(ModelType.lora) or []
+
+    def get_upscaler_names(self) -> List[str]:
+        return self.inventory.names(ModelType.upscaler) or []
+
+    def set_upscaler_model(self, upscaler_model: str) -> bool:
+        # applied to the selected host when upscaling
+        self._local.upscaler_model = upscaler_model
+        return True
+
+    def generate_image(self, **kwargs) -> ImageFile:
+        sd_model = kwargs.get("sd_model")
+        url, image = self._run(
+            sd_model,
+            ModelType.checkpoint,
+            lambda url, api: api.generate_image(**kwargs),
+        )
+        if sd_model is not None:
+            with self._lock:
+                self._loaded[url] = sd_model
+        return image
+
+    def generate_image_batch(self, requests: List[Dict]) -> List[ImageFile]:
+        # a batch runs on one host (same model)
+        sd_model = requests[0].get("sd_model")
+        url, images = self._run(
+            sd_model,
+            ModelType.checkpoint,
+            lambda url, api: api.generate_image_batch(requests),
+        )
+        if sd_model is not None:
+            with self._lock:
+                self._loaded[url] = sd_model
+        return images
+
+    def upscale_image(self, image: ImageFile) -> ImageFile:
+        upscaler_model = getattr(self._local, "upscaler_model", None)
+
+        def upscale(url: str, api: AbstractAPI) -> ImageFile:
+            # the upscaler model is host state, hold it for the request
+            with self._backend_locks[url]:
+                if upscaler_model is not None:
+                    api.set_upscaler_model(upscaler_model)
+                return api.upscale_image(image)
+
+        return self._run(upscaler_model, ModelType.upscaler, upscale)[1]
+
+    def get_status(self, request):
+        pass
+
+    def check_sd_host(self, timeout: Optional[float] = None, log: bool = True) -> bool:
+        return any(
+            api.check_sd_host(timeout=timeout, log=log) for api in self.apis.values()
+        )
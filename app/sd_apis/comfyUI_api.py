@@ -1,17 +1,28 @@
 import os
+import copy
 import json
 import uuid
 import logging
 from app.utils.logger import logger
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import urllib.error
 import urllib.request
 import urllib.parse
+import requests
+import requests.adapters
 import websocket  # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
 from PIL import Image, PngImagePlugin
 
 from . import AbstractAPI
+from .abstract_api import PreviewCallback
 from app.utils.image_file import ImageFile
 from app.utils.helpers import random_seed
+from app.settings import Settings, ModelType
+from app.utils.prompts import PromptConstants
+from .backend_health import is_backend_error
+from .timeouts import Deadline, DeadlineExceededError, job_budget, retry_call
+from .comfyUI_execution import PromptExecution, is_output_node
 
 # Default workflow for picture generation
 DEFAULT_WORKFLOW = """
@@ -167,6 +178,44 @@ DEFAULT_UPSCALER_WORKFLOW_MAP = """
 """
 
 
+# Merges workflows (API format) into one prompt, to run them with one request
+# - the nodes of each workflow are renamed ("<i>:<node id>", the first keeps its ids)
+# - identical nodes with identical inputs (e.g. the checkpoint loader, the negative
+#   prompt encoding) are added only once and shared by the workflows
+# - returns the merged prompt and for each workflow its node id -> merged node id
+def merge_workflows(workflows: List[Dict]) -> Tuple[Dict, List[Dict[str, str]]]:
+    merged: Dict[str, Dict] = {}
+    by_signature: Dict[str, str] = {}
+    id_maps: List[Dict[str, str]] = []
+    for i, workflow in enumerate(workflows):
+        nodes = workflow.get("prompt", workflow)
+        id_map: Dict[str, str] = {}
+
+        def add(node_id: str) -> str:
+            if node_id in id_map:
+                return id_map[node_id]
+            node = nodes[node_id]
+            inputs = {}
+            for name, value in node.get("inputs", {}).items():
+                # links are [node id, output index]
+                if isinstance(value, list) and len(value) == 2 and str(value[0]) in nodes:
+                    value = [add(str(value[0])), value[1]]
+                inputs[name] = value
+            node = {**node, "inputs": inputs}
+            signature = json.dumps(node, sort_keys=True)
+            if signature not in by_signature:
+                new_id = node_id if i == 0 else f"{i}:{node_id}"
+                merged[new_id] = node
+                by_signature[signature] = new_id
+            id_map[node_id] = by_signature[signature]
+            return id_map[node_id]
+
+        for node_id in nodes:
+            add(str(node_id))
+        id_maps.append(id_map)
+    return merged, id_maps
+
+
 # Defines the SD API handler for A1111
 class ComfyUIAPI(AbstractAPI):
 
@@ -185,6 +234,7 @@ class ComfyUIAPI(AbstractAPI):
         self.workflow_map = workflow_map
         self.upscaler_workflow = upscaler_workflow_json
         self.upscaler_workflow_map = upscaler_workflow_map
+        self._session: requests.Session = None
 
     def _load_json(self, json_input: str | os.PathLike) -> Dict:
         if os.path.isfile(json_input):
@@ -259,7 +309,8 @@ class ComfyUIAPI(AbstractAPI):
             else:
                 set_recursive(stack[1:], workflow[stack[0]], val)
 
-        wf = {**self.workflow} if workflow is None else {**workflow}
+        # the template is shared (concurrent jobs, batches), only the copy is changed
+        wf = copy.deepcopy(self.workflow if workflow is None else workflow)
         wf_map = self.workflow_map if workflow_map is None else workflow_map
         for sd_var, setting in model_vals.items():
             if sd_var in wf_map:
@@ -273,23 +324,98 @@ class ComfyUIAPI(AbstractAPI):
                 self._logger.warn(f"Warning: {sd_var} not in workflow_map")
         return wf
 
-    def _queue_prompt(self, workflow: str, client_id: str):
+    def _build_workflow(
+        self, settings: Dict, workflow: Dict = None, workflow_map: Dict = None
+    ) -> Dict:
+        wf = self._apply_settings(settings, workflow=workflow, workflow_map=workflow_map)
+        wf_map = self.workflow_map if workflow_map is None else workflow_map
+        if Settings.server.conditioning_cache and settings.get("negativeprompt"):
+            self._split_negative_prompt(wf, wf_map, settings["negativeprompt"])
+        return wf
+
+    def _split_negative_prompt(self, wf: Dict, wf_map: Dict, negative_prompt: str):
+        # Conditioning cache: the style template of the negative prompt is encoded
+        # by its own CLIPTextEncode node and concatenated to the user's part (as a
+        # BREAK), the template encoding has the same inputs in every job of the style,
+        # so the host reuses it from its node cache (and batches share one node)
+        user_part, template = PromptConstants.split_negative_prompt(negative_prompt)
+        stack = wf_map.get("negativeprompt")
+        if not (user_part and template and stack) or isinstance(stack[0], (list, tuple)):
+            return
+        nodes = wf["prompt"] if stack[0] == "prompt" else wf
+        node_id = stack[-3]
+        node = nodes.get(node_id)
+        if node is None or node.get("class_type") != "CLIPTextEncode" or stack[-1] != "text":
+            return
+
+        node["inputs"]["text"] = user_part
+        template_id, concat_id = f"{node_id}:template", f"{node_id}:concat"
+        for other in nodes.values():
+            for name, value in other["inputs"].items():
+                if value == [node_id, 0]:
+                    other["inputs"][name] = [concat_id, 0]
+        nodes[template_id] = {
+            "inputs": {"text": template, "clip": node["inputs"]["clip"]},
+            "class_type": "CLIPTextEncode",
+        }
+        nodes[concat_id] = {
+            "inputs": {"conditioning_to": [node_id, 0], "conditioning_from": [template_id, 0]},
+            "class_type": "ConditioningConcat",
+        }
+
+    @staticmethod
+    def _request_not_sent(e: Exception) -> bool:
+        # /prompt is not idempotent, only retried when the host refused the connection
+        if isinstance(e, urllib.error.URLError) and not isinstance(
+            e, urllib.error.HTTPError
+        ):
+            e = e.reason
+        return isinstance(e, ConnectionRefusedError)
+
+    def _queue_prompt(
+        self, workflow: str, client_id: str, deadline: Optional[Deadline] = None
+    ):
+        deadline = deadline or Deadline(None)
         if "prompt" in list(workflow.keys()):
             p = {**workflow, "client_id": client_id}
         else:
             p = {"prompt": {**workflow}, "client_id": client_id}
 
         data = json.dumps(p).encode("utf-8")
-        req = urllib.request.Request(f"http://{self.webui_url}/prompt", data=data)
-        return json.loads(urllib.request.urlopen(req).read())
+
+        def post_prompt():
+            req = urllib.request.Request(f"http://{self.webui_url}/prompt", data=data)
+            with urllib.request.urlopen(req, timeout=deadline.timeout()) as response:
+                return json.loads(response.read())
+
+        return retry_call(
+            post_prompt,
+            retry_on=self._request_not_sent,
+            deadline=deadline,
+            what=f"POST {self.webui_url}/prompt",
+        )
+
+    @property
+    def session(self) -> requests.Session:
+        # pooled HTTP connections to the host (history, outputs)
+        if self._session is None:
+            pool_size = max(Settings.server.download_workers or 1, 1)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+        return self._session
 
     def _get_image(
         self,
         filename: str,
         subfolder: str,
         folder_type: str,
-    ):
-        data = {
+        deadline: Optional[Deadline] = None,
+    ) -> bytes:
+        deadline = deadline or Deadline(None)
+        params = {
             k: v
             for k, v in {
                 "filename": filename,
@@ -298,69 +424,218 @@ class ComfyUIAPI(AbstractAPI):
             }.items()
             if v
         }
-        url_values = urllib.parse.urlencode(data)
-        with urllib.request.urlopen(
-            f"http://{self.webui_url}/view?{url_values}"
-        ) as response:
-            return response.read()
-
-    def _get_history(self, prompt_id: str):
-        with urllib.request.urlopen(
-            f"http://{self.webui_url}/history?{prompt_id}"
-        ) as response:
-            return json.loads(response.read())
-
-    def _get_images(self, ws: websocket.WebSocket, workflow: str, client_id: str):
-        prompt_id = self._queue_prompt(workflow, client_id)["prompt_id"]
+
+        def get_view() -> bytes:
+            # streamed in chunks, videos can be large
+            with self.session.get(
+                f"http://{self.webui_url}/view",
+                params=params,
+                stream=True,
+                timeout=deadline.timeout(),
+            ) as response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=2**16):
+                    data += chunk
+                return bytes(data)
+
+        return retry_call(
+            get_view,
+            retry_on=is_backend_error,
+            deadline=deadline,
+            what=f"GET {self.webui_url}/view",
+        )
+
+    def _get_history(self, prompt_id: str, deadline: Optional[Deadline] = None):
+        deadline = deadline or Deadline(None)
+
+        def get_history():
+            response = self.session.get(
+                f"http://{self.webui_url}/history/{prompt_id}",
+                timeout=deadline.timeout(),
+            )
+            response.raise_for_status()
+            return response.json()
+
+        return retry_call(
+            get_history,
+            retry_on=is_backend_error,
+            deadline=deadline,
+            what=f"GET {self.webui_url}/history",
+        )
+
+    @staticmethod
+    def _select_outputs(
+        outputs: Dict[str, Dict], output_nodes: Optional[List[str]] = None
+    ) -> Dict[str, List[Dict]]:
+        # files to download by node: all files of the output nodes declared in the
+        # workflow map ("output_nodes"), else the last file of the first output node
+        files = {
+            node_id: output[out_type[0]]
+            for node_id, output in outputs.items()
+            if (out_type := [t for t in ("images", "gifs") if t in output])
+        }
+        if output_nodes:
+            return {n: files[str(n)] for n in map(str, output_nodes) if n in files}
+        for node_id, node_files in files.items():
+            if node_files:
+                return {node_id: node_files[-1:]}
+        return {}
+
+    def _download(
+        self, files: Dict[str, List[Dict]], deadline: Deadline
+    ) -> Dict[str, List[tuple]]:
+        # download the files concurrently, returns (data, extension) by node
+        refs = [(node_id, f) for node_id, node_files in files.items() for f in node_files]
+        if not refs:
+            return {}
+
+        def download(ref) -> tuple:
+            _, f = ref
+            data = self._get_image(f["filename"], f["subfolder"], f["type"], deadline)
+            return data, f["filename"].split(".")[-1]
+
+        n_workers = min(len(refs), max(Settings.server.download_workers or 1, 1))
+        if n_workers == 1:
+            results = list(map(download, refs))
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(download, refs))
+
         output_images = {}
-        while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message["type"] == "executing":
-                    data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break  # Execution is done
+        for (node_id, _), result in zip(refs, results):
+            output_images.setdefault(node_id, []).append(result)
+        return output_images
+
+    def _cancel_prompt(self, execution: PromptExecution):
+        # stop a prompt the bot gave up on (e.g. deadline), so the host is free again:
+        # interrupt it when running, else remove it from the queue
+        try:
+            if execution.started and not execution.done:
+                req = urllib.request.Request(
+                    f"http://{self.webui_url}/interrupt", data=b"", method="POST"
+                )
             else:
-                continue  # previews are binary data
-
-        history = self._get_history(prompt_id)[prompt_id]
-        for node_id in history["outputs"]:
-            node_output = history["outputs"][node_id]
-            if out_type := list(
-                set(node_output.keys()).intersection({"images", "gifs"})
-            ):
-                images_output = []
-                for image in node_output[out_type[0]]:
-                    image_data = self._get_image(
-                        image["filename"], image["subfolder"], image["type"]
-                    )
-                    extension = image["filename"].split(".")[-1]
-                    images_output.append((image_data, extension))
-                output_images[node_id] = images_output
+                data = json.dumps({"delete": [execution.prompt_id]}).encode("utf-8")
+                req = urllib.request.Request(f"http://{self.webui_url}/queue", data=data)
+            urllib.request.urlopen(req, timeout=Settings.server.request_timeout).close()
+        except Exception as e:
+            self._logger.warning(f"Could not cancel prompt {execution.prompt_id}: {e}")
 
-        return output_images
+    def _get_images(
+        self,
+        ws: websocket.WebSocket,
+        workflow: str,
+        client_id: str,
+        deadline: Optional[Deadline] = None,
+        output_nodes: Optional[List[str]] = None,
+        on_preview: Optional[PreviewCallback] = None,
+    ) -> Dict[str, List[tuple]]:
+        deadline = deadline or Deadline(None)
+        prompt_id = self._queue_prompt(workflow, client_id, deadline)["prompt_id"]
+        execution = PromptExecution.from_workflow(prompt_id, workflow, output_nodes)
+        history = None
+        try:
+            while not execution.done:
+                deadline.check(f"Prompt {prompt_id} on SD host {self.webui_url}")
+                ws.settimeout(deadline.timeout())
+                try:
+                    out = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    # no message for request_timeout: the end of the prompt may have
+                    # been missed, else keep waiting until the deadline
+                    history = self._get_history(prompt_id, deadline)
+                    if prompt_id in history:
+                        break
+                    continue
+                if isinstance(out, str):
+                    execution.handle(json.loads(out))
+                elif (preview := execution.handle_binary(out)) and on_preview:
+                    try:
+                        on_preview(*preview, execution.progress)
+                    except Exception as e:
+                        self._logger.warning(f"Preview callback failed: {e}")
+        except DeadlineExceededError:
+            self._cancel_prompt(execution)
+            raise
+
+        # images sent over the websocket (SaveImageWebsocket nodes) need no requests
+        ws_nodes = output_nodes or list(execution.ws_outputs)[:1]
+        if ws_nodes and all(str(n) in execution.ws_outputs for n in ws_nodes):
+            if output_nodes:
+                return {str(n): execution.ws_outputs[str(n)] for n in ws_nodes}
+            return {ws_nodes[0]: execution.ws_outputs[ws_nodes[0]][-1:]}
+
+        # outputs of the `executed` messages, /history only for cached outputs
+        outputs = execution.outputs
+        if execution.needs_history or (history is not None and prompt_id in history):
+            if history is None or prompt_id not in history:
+                history = self._get_history(prompt_id, deadline)
+            outputs = {**history[prompt_id]["outputs"], **outputs}
+
+        files = self._select_outputs(outputs, output_nodes)
+        return self._download(files, deadline)
+
+    def _execute(
+        self,
+        workflow: Dict,
+        deadline: Deadline,
+        output_nodes: Optional[List[str]] = None,
+        on_preview: Optional[PreviewCallback] = None,
+    ) -> Dict[str, List[tuple]]:
+        # run the workflow on the host, returns the output (data, extension) by node
+        client_id = str(uuid.uuid4())
+        ws = websocket.WebSocket()
+        try:
+            ws.connect(
+                f"ws://{self.webui_url}/ws?clientId={client_id}",
+                timeout=deadline.timeout(),
+            )
+            return self._get_images(
+                ws, workflow, client_id, deadline, output_nodes, on_preview
+            )
+        finally:
+            ws.close()
+
+    def _get_object_info(self, node_class: Optional[str] = None) -> Dict:
+        # node definitions (all, or of one node class), retried on backend errors
+        url = f"http://{self.webui_url}/object_info"
+        if node_class:
+            url += f"/{node_class}"
+
+        def get_object_info() -> Dict:
+            with urllib.request.urlopen(
+                url, timeout=Settings.server.request_timeout
+            ) as response:
+                return json.loads(response.read())
+
+        return retry_call(get_object_info, retry_on=is_backend_error, what=f"GET {url}")
 
     def get_checkpoint_names(self) -> List[str]:
-        with urllib.request.urlopen(
-            f"http://{self.webui_url}/object_info/CheckpointLoaderSimple"
-        ) as response:
-            res = json.loads(response.read())
-            return res["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"][0]
+        res = self._get_object_info("CheckpointLoaderSimple")
+        return res["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"][0]
 
     def get_lora_names(self) -> List[str]:
-        with urllib.request.urlopen(
-            f"http://{self.webui_url}/object_info/LoraLoader"
-        ) as response:
-            res = json.loads(response.read())
-            return res["LoraLoader"]["input"]["required"]["lora_name"][0]
+        res = self._get_object_info("LoraLoader")
+        return res["LoraLoader"]["input"]["required"]["lora_name"][0]
 
     def get_upscaler_names(self) -> List[str]:
-        with urllib.request.urlopen(
-            f"http://{self.webui_url}/object_info/UpscaleModelLoader"
-        ) as response:
-            res = json.loads(response.read())
-            return res["UpscaleModelLoader"]["input"]["required"]["model_name"][0]
+        res = self._get_object_info("UpscaleModelLoader")
+        return res["UpscaleModelLoader"]["input"]["required"]["model_name"][0]
+
+    def get_model_names(self) -> Dict[str, List[str]]:
+        # one request for all node definitions, instead of one per loader node
+        res = self._get_object_info()
+
+        def input_choices(node_class: str, input_name: str) -> List[str]:
+            inputs = res.get(node_class, {}).get("input", {}).get("required", {})
+            return inputs.get(input_name, [[]])[0]
+
+        return {
+            ModelType.checkpoint.value: input_choices("CheckpointLoaderSimple", "ckpt_name"),
+            ModelType.lora.value: input_choices("LoraLoader", "lora_name"),
+            ModelType.upscaler.value: input_choices("UpscaleModelLoader", "model_name"),
+        }
 
     def generate_image(
         self,
@@ -383,30 +658,27 @@ class ComfyUIAPI(AbstractAPI):
         workflow: Optional[Dict] = None,
         workflow_map: Optional[Dict] = None,
         animation_model: Optional[str] = None,
+        on_preview: Optional[PreviewCallback] = None,
     ) -> ImageFile:
-        settings = {
-            k: v
-            for k, v in {
-                "sd_model": sd_model,
-                "prompt": prompt,
-                "negativeprompt": negativeprompt,
-                "width": width,
-                "height": height,
-                "seed": seed,
-                "subseed": sub_seed,
-                "variation_strength": variation_strength,
-                "image_file": image_file,
-                "video_format": video_format,
-                "frame_rate": frame_rate,
-                "loop_count": loop_count,
-                "video_frames": video_frames,
-                "motion_bucket_id": motion_bucket_id,
-                "ping_pong": ping_pong,
-                "animation_model": animation_model,
-            }.items()
-            if v is not None
-        }
-        out_workflow = self._apply_settings(
+        settings = self._settings(
+            sd_model=sd_model,
+            prompt=prompt,
+            negativeprompt=negativeprompt,
+            width=width,
+            height=height,
+            seed=seed,
+            sub_seed=sub_seed,
+            variation_strength=variation_strength,
+            image_file=image_file,
+            video_format=video_format,
+            frame_rate=frame_rate,
+            loop_count=loop_count,
+            video_frames=video_frames,
+            motion_bucket_id=motion_bucket_id,
+            ping_pong=ping_pong,
+            animation_model=animation_model,
+        )
+        out_workflow = self._build_workflow(
             settings,
             workflow=workflow,
             workflow_map=workflow_map,
@@ -416,18 +688,72 @@ class ComfyUIAPI(AbstractAPI):
         with open("debug_workflow.json", "w") as f:
             json.dump(out_workflow, f)
 
-        client_id = str(uuid.uuid4())
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.webui_url}/ws?clientId={client_id}")
-        images = self._get_images(ws, out_workflow, client_id)
+        deadline = Deadline(job_budget(width, height, video_frames))
+        wf_map = self.workflow_map if workflow_map is None else workflow_map
+        images = self._execute(
+            out_workflow, deadline, wf_map.get("output_nodes"), on_preview
+        )
         image_data = list(images.values())[0][-1]
         image_bytes, extension = image_data
         image = ImageFile(image_bytes=image_bytes)
         image.save(extension=extension)
-        ws.close()
 
         return image
 
+    @staticmethod
+    def _settings(**kwargs) -> Dict:
+        # generate_image arguments -> workflow settings (workflow_map keys), if set
+        return {
+            "subseed" if k == "sub_seed" else k: v
+            for k, v in kwargs.items()
+            if v is not None and k not in ("workflow", "workflow_map", "on_preview")
+        }
+
+    def generate_image_batch(self, requests: List[Dict]) -> List[ImageFile]:
+        # several generate_image requests (txt2img) run as one prompt on the host,
+        # the outputs are split back by the output nodes of each request
+        if len(requests) == 1:
+            return [self.generate_image(**requests[0])]
+
+        workflows, output_nodes, budgets = [], [], []
+        for kwargs in requests:
+            wf_map = kwargs.get("workflow_map") or self.workflow_map
+            workflow = self._build_workflow(
+                self._settings(**kwargs),
+                workflow=kwargs.get("workflow"),
+                workflow_map=wf_map,
+            )
+            nodes = workflow.get("prompt", workflow)
+            output_nodes.append(
+                [str(n) for n in wf_map.get("output_nodes") or []]
+                or [k for k, v in nodes.items() if is_output_node(v.get("class_type"))]
+            )
+            workflows.append(workflow)
+            budgets.append(job_budget(kwargs.get("width"), kwargs.get("height")))
+
+        merged, id_maps = merge_workflows(workflows)
+        item_nodes = [
+            [id_map[n] for n in nodes if n in id_map]
+            for nodes, id_map in zip(output_nodes, id_maps)
+        ]
+        deadline = Deadline(None if None in budgets else sum(budgets))
+        outputs = self._execute(
+            {**workflows[0], "prompt": merged} if "prompt" in workflows[0] else merged,
+            deadline,
+            list(dict.fromkeys(n for nodes in item_nodes for n in nodes)),
+        )
+
+        images = []
+        for nodes in item_nodes:
+            found = [outputs[n] for n in nodes if outputs.get(n)]
+            if not found:
+                raise RuntimeError(f"No output of nodes {nodes} on SD host {self.webui_url}")
+            image_bytes, extension = found[0][-1]
+            image = ImageFile(image_bytes=image_bytes)
+            image.save(extension=extension)
+            images.append(image)
+        return images
+
     def set_upscaler_model(self, upscaler_model: str) -> bool:
         # reset the upscaler model definition
         if not upscaler_model.endswith(".pth"):
@@ -450,15 +776,15 @@ class ComfyUIAPI(AbstractAPI):
             self.upscaler_workflow,
             self.upscaler_workflow_map,
         )
-        client_id = str(uuid.uuid4())
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.webui_url}/ws?clientId={client_id}")
-        images = self._get_images(ws, workflow, client_id)
+        images = self._execute(
+            workflow,
+            Deadline(job_budget()),
+            self.upscaler_workflow_map.get("output_nodes"),
+        )
         image_data = list(images.values())[0][-1]
         image_bytes, extension = image_data
         image = ImageFile(image_bytes=image_bytes)
         image.save(extension=extension)
-        ws.close()
 
         return image
 
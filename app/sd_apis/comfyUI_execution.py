@@ -0,0 +1,166 @@
+import time
+import struct
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+__all__ = [
+    "ComfyUIExecutionError",
+    "ComfyUIInterruptedError",
+    "PromptExecution",
+    "is_output_node",
+]
+
+# binary websocket frames: event type, image format, image bytes
+BINARY_PREVIEW_IMAGE = 1
+IMAGE_FORMATS = {1: "jpeg", 2: "png"}
+# nodes sending their images as binary frames (instead of saving a file)
+WEBSOCKET_OUTPUT_NODE_TYPES = {"SaveImageWebsocket"}
+# nodes producing the outputs of a prompt (besides any other Save* node)
+OUTPUT_NODE_TYPES = {"SaveImage", "SaveImageWebsocket", "PreviewImage", "VHS_VideoCombine"}
+
+
+def is_output_node(class_type: Optional[str]) -> bool:
+    return bool(class_type) and (
+        class_type in OUTPUT_NODE_TYPES or class_type.startswith("Save")
+    )
+
+
+class ComfyUIExecutionError(RuntimeError):
+    # a node of the prompt failed on the ComfyUI host (execution_error message)
+    def __init__(
+        self,
+        prompt_id: str,
+        node_id: Optional[str] = None,
+        node_type: Optional[str] = None,
+        exception_type: Optional[str] = None,
+        exception_message: Optional[str] = None,
+        traceback: Optional[List[str]] = None,
+    ):
+        self.prompt_id = prompt_id
+        self.node_id = node_id
+        self.node_type = node_type
+        self.exception_type = exception_type
+        self.exception_message = exception_message
+        self.traceback = traceback or []
+        super().__init__(
+            f"Prompt {prompt_id} failed in node {node_id} ({node_type}): "
+            f"{exception_type}: {exception_message}"
+        )
+
+
+class ComfyUIInterruptedError(ComfyUIExecutionError):
+    # the prompt was interrupted on the host (execution_interrupted message)
+    def __init__(self, prompt_id: str, node_id: str = None, node_type: str = None):
+        super().__init__(prompt_id, node_id, node_type, "Interrupted", "prompt interrupted")
+
+
+# State of a single prompt, tracked from the ComfyUI websocket messages
+# - `handle` returns True when the prompt is done, raises ComfyUIExecutionError
+#   on execution_error / execution_interrupted (instead of waiting for outputs)
+# - outputs of executed nodes are kept from the `executed` messages, nodes whose
+#   outputs were cached by ComfyUI (execution_cached) send no `executed` message,
+#   so the outputs must be read from /history only when a cached node is an output
+#   node (declared in `output_nodes`, else by its type), e.g. not for cached loaders
+# - `handle_binary` keeps the images of websocket output nodes (SaveImageWebsocket,
+#   no /history and /view requests needed) and returns the other binary frames,
+#   the latent previews
+class PromptExecution:
+    def __init__(
+        self,
+        prompt_id: str,
+        node_types: Optional[Dict[str, str]] = None,
+        output_nodes: Optional[List[str]] = None,
+    ):
+        self.prompt_id = prompt_id
+        self.node_types = node_types or {}  # node_id: class_type
+        self.output_nodes = {str(n) for n in output_nodes or []}
+        self.started = False
+        self.done = False
+        self.node: Optional[str] = None  # currently executing node
+        self.progress: Optional[tuple] = None  # (value, max) of the current node
+        self.cached_nodes: Set[str] = set()
+        self.outputs: Dict[str, Dict[str, Any]] = {}  # node_id: output
+        self.ws_outputs: Dict[str, List[Tuple[bytes, str]]] = {}  # node_id: images
+        self.last_message_at: float = time.monotonic()
+
+    def __repr__(self):
+        return (
+            f"<PromptExecution {self.prompt_id} started={self.started} "
+            f"done={self.done} node={self.node}>"
+        )
+
+    def is_output(self, node_id: str) -> bool:
+        if self.output_nodes:
+            return node_id in self.output_nodes
+        return is_output_node(self.node_types.get(node_id))
+
+    @property
+    def needs_history(self) -> bool:
+        if not (self.outputs or self.ws_outputs):
+            return True
+        return any(
+            self.is_output(n) and n not in self.outputs and n not in self.ws_outputs
+            for n in self.cached_nodes
+        )
+
+    @classmethod
+    def from_workflow(
+        cls, prompt_id: str, workflow: Dict, output_nodes: Optional[List[str]] = None
+    ) -> "PromptExecution":
+        nodes = workflow.get("prompt", workflow)
+        return cls(
+            prompt_id, {k: v.get("class_type") for k, v in nodes.items()}, output_nodes
+        )
+
+    def handle_binary(self, data: bytes) -> Optional[Tuple[bytes, str]]:
+        # returns (image bytes, extension) of a preview frame, else None
+        if len(data) < 8:
+            return None
+        event, image_format = struct.unpack(">II", data[:8])
+        if event != BINARY_PREVIEW_IMAGE:
+            return None
+        image = (data[8:], IMAGE_FORMATS.get(image_format, "png"))
+        if self.node_types.get(self.node) in WEBSOCKET_OUTPUT_NODE_TYPES:
+            self.ws_outputs.setdefault(self.node, []).append(image)
+            return None
+        return image
+
+    def handle(self, message: Dict) -> bool:
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        if data.get("prompt_id", self.prompt_id) != self.prompt_id:
+            return self.done  # message of another prompt (e.g. other client)
+
+        self.last_message_at = time.monotonic()
+        if msg_type == "execution_start":
+            self.started = True
+        elif msg_type == "execution_cached":
+            self.started = True
+            self.cached_nodes.update(str(n) for n in data.get("nodes", []))
+        elif msg_type == "executing":
+            self.node = data.get("node")
+            self.progress = None
+            if self.node is None and self.started:
+                self.done = True
+        elif msg_type == "progress":
+            self.progress = (data.get("value"), data.get("max"))
+        elif msg_type == "executed":
+            if (node_id := data.get("node")) is not None:
+                self.outputs[str(node_id)] = data.get("output") or {}
+        elif msg_type == "execution_success":
+            self.done = True
+        elif msg_type == "execution_interrupted":
+            self.done = True
+            raise ComfyUIInterruptedError(
+                self.prompt_id, data.get("node_id"), data.get("node_type")
+            )
+        elif msg_type == "execution_error":
+            self.done = True
+            raise ComfyUIExecutionError(
+                self.prompt_id,
+                node_id=data.get("node_id"),
+                node_type=data.get("node_type"),
+                exception_type=data.get("exception_type"),
+                exception_message=data.get("exception_message"),
+                traceback=data.get("traceback"),
+            )
+        return self.done
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, asdict, replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from app.settings import Settings, ModelType
+from app.utils.logger import logger
+from .abstract_api import AbstractAPI
+
+__all__ = ["BackendInventory", "ModelInventory"]
+
+
+@dataclass
+class BackendInventory:
+    url: str
+    api_type: str
+    models: Dict[str, Optional[List[str]]]  # ModelType value: names (None=unknown)
+    updated_at: float  # time.time() of the last query of the host
+    stale: bool = False  # the host did not answer the last refresh (last known models)
+
+    def is_fresh(self, ttl: float, now: float = None) -> bool:
+        return ttl > 0 and ((now or time.time()) - self.updated_at) < ttl
+
+    def has_model(self, name: str, model_type: ModelType = ModelType.checkpoint) -> bool:
+        names = self.models.get(model_type.value)
+        return names is None or name in names
+
+
+# Inventory of the models available on each SD host (backend)
+# - `discover` queries all hosts concurrently, so a cold start takes as long as
+#   the slowest host (not the sum); each host is queried with a single request
+# - results are cached to Settings.files.model_cache_file, entries younger than
+#   Settings.server.model_cache_ttl are used without querying the host models
+# - `start_refresh` re-queries the hosts periodically, so models (and hosts) that
+#   become available after startup are picked up for routing without restart;
+#   a host that does not answer keeps its last known models (stale), so jobs for
+#   them wait for the host (circuit breaker) instead of failing as unknown models
+class _ModelInventory:
+    def __init__(self):
+        self._backends: Dict[str, BackendInventory] = {}
+        self._lock = threading.Lock()
+        self._refresh_thread: threading.Thread = None
+        self._stop = threading.Event()
+        self.logger = logger
+
+    def __len__(self):
+        return len(self._backends)
+
+    def __contains__(self, url: str):
+        return url in self._backends
+
+    @property
+    def backends(self) -> Dict[str, BackendInventory]:
+        with self._lock:
+            return dict(self._backends)
+
+    def clear(self):
+        with self._lock:
+            self._backends.clear()
+
+    # ---------------------------------------
+    # cache file
+    # ---------------------------------------
+    def _load_cache(self) -> Dict[str, BackendInventory]:
+        cache_file = Settings.files.model_cache_file
+        if not cache_file or not os.path.exists(cache_file):
+            return {}
+        try:
+            with open(cache_file, "r") as f:
+                return {url: BackendInventory(**v) for url, v in json.load(f).items()}
+        except (OSError, ValueError, TypeError) as e:
+            self.logger.warning(f"Ignoring invalid model cache '{cache_file}': {e}")
+            return {}
+
+    def _save_cache(self):
+        cache_file = Settings.files.model_cache_file
+        if not cache_file:
+            return
+        data = {url: asdict(b) for url, b in self.backends.items()}
+        try:
+            tmp_file = f"{cache_file}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self.logger.warning(f"Could not write model cache '{cache_file}': {e}")
+
+    # ---------------------------------------
+    # host queries
+    # ---------------------------------------
+    def query(self, url: str, api: AbstractAPI) -> BackendInventory:
+        # raises on connection errors
+        try:
+            models = api.get_model_names()
+        except NotImplementedError:
+            self.logger.warning(f"Model listing not supported by SD host: {url}")
+            models = {t.value: None for t in ModelType}
+
+        return BackendInventory(
+            url=url,
+            api_type=api.__class__.__name__,
+            models=models,
+            updated_at=time.time(),
+        )
+
+    def discover(
+        self, apis: Dict[str, AbstractAPI], use_cache: bool = True
+    ) -> Dict[str, BackendInventory]:
+        # returns the inventory of all reachable hosts
+        cached = self._load_cache() if use_cache else {}
+        ttl = Settings.server.model_cache_ttl or 0
+
+        def discover_one(url: str, api: AbstractAPI) -> Optional[BackendInventory]:
+            if not api.check_sd_host(timeout=Settings.server.health_check_timeout or None):
+                return None
+            entry = cached.get(url)
+            if entry is not None and entry.api_type == api.__class__.__name__:
+                if entry.is_fresh(ttl):
+                    self.logger.info(f"Using cached model list for SD host: {url}")
+                    return entry
+            try:
+                return self.query(url, api)
+            except Exception as e:
+                self.logger.error(f"Failed to query models of SD host {url}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(len(apis), 1)) as executor:
+            results = dict(
+                zip(apis.keys(), executor.map(discover_one, apis.keys(), apis.values()))
+            )
+
+        with self._lock:
+            for url, entry in results.items():
+                if entry is not None:
+                    self._backends[url] = entry
+                else:
+                    self._backends.pop(url, None)
+
+        self._save_cache()
+        return self.backends
+
+    def refresh(self, apis: Dict[str, AbstractAPI]) -> Dict[str, BackendInventory]:
+        # re-query all hosts (no cache, no host ping), hosts that fail keep their
+        # last known models, marked stale, until they answer again
+        def refresh_one(url: str, api: AbstractAPI) -> Optional[BackendInventory]:
+            try:
+                return self.query(url, api)
+            except Exception as e:
+                old = self.backends.get(url)
+                if old is not None and not old.stale:
+                    self.logger.warning(
+                        f"SD host {url} did not answer, keeping its last known models: {e}"
+                    )
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(len(apis), 1)) as executor:
+            results = dict(
+                zip(apis.keys(), executor.map(refresh_one, apis.keys(), apis.values()))
+            )
+
+        with self._lock:
+            for url, entry in results.items():
+                old = self._backends.get(url)
+                if entry is None:
+                    if old is not None:
+                        self._backends[url] = replace(old, stale=True)
+                    continue
+                self._backends[url] = entry
+                if old is None:
+                    self.logger.info(f"SD host {url} added to inventory")
+                elif old.stale:
+                    self.logger.info(f"SD host {url} answers again, inventory updated")
+                elif old.models != entry.models:
+                    self.logger.info(f"Updated model inventory of SD host {url}")
+
+        self._save_cache()
+        return self.backends
+
+    def start_refresh(self, apis: Dict[str, AbstractAPI], interval: Optional[int] = None):
+        # periodically re-query the hosts in a daemon thread
+        interval = interval or Settings.server.model_refresh_interval
+        if self._refresh_thread is not None or not interval:
+            return
+
+        def _refresh_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh(apis)
+                except Exception as e:
+                    self.logger.error(f"Model inventory refresh failed: {e}")
+
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(
+            target=_refresh_loop, name="model-inventory", daemon=True
+        )
+        self._refresh_thread.start()
+        self.logger.info(f"Model inventory refresh started, interval={interval}s")
+
+    def stop_refresh(self):
+        self._stop.set()
+        self._refresh_thread = None
+
+    # ---------------------------------------
+    # lookups
+    # ---------------------------------------
+    def names(self, model_type: ModelType) -> Optional[List[str]]:
+        # union of the model names of all hosts, None if no host lists them
+        names, known = [], False
+        for backend in self.backends.values():
+            backend_names = backend.models.get(model_type.value)
+            if backend_names is None:
+                continue
+            known = True
+            names.extend(n for n in backend_names if n not in names)
+        return names if known else None
+
+    def backends_with(
+        self, name: str, model_type: ModelType = ModelType.checkpoint
+    ) -> List[str]:
+        return [
+            url for url, b in self.backends.items() if b.has_model(name, model_type)
+        ]
+
+
+ModelInventory = _ModelInventory()  # singleton instance
@@ -0,0 +1,92 @@
+import time
+import random
+from typing import Callable, Optional, TypeVar
+
+from app.settings import Settings
+from app.utils.logger import logger
+
+__all__ = ["DeadlineExceededError", "Deadline", "job_budget", "retry_call"]
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(TimeoutError):
+    # raised when a job runs past its deadline (e.g. a prompt dropped by the host)
+    pass
+
+
+def job_budget(
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    frames: Optional[int] = None,
+) -> Optional[float]:
+    # seconds a job may take: job_timeout_base + job_timeout_per_mpixel per
+    # megapixel of each frame, capped at job_timeout_max (None=no deadline)
+    server = Settings.server
+    if not server.job_timeout_max:
+        return None
+    mpixels = (width or 0) * (height or 0) / 1e6 * max(frames or 1, 1)
+    budget = (server.job_timeout_base or 0) + (server.job_timeout_per_mpixel or 0) * mpixels
+    return min(budget, server.job_timeout_max)
+
+
+# End-to-end deadline of a job, shared by all requests of the job
+# (each request waits at most request_timeout, or what is left of the job)
+class Deadline:
+    def __init__(self, seconds: Optional[float]):
+        self.seconds = seconds
+        self._expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def __repr__(self):
+        return f"<Deadline {self.seconds}s remaining={self.remaining}>"
+
+    @property
+    def remaining(self) -> Optional[float]:
+        if self._expires_at is None:
+            return None
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining == 0.0
+
+    def timeout(self, request_timeout: Optional[float] = None) -> Optional[float]:
+        # socket timeout for the next request
+        request_timeout = request_timeout or Settings.server.request_timeout or None
+        remaining = self.remaining
+        if remaining is None:
+            return request_timeout
+        if request_timeout is None:
+            return max(remaining, 0.001)
+        return max(min(remaining, request_timeout), 0.001)
+
+    def check(self, what: str = "job"):
+        if self.expired:
+            raise DeadlineExceededError(f"{what} exceeded its deadline of {self.seconds:.0f}s")
+
+
+def retry_call(
+    func: Callable[[], T],
+    retry_on: Callable[[Exception], bool],
+    deadline: Optional[Deadline] = None,
+    attempts: Optional[int] = None,
+    backoff: Optional[float] = None,
+    what: str = "request",
+) -> T:
+    # call func, retried on errors where retry_on(e) is True, with exponential
+    # backoff and full jitter (attempts/backoff default to the server settings)
+    attempts = max(attempts or Settings.server.request_retries or 1, 1)
+    backoff = Settings.server.retry_backoff if backoff is None else backoff
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts or not retry_on(e):
+                raise
+            delay = random.uniform(0, (backoff or 0) * 2 ** (attempt - 1))
+            if deadline is not None:
+                deadline.check(what)
+                if deadline.remaining is not None:
+                    delay = min(delay, deadline.remaining)
+            logger.warning(f"{what} failed ({e}), retry {attempt}/{attempts - 1}")
+            time.sleep(delay)
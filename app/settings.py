@@ -9,6 +9,8 @@ from typing import Optional, Literal, List, Dict, TextIO, cast
 __all__ = [
     "Settings",
     "GroupCommands",
+    "ModelType",
+    "BackendModel",
     "Type_SingleModel",
     "Txt2ImgSingleModel",
     "Img2ImgSingleModel",
@@ -33,6 +35,16 @@ class ModelType(Enum):
 
 
 # Default settings
+class BackendModel(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 8188
+    sd_api_type: str = "comfyUI"
+
+    @property
+    def url(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
 class ServerModel(BaseModel):
     host: Optional[str] = "127.0.0.1"
     port: Optional[int] = 8188
@@ -43,6 +55,54 @@ class ServerModel(BaseModel):
     view_timeout: Optional[int] = 3600
     allow_dm: Optional[bool] = False
     max_jobs: Optional[int] = 50
+    num_workers: Optional[int] = None  # task queue workers, None=one per SD host
+    settings_watch_interval: Optional[int] = 10  # seconds, 0=no hot settings reload
+    # multiple SD hosts, if empty the single host/port/sd_api_type above is used
+    backends: List[BackendModel] = []
+    model_cache_ttl: Optional[int] = 3600  # seconds, 0=always query the backends
+    model_refresh_interval: Optional[int] = 300  # seconds, 0=no live model refresh
+    model_miss_refresh_interval: Optional[float] = 30  # seconds between refreshes for unknown models
+    keep_missing_models: bool = True  # keep models no backend has (yet), else remove
+    affinity_max_skips: Optional[int] = 4  # queued jobs grouped by model, 0=FIFO
+    batch_max_size: Optional[int] = 1  # compatible txt2img jobs run as one, 1=off
+    batch_window: Optional[float] = 0.05  # seconds a worker waits to fill a batch
+    conditioning_cache: bool = False  # encode style negatives apart, cached by ComfyUI
+    model_swap_penalty: Optional[float] = 2.0  # jobs in flight, worth a model swap
+    health_check_interval: Optional[float] = 5  # seconds, 0=no SD host health probes
+    health_check_timeout: Optional[float] = 2  # seconds
+    breaker_failure_threshold: Optional[int] = 3  # consecutive failures, host is down
+    breaker_open_seconds: Optional[float] = 5  # no jobs to a down host (doubles)
+    breaker_max_open_seconds: Optional[float] = 120
+    breaker_ramp_successes: Optional[int] = 3  # jobs until a recovered host is healthy
+    backend_hold_seconds: Optional[float] = 60  # jobs wait for a host, 0=fail at once
+    request_timeout: Optional[float] = 30  # seconds per SD host request / websocket read
+    request_retries: Optional[int] = 3  # attempts of idempotent requests
+    retry_backoff: Optional[float] = 0.5  # seconds, doubles per retry (with jitter)
+    job_timeout_base: Optional[float] = 120  # seconds per job
+    job_timeout_per_mpixel: Optional[float] = 30  # seconds per megapixel of each frame
+    job_timeout_max: Optional[float] = 3600  # seconds, 0=no job deadline
+    download_workers: Optional[int] = 4  # parallel output downloads per job
+    http_pool_size: Optional[int] = 8  # pooled connections per A1111 host, 0=unlimited
+    progress_poll_min: Optional[float] = 0.25  # seconds, A1111 progress while sampling
+    progress_poll_max: Optional[float] = 2  # seconds, while queued / loading
+    live_previews: bool = False  # show sampler previews in the status message
+    preview_every_steps: Optional[int] = 5  # sampler steps between previews
+    preview_min_interval: Optional[float] = 3  # seconds between preview edits
+    preview_max_size: Optional[int] = 256  # pixels, longest side of a preview
+    incremental_delivery: bool = False  # show each image of a batch when it is done
+    prompt_max_chunks: Optional[int] = 3  # prompts cut to CLIP chunks (75 tokens), 0=off
+    prompt_pool_size: Optional[int] = 32  # random prompts generated ahead, 0=off
+    prompt_pool_batch: Optional[int] = 8  # random prompts per model run
+    # words not allowed in prompts ("word*": any ending), rejected or removed
+    content_filter: List[str] = ["nude", "naked", "nsfw", "porn*"]
+    content_filter_action: Literal["reject", "remove"] = "reject"
+
+    def get_backends(self) -> List[BackendModel]:
+        if self.backends:
+            return self.backends
+        return [
+            BackendModel(host=self.host, port=self.port, sd_api_type=self.sd_api_type)
+        ]
 
     @field_serializer("discord_bot_key", when_used="json")
     def _hide_discord_bot_key(cls, v: str) -> str:
@@ -57,6 +117,14 @@ class FilesModel(BaseModel):
     default_image_type: Literal["jpg", "png", "jpeg"] = "png"
     video_types: List[str] = ["gif", "mp4"]
     default_video_type: Literal["gif", "mp4"] = "gif"
+    max_upload_mb: Optional[float] = 25  # largest accepted input attachment
+    max_storage_mb: Optional[int] = 10240  # size budget of image_folder, 0=unbounded
+    input_retention_hours: Optional[float] = 24  # uploaded images, 0=keep
+    output_retention_hours: Optional[float] = 168  # generated images, 0=keep
+    storage_gc_interval: Optional[int] = 600  # seconds, 0=disable background GC
+    storage_gc_grace_seconds: Optional[int] = 300  # never evict newer files
+    shard_image_folder: bool = False  # use <tier>/<xx>/ sub-folders
+    model_cache_file: Optional[str] = "./.model_cache.json"  # None=no cache
 
 
 class Type_SingleModel(BaseModel):
@@ -329,7 +397,10 @@ class _Settings(BaseModel):
         valid_loras: Optional[List[str]] = [],
         valid_upscalers: Optional[List[str]] = [],
         purge_and_warn: bool = True,
+        keep_missing: bool = False,
     ) -> bool:
+        # keep_missing: only warn, models may become available later
+        # (the model inventory is refreshed, jobs are routed to hosts with the model)
         messages = {}
         for k in self.__dict__.keys():
             if hasattr(self.__dict__[k], "models"):
@@ -353,7 +424,10 @@ class _Settings(BaseModel):
                             )
 
         if messages:
-            if purge_and_warn:
+            if keep_missing:
+                for message in messages.values():
+                    logger.warning(f"{message} on any SD host (yet), keeping model.")
+            elif purge_and_warn:
                 for (k, name), message in messages.items():
                     logger.warning(f"{message}, removing from list of models.")
                     self.__dict__[k].models.pop(name)
@@ -369,21 +443,29 @@ class _Settings(BaseModel):
     def check_for_valid_workflows(
         self, workflow_folder: str | os.PathLike, purge_and_warn: bool = True
     ) -> bool:
+        # list the folder once, instead of a stat per workflow file
+        # (names with a sub-folder are checked individually)
+        try:
+            existing = set(os.listdir(workflow_folder))
+        except FileNotFoundError:
+            existing = set()
+
+        def exists(file_name: str) -> bool:
+            if os.path.basename(file_name) != file_name:
+                return os.path.exists(os.path.join(workflow_folder, file_name))
+            return file_name in existing
+
         messages = {}
         for k in self.__dict__.keys():
             if hasattr(self.__dict__[k], "models"):
                 for name, model in self.__dict__[k].models.items():
                     model: Type_SingleModel = cast(Type_SingleModel, model)
-                    if not os.path.exists(
-                        os.path.join(workflow_folder, model.workflow_api)
-                    ):
+                    if not exists(model.workflow_api):
                         messages[(k, name)] = (
                             f"Model {name}.{model.display_name} workflow_api did not exist: '{model.workflow_api}'"
                         )
 
-                    if not os.path.exists(
-                        os.path.join(workflow_folder, model.workflow_api_map)
-                    ):
+                    if not exists(model.workflow_api_map):
                         messages[(k, name)] = (
                             f"Model {name}.{model.display_name} workflow_api_map did not exist: '{model.workflow_api_map}'"
                         )
@@ -405,6 +487,17 @@ class _Settings(BaseModel):
     def reset(self):
         self.__dict__.update(self.__class__().__dict__)
 
+    def apply(self, new_self: "_Settings"):
+        # swap in a validated settings snapshot (hot reload): the sub-models are
+        # replaced and not mutated, so model definitions already taken by running
+        # jobs keep their values. The sub-models are swapped one at a time, apply is
+        # not atomic across sections (a reader may see a new section next to an old
+        # one), each section itself is always consistent
+        self._check_commands(new_self)
+        for name in self.__class__.model_fields:
+            self.__dict__[name] = new_self.__dict__[name]
+        self.__pydantic_fields_set__ = set(new_self.__pydantic_fields_set__)
+
     def reload(
         self,
         dot_env: str | os.PathLike | TextIO = None,
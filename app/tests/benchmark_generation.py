@@ -0,0 +1,202 @@
+import sys
+import math
+import time
+import asyncio
+import argparse
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from app.settings import Settings
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.utils.async_task_queue import _AsyncTaskQueue, Task, TaskState
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+__all__ = ["BenchmarkResult", "run_benchmark", "main"]
+
+
+# Generation benchmark: AsyncTaskQueue + ComfyUIAPI against the mock ComfyUI server
+# - `concurrency` simulated users each submit jobs back-to-back (waiting on the result)
+# - the per-stage breakdown matches tasks with server records by seed:
+#     queue_wait: task created -> task started (bot queue)
+#     submit:     task started -> prompt received by server (ws connect + /prompt)
+#     backend:    prompt received -> execution finished (server queue + execution)
+#     fetch:      execution finished -> task finished (ws notify + /history + /view + save)
+#   `submit` + `fetch` is the client overhead of the bot
+#
+# usage: python -m app.tests.benchmark_generation --concurrency 1 4 16 --jobs 64
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    # nearest-rank percentile
+    values = sorted(values)
+    k = min(len(values), max(1, math.ceil(pct / 100 * len(values))))
+    return values[k - 1]
+
+
+@dataclass
+class BenchmarkResult:
+    concurrency: int
+    num_workers: int
+    jobs: int = 0
+    failed: int = 0
+    rejected: int = 0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    stages: Dict[str, List[float]] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        return self.jobs / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "workers": self.num_workers,
+            "jobs": self.jobs,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "throughput": self.throughput,
+            "p50": percentile(self.latencies, 50),
+            "p99": percentile(self.latencies, 99),
+            **{
+                f"{stage}_mean": sum(v) / len(v) if v else float("nan")
+                for stage, v in self.stages.items()
+            },
+        }
+
+
+def _prompt_seed(prompt: Dict):
+    for node in prompt.values():
+        if "seed" in node.get("inputs", {}):
+            return node["inputs"]["seed"]
+    return None
+
+
+def _stage_times(tasks: List[Task], server: MockComfyUIServer) -> Dict[str, List[float]]:
+    records = {_prompt_seed(r.prompt): r for r in server.prompts.values()}
+    stages = {"queue_wait": [], "submit": [], "backend": [], "fetch": []}
+    for task in tasks:
+        record = records.get(task.kwargs["seed"])
+        if task.state != TaskState.COMPLETED or record is None or not record.finished_at:
+            continue
+        stages["queue_wait"].append(task.started_at - task.created_at)
+        stages["submit"].append(record.received_at - task.started_at)
+        stages["backend"].append(record.finished_at - record.received_at)
+        stages["fetch"].append(task.finished_at - record.finished_at)
+    return stages
+
+
+async def _run(
+    api: ComfyUIAPI,
+    server: MockComfyUIServer,
+    concurrency: int,
+    n_jobs: int,
+    num_workers: int,
+) -> BenchmarkResult:
+    queue = _AsyncTaskQueue(num_workers=num_workers, max_jobs=max(n_jobs, 1))
+    result = BenchmarkResult(concurrency=concurrency, num_workers=num_workers)
+    tasks: List[Task] = []
+    seeds = iter(range(1, n_jobs + 1))
+
+    async def user(user_id: int):
+        for seed in seeds:
+            task = await queue.create_and_add_task(
+                api.generate_image,
+                task_owner=f"user{user_id}",
+                kwargs=dict(prompt=f"benchmark {seed}", seed=seed),
+            )
+            if task is None:
+                result.rejected += 1
+                continue
+            tasks.append(task)
+            await task.wait_result()
+            if task.state == TaskState.COMPLETED:
+                result.jobs += 1
+                result.latencies.append(task.finished_at - task.created_at)
+            else:
+                result.failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[user(i) for i in range(concurrency)])
+    result.elapsed = time.perf_counter() - start
+    queue.cancel_all_tasks()
+
+    result.stages = _stage_times(tasks, server)
+    return result
+
+
+def run_benchmark(
+    server: MockComfyUIServer,
+    *,
+    concurrency: int = 1,
+    n_jobs: int = 16,
+    num_workers: int = 1,
+) -> BenchmarkResult:
+    # generated images are written to a temporary folder, not the bot image folder
+    old_files = Settings.files.model_copy()
+    with tempfile.TemporaryDirectory() as tmp:
+        Settings.files.image_folder = tmp
+        try:
+            api = ComfyUIAPI(server.url)
+            return asyncio.run(_run(api, server, concurrency, n_jobs, num_workers))
+        finally:
+            Settings.files = old_files
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    columns = [
+        ("concurrency", "{:>11d}"),
+        ("workers", "{:>7d}"),
+        ("jobs", "{:>5d}"),
+        ("failed", "{:>6d}"),
+        ("throughput", "{:>10.2f}"),
+        ("p50", "{:>8.4f}"),
+        ("p99", "{:>8.4f}"),
+        ("queue_wait_mean", "{:>15.4f}"),
+        ("submit_mean", "{:>11.4f}"),
+        ("backend_mean", "{:>12.4f}"),
+        ("fetch_mean", "{:>10.4f}"),
+    ]
+    lines = [" ".join(f"{name:>{len(fmt.format(0))}}" for name, fmt in columns)]
+    for result in results:
+        summary = result.summary()
+        lines.append(" ".join(fmt.format(summary[name]) for name, fmt in columns))
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark generation on a mock ComfyUI")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--step-latency", type=float, default=0.005)
+    parser.add_argument("--output-bytes", type=int, default=0)
+    parser.add_argument("--output-size", type=int, nargs=2, default=[512, 512])
+    args = parser.parse_args(argv)
+
+    config = MockComfyUIConfig(
+        steps=args.steps,
+        step_latency=args.step_latency,
+        output_bytes=args.output_bytes,
+        output_size=tuple(args.output_size),
+    )
+    results = []
+    for concurrency in args.concurrency:
+        with MockComfyUIServer(config) as server:
+            results.append(
+                run_benchmark(
+                    server,
+                    concurrency=concurrency,
+                    n_jobs=args.jobs,
+                    num_workers=args.workers,
+                )
+            )
+
+    print(format_results(results))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,219 @@
+import time
+import asyncio
+import discord
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+__all__ = [
+    "CallRecord",
+    "CallRecorder",
+    "FakeUser",
+    "FakeMessage",
+    "FakeInteraction",
+    "FakeApplicationContext",
+]
+
+
+# In-process stand-ins for the py-cord objects used by the commands and views
+# - only the methods called by the bot are implemented
+#   (respond, response.send_message, edit_original_response, followup.send, ...)
+# - every call is recorded with a timestamp in a (shared) CallRecorder,
+#   so latency and edit-rate can be measured offline
+# - `latency` adds a simulated Discord round trip to every call
+@dataclass
+class CallRecord:
+    name: str
+    t: float  # seconds since the recorder was created
+    interaction_id: int
+    user_id: int
+    kwargs: Dict = field(default_factory=dict)
+
+
+class CallRecorder:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[CallRecord] = []
+        self._t0 = time.perf_counter()
+        self._next_id = 0
+
+    @property
+    def now(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    async def record(self, name: str, interaction_id: int, user_id: int, **kwargs):
+        # discord.File objects are replaced by their names (and closed, as discord would)
+        for key in ("file", "files"):
+            if kwargs.get(key) is None:
+                continue
+            files = kwargs[key] if isinstance(kwargs[key], list) else [kwargs[key]]
+            for f in files:
+                f.close()
+            kwargs[key] = [f.filename for f in files]
+
+        self.calls.append(
+            CallRecord(
+                name=name,
+                t=self.now,
+                interaction_id=interaction_id,
+                user_id=user_id,
+                kwargs=kwargs,
+            )
+        )
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def filter(
+        self,
+        name: str = None,
+        interaction_id: int = None,
+        user_id: int = None,
+    ) -> List[CallRecord]:
+        return [
+            c
+            for c in self.calls
+            if (name is None or c.name == name)
+            and (interaction_id is None or c.interaction_id == interaction_id)
+            and (user_id is None or c.user_id == user_id)
+        ]
+
+    def views(self, user_id: int = None) -> List[discord.ui.View]:
+        return [
+            c.kwargs["view"]
+            for c in self.filter(user_id=user_id)
+            if c.kwargs.get("view") is not None
+        ]
+
+
+@dataclass
+class FakeUser:
+    id: int
+    name: str = "user"
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+@dataclass
+class FakeGuild:
+    id: int = 1
+    name: str = "guild"
+
+
+class FakeMessage:
+    def __init__(self, recorder: CallRecorder, interaction_id: int, user: FakeUser):
+        self._recorder = recorder
+        self._interaction_id = interaction_id
+        self.id = recorder.new_id()
+        self.author = user
+        self.reactions: List[str] = []
+
+    async def _record(self, name: str, **kwargs):
+        await self._recorder.record(name, self._interaction_id, self.author.id, **kwargs)
+
+    async def add_reaction(self, emoji: str):
+        self.reactions.append(emoji)
+        await self._record("message.add_reaction", emoji=emoji)
+
+    async def edit(self, **kwargs):
+        await self._record("message.edit", **kwargs)
+        return self
+
+    async def delete(self, **kwargs):
+        await self._record("message.delete", **kwargs)
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: str = None, **kwargs):
+        self._done = True
+        await self._interaction._record("response.send_message", content=content, **kwargs)
+        return self._interaction
+
+    async def defer(self, **kwargs):
+        self._done = True
+        await self._interaction._record("response.defer", **kwargs)
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+        await self._interaction._record("response.edit_message", **kwargs)
+
+
+class FakeWebhook:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        await self._interaction._record("followup.send", content=content, **kwargs)
+        return FakeMessage(
+            self._interaction._recorder, self._interaction.id, self._interaction.user
+        )
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser, recorder: CallRecorder, guild: Any = FakeGuild()):
+        self._recorder = recorder
+        self.id = recorder.new_id()
+        self.user = user
+        self.guild = guild
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeWebhook(self)
+        self.original_deleted = False
+
+    async def _record(self, name: str, **kwargs):
+        await self._recorder.record(name, self.id, self.user.id, **kwargs)
+
+    async def original_response(self) -> FakeMessage:
+        return FakeMessage(self._recorder, self.id, self.user)
+
+    async def edit_original_response(self, **kwargs):
+        await self._record("edit_original_response", **kwargs)
+        return await self.original_response()
+
+    async def delete_original_response(self, **kwargs):
+        self.original_deleted = True
+        await self._record("delete_original_response", **kwargs)
+
+
+class FakeApplicationContext:
+    # the first `respond` answers the interaction (returns the interaction),
+    # following calls are sent as followup messages (as in py-cord)
+    def __init__(
+        self,
+        user: FakeUser,
+        recorder: CallRecorder,
+        guild: Optional[Any] = FakeGuild(),
+    ):
+        self.author = user
+        self.user = user
+        self.guild = guild
+        self.interaction = FakeInteraction(user, recorder, guild)
+        self.followup = self.interaction.followup
+
+    @property
+    def response(self) -> FakeInteractionResponse:
+        return self.interaction.response
+
+    async def defer(self, **kwargs):
+        await self.interaction.response.defer(**kwargs)
+
+    async def respond(self, content: str = None, **kwargs):
+        if not self.interaction.response.is_done():
+            return await self.interaction.response.send_message(content, **kwargs)
+        return await self.followup.send(content, **kwargs)
+
+    async def edit(self, **kwargs):
+        return await self.interaction.edit_original_response(**kwargs)
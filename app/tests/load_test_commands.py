@@ -0,0 +1,216 @@
+import sys
+import random
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import discord
+from unittest import mock
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from app.settings import Settings
+from app.sd_apis.api_handler import Sd
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.utils.async_task_queue import AsyncTaskQueue, _AsyncTaskQueue
+from app.utils import Orientation, PromptConstants
+from app.commands.txt2img_cmds import Txt2ImageCommands
+from .fake_discord import CallRecorder, FakeApplicationContext, FakeInteraction, FakeUser
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+from .benchmark_generation import percentile
+
+__all__ = ["LoadTestResult", "run_load_test", "main"]
+
+
+# End-to-end load test of the txt2img command and GenerateImageView buttons
+# - simulated users run `/txt2img image`, then press random buttons of the resulting view
+# - discord is replaced by the fake interaction layer, SD by the mock ComfyUI server
+# - reports end-to-end latency per interaction, edit-rate (edit_original_response / s)
+#   and queue fairness (Jain's index over the mean latency per user)
+# - time to first image: first response -> first message or edit with files
+#
+# usage: python -m app.tests.load_test_commands --users 100 --presses 1
+@dataclass
+class LoadTestResult:
+    users: int
+    elapsed: float = 0.0
+    latencies: Dict[int, List[float]] = field(default_factory=dict)  # user_id: [s]
+    first_latencies: List[float] = field(default_factory=list)  # [s], to the first image
+    edits: int = 0
+    max_edit_rate: float = 0.0  # edits/s of the busiest interaction
+    rejected: int = 0  # requests refused with "queue full"
+    errors: int = 0
+
+    @property
+    def all_latencies(self) -> List[float]:
+        return [t for v in self.latencies.values() for t in v]
+
+    @property
+    def fairness(self) -> float:
+        means = [sum(v) / len(v) for v in self.latencies.values() if v]
+        if not means:
+            return float("nan")
+        return sum(means) ** 2 / (len(means) * sum(m * m for m in means))
+
+    def summary(self) -> Dict:
+        latencies = self.all_latencies
+        return {
+            "users": self.users,
+            "interactions": len(latencies),
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "elapsed": self.elapsed,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "p50_first": percentile(self.first_latencies, 50),
+            "edit_rate": self.edits / self.elapsed if self.elapsed else 0.0,
+            "max_edit_rate": self.max_edit_rate,
+            "fairness": self.fairness,
+        }
+
+
+@contextlib.contextmanager
+def patched_task_queue(queue: _AsyncTaskQueue):
+    # the AsyncTaskQueue singleton is bound to the event loop it first ran in,
+    # replace it in all modules that imported it
+    with contextlib.ExitStack() as stack:
+        for module in list(sys.modules.values()):
+            if (
+                getattr(module, "__name__", "").startswith("app.")
+                and getattr(module, "AsyncTaskQueue", None) is AsyncTaskQueue
+            ):
+                stack.enter_context(mock.patch.object(module, "AsyncTaskQueue", queue))
+        yield queue
+
+
+def _collect(recorder: CallRecorder, result: LoadTestResult):
+    # latency: first response of an interaction -> last message with files
+    by_interaction: Dict[int, List] = {}
+    for call in recorder.calls:
+        by_interaction.setdefault(call.interaction_id, []).append(call)
+
+    for calls in by_interaction.values():
+        edits = [c for c in calls if c.name == "edit_original_response"]
+        result.edits += len(edits)
+        if len(edits) > 1 and edits[-1].t > edits[0].t:
+            result.max_edit_rate = max(
+                result.max_edit_rate, (len(edits) - 1) / (edits[-1].t - edits[0].t)
+            )
+        if any("queue full" in (c.kwargs.get("content") or "") for c in edits):
+            result.rejected += 1
+            continue
+
+        sent = [c for c in calls if c.kwargs.get("files") or c.kwargs.get("file")]
+        if sent:
+            result.latencies.setdefault(calls[0].user_id, []).append(
+                sent[-1].t - calls[0].t
+            )
+            result.first_latencies.append(sent[0].t - calls[0].t)
+
+
+async def _run(
+    n_users: int,
+    presses: int,
+    max_jobs: int,
+    latency: float,
+    seed: int,
+) -> LoadTestResult:
+    rng = random.Random(seed)
+    recorder = CallRecorder(latency=latency)
+    result = LoadTestResult(users=n_users)
+    commands = Txt2ImageCommands(
+        discord.SlashCommandGroup("txt2img", "load test"), commands=["image"]
+    )
+    model = list(Settings.txt2img.models.keys())[0]
+    styles = PromptConstants.get_style_presets()
+
+    async def user(user_id: int):
+        fake_user = FakeUser(id=user_id, name=f"user{user_id}")
+        try:
+            await commands.generate_image(
+                FakeApplicationContext(fake_user, recorder),
+                prompt=f"load test {user_id}",
+                style=rng.choice(styles),
+                model=model,
+                orientation=Orientation.SQUARE,
+                negative_prompt="",
+            )
+            for _ in range(presses):
+                views = recorder.views(user_id=user_id)
+                buttons = [b for v in views for b in v.children]
+                if not buttons:
+                    break
+                await rng.choice(buttons).callback(FakeInteraction(fake_user, recorder))
+        except Exception:
+            result.errors += 1
+
+    with patched_task_queue(_AsyncTaskQueue(num_workers=1, max_jobs=max_jobs)) as queue:
+        start = recorder.now
+        await asyncio.gather(*[user(i + 1) for i in range(n_users)])
+        result.elapsed = recorder.now - start
+        queue.cancel_all_tasks()
+
+    for view in recorder.views():
+        view.stop()
+
+    _collect(recorder, result)
+    return result
+
+
+def run_load_test(
+    server: MockComfyUIServer,
+    *,
+    n_users: int = 10,
+    presses: int = 1,
+    max_jobs: int = None,
+    latency: float = 0.0,
+    seed: int = 0,
+) -> LoadTestResult:
+    old_api = getattr(Sd, "api", None)
+    old_files = Settings.files.model_copy()
+    with tempfile.TemporaryDirectory() as tmp:
+        Settings.files.image_folder = tmp
+        Sd.api = ComfyUIAPI(server.url)
+        try:
+            return asyncio.run(
+                _run(
+                    n_users,
+                    presses,
+                    max_jobs or Settings.server.max_jobs,
+                    latency,
+                    seed,
+                )
+            )
+        finally:
+            Settings.files = old_files
+            Sd.api = old_api
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Load test commands with fake discord")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--presses", type=int, default=1)
+    parser.add_argument("--max-jobs", type=int, default=None)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--step-latency", type=float, default=0.002)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = MockComfyUIConfig(steps=10, step_latency=args.step_latency)
+    with MockComfyUIServer(config) as server:
+        result = run_load_test(
+            server,
+            n_users=args.users,
+            presses=args.presses,
+            max_jobs=args.max_jobs,
+            latency=args.latency,
+            seed=args.seed,
+        )
+
+    for key, value in result.summary().items():
+        print(f"{key:>14}: {value:.4f}" if isinstance(value, float) else f"{key:>14}: {value}")
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
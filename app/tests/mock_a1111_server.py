@@ -0,0 +1,211 @@
+import io
+import json
+import base64
+import socket
+import asyncio
+import threading
+from aiohttp import web
+from dataclasses import dataclass, field
+from typing import Dict, List
+from PIL import Image, PngImagePlugin
+
+__all__ = ["MockA1111Config", "MockA1111Server"]
+
+
+# Local stand-in for an A1111 webui server, used by tests
+# - implements the /sdapi/v1 routes used by the bot (txt2img, model lists,
+#   extra-single-image, png-info, progress, interrupt)
+# - images are returned as base64 PNGs, the parameters in the `info` field
+# - txt2img runs `steps` sampler steps (progress), an interrupt ends it early
+@dataclass
+class MockA1111Config:
+    image_size: tuple = (64, 64)  # size of output images (w, h)
+    return_grid: bool = True  # batches return a grid image first (as A1111)
+    embed_parameters: bool = False  # write the infotext into the PNGs
+    steps: int = 4  # sampler steps per txt2img request
+    step_latency: float = 0.0  # seconds per sampler step
+    send_previews: bool = False  # /progress returns a current_image per step
+    checkpoints: List[str] = field(
+        default_factory=lambda: ["v1-5-pruned-emaonly.ckpt", "sdxl/sd_xl_base_1.0.safetensors"]
+    )
+    loras: List[str] = field(default_factory=lambda: ["add_detail"])
+    upscalers: List[str] = field(default_factory=lambda: ["4x_NMKD-Siax_200k.pth"])
+
+
+class MockA1111Server:
+    def __init__(self, config: MockA1111Config = None, host: str = "127.0.0.1"):
+        self.config = config or MockA1111Config()
+        self.host = host
+        self.port: int = None
+        self.requests: List[Dict] = []  # txt2img payloads
+        self.request_counts: Dict[str, int] = {}
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._runner: web.AppRunner = None
+        self._ready = threading.Event()
+        self._step = 0
+        self._running = False
+        self.interrupted = 0  # number of interrupted jobs
+        self._interrupt = False
+
+    @property
+    def url(self) -> str:
+        # same format as the webui_url of the SD apis (no scheme)
+        return f"{self.host}:{self.port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------------------------------------
+    # server lifetime (runs in its own thread)
+    # ---------------------------------------
+    def start(self):
+        with socket.socket() as s:
+            s.bind((self.host, 0))
+            self.port = s.getsockname()[1]
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+            self._loop = None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._startup())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _startup(self):
+        app = web.Application(client_max_size=2**30)
+        app.router.add_get("/", self._index)
+        app.router.add_post("/sdapi/v1/txt2img", self._txt2img)
+        app.router.add_post("/sdapi/v1/png-info", self._png_info)
+        app.router.add_post("/sdapi/v1/extra-single-image", self._extra_single_image)
+        app.router.add_get("/sdapi/v1/sd-models", self._sd_models)
+        app.router.add_get("/sdapi/v1/loras", self._loras)
+        app.router.add_get("/sdapi/v1/upscalers", self._upscalers)
+        app.router.add_get("/sdapi/v1/progress", self._progress)
+        app.router.add_post("/sdapi/v1/interrupt", self._post_interrupt)
+        app.middlewares.append(self._count_requests)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    @web.middleware
+    async def _count_requests(self, request: web.Request, handler):
+        key = request.path.rsplit("/", 1)[-1] or "/"
+        self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        return await handler(request)
+
+    # ---------------------------------------
+    # HTTP API
+    # ---------------------------------------
+    def _image_b64(self, color: tuple, infotext: str = None) -> str:
+        buffer = io.BytesIO()
+        image = Image.new("RGB", self.config.image_size, color)
+        kwargs = {}
+        if infotext and self.config.embed_parameters:
+            kwargs["pnginfo"] = PngImagePlugin.PngInfo()
+            kwargs["pnginfo"].add_text("parameters", infotext)
+        image.save(buffer, format="PNG", **kwargs)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    async def _index(self, request: web.Request):
+        return web.Response(text="mock A1111")
+
+    async def _txt2img(self, request: web.Request):
+        data = await request.json()
+        self.requests.append(data)
+        self._running, self._interrupt = True, False
+        try:
+            for self._step in range(1, self.config.steps + 1):
+                await asyncio.sleep(self.config.step_latency)
+                if self._interrupt:
+                    self.interrupted += 1
+                    break
+        finally:
+            self._running, self._step = False, 0
+
+        n_images = data.get("n_iter", 1) * data.get("batch_size", 1)
+        seeds = [data["seed"] + i for i in range(n_images)]
+        infotexts = [f"{data['prompt']}\nSteps: {data['steps']}, Seed: {s}" for s in seeds]
+        images = [self._image_b64((i * 20 % 256, 0, 0), t) for i, t in enumerate(infotexts)]
+        if n_images > 1 and self.config.return_grid:
+            images.insert(0, self._image_b64((0, 0, 255), infotexts[0]))
+            infotexts.insert(0, infotexts[0])
+
+        info = {"all_seeds": seeds, "infotexts": infotexts}
+        return web.json_response(
+            {"images": images, "parameters": data, "info": json.dumps(info)}
+        )
+
+    async def _progress(self, request: web.Request):
+        steps = self.config.steps
+        current_image = None
+        if (
+            self._running
+            and self.config.send_previews
+            and request.query.get("skip_current_image") != "true"
+        ):
+            current_image = self._image_b64((0, self._step * 10 % 256, 0))
+        return web.json_response(
+            {
+                "progress": self._step / steps if self._running else 0.0,
+                "eta_relative": (steps - self._step) * self.config.step_latency,
+                "state": {
+                    "job_count": int(self._running),
+                    "sampling_step": self._step,
+                    "sampling_steps": steps,
+                    "interrupted": self._interrupt,
+                },
+                "current_image": current_image,
+            }
+        )
+
+    async def _post_interrupt(self, request: web.Request):
+        if self._running:
+            self._interrupt = True
+        return web.json_response({})
+
+    async def _png_info(self, request: web.Request):
+        return web.json_response({"info": "", "items": {}})
+
+    async def _extra_single_image(self, request: web.Request):
+        data = await request.json()
+        w, h = self.config.image_size
+        factor = int(data.get("upscaling_resize", 4))
+        buffer = io.BytesIO()
+        Image.new("RGB", (w * factor, h * factor)).save(buffer, format="PNG")
+        return web.json_response(
+            {"image": base64.b64encode(buffer.getvalue()).decode("utf-8"), "html_info": ""}
+        )
+
+    async def _sd_models(self, request: web.Request):
+        return web.json_response(
+            [
+                {"title": f"{c} [0123456789]", "model_name": c.rsplit(".", 1)[0], "filename": c}
+                for c in self.config.checkpoints
+            ]
+        )
+
+    async def _loras(self, request: web.Request):
+        return web.json_response(
+            [{"name": l, "alias": l, "path": f"models/Lora/{l}.safetensors"} for l in self.config.loras]
+        )
+
+    async def _upscalers(self, request: web.Request):
+        return web.json_response(
+            [{"name": "None"}] + [{"name": u} for u in self.config.upscalers]
+        )
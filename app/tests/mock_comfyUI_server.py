@@ -0,0 +1,385 @@
+import io
+import json
+import time
+import uuid
+import struct
+import socket
+import asyncio
+import threading
+from aiohttp import web, WSMsgType
+from dataclasses import dataclass, field
+from typing import Dict, List
+from PIL import Image
+
+__all__ = ["MockComfyUIConfig", "MockComfyUIServer"]
+
+
+# Local stand-in for a ComfyUI server, used by tests and benchmarks
+# - implements the HTTP API used by the bot (/prompt, /history, /view, /object_info)
+#   and the /ws websocket, emitting the same message sequence as ComfyUI
+# - prompts are executed one at a time (like a single GPU), with configurable latencies
+@dataclass
+class MockComfyUIConfig:
+    steps: int = 20  # sampler steps per prompt (progress messages)
+    step_latency: float = 0.005  # seconds per sampler step
+    node_latency: float = 0.001  # seconds per (non sampler) node
+    output_bytes: int = 0  # pad output files to (at least) this size
+    output_size: tuple = (64, 64)  # size of output images (w, h)
+    send_previews: bool = False  # send binary preview frames during sampling
+    checkpoints: List[str] = field(
+        default_factory=lambda: ["v1-5-pruned-emaonly.ckpt", "svd.safetensors"]
+    )
+    loras: List[str] = field(default_factory=lambda: ["v2_lora_PanRight.ckpt"])
+    upscalers: List[str] = field(default_factory=lambda: ["4x_NMKD-Siax_200k.pth"])
+    drop_prompts: bool = False  # accept prompts, but never run them (lost prompts)
+    error_node_types: List[str] = field(default_factory=list)  # nodes that fail
+    cache_prompts: bool = False  # identical prompts are cached (execution_cached)
+    cache_loaders: bool = False  # loader nodes seen before are cached, the others run
+    # route (e.g. "view") -> number of requests answered with HTTP 503 (transient errors)
+    fail_requests: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class _PromptRecord:
+    prompt_id: str
+    client_id: str
+    prompt: Dict
+    received_at: float = field(default_factory=time.perf_counter)
+    started_at: float = None
+    finished_at: float = None
+    outputs: Dict = field(default_factory=dict)
+    status: str = "success"
+    deleted: bool = False
+
+
+OUTPUT_NODE_TYPES = {
+    "SaveImage": "images",
+    "PreviewImage": "images",
+    "VHS_VideoCombine": "gifs",
+}
+SAMPLER_NODE_TYPES = {"KSampler", "KSamplerAdvanced", "SamplerCustom"}
+WEBSOCKET_OUTPUT_NODE_TYPES = {"SaveImageWebsocket"}  # images as binary frames
+
+
+class MockComfyUIServer:
+    def __init__(self, config: MockComfyUIConfig = None, host: str = "127.0.0.1"):
+        self.config = config or MockComfyUIConfig()
+        self.host = host
+        self.port: int = None
+        self.prompts: Dict[str, _PromptRecord] = {}
+        self.request_counts: Dict[str, int] = {}
+        self._files: Dict[str, bytes] = {}
+        self._sockets: Dict[str, web.WebSocketResponse] = {}
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._queue: asyncio.Queue = None
+        self._runner: web.AppRunner = None
+        self._ready = threading.Event()
+        self._interrupt = False
+        self._cache: Dict[str, Dict] = {}  # prompt json: outputs
+        self._loader_cache: set = set()  # loader node json
+
+    @property
+    def url(self) -> str:
+        # same format as the webui_url of the SD apis (no scheme)
+        return f"{self.host}:{self.port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---------------------------------------
+    # server lifetime (runs in its own thread)
+    # ---------------------------------------
+    def start(self):
+        # a stopped server starts again on the same port (host back up)
+        if self.port is None:
+            with socket.socket() as s:
+                s.bind((self.host, 0))
+                self.port = s.getsockname()[1]
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+            self._loop = None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._startup())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _startup(self):
+        app = web.Application(client_max_size=2**30)
+        app.router.add_get("/", self._index)
+        app.router.add_post("/prompt", self._post_prompt)
+        app.router.add_get("/history", self._get_history)
+        app.router.add_get("/history/{prompt_id}", self._get_history)
+        app.router.add_get("/view", self._get_view)
+        app.router.add_get("/object_info", self._get_object_info)
+        app.router.add_get("/object_info/{node_class}", self._get_object_info)
+        app.router.add_post("/interrupt", self._post_interrupt)
+        app.router.add_post("/queue", self._post_queue)
+        app.router.add_get("/ws", self._websocket)
+        app.middlewares.append(self._count_requests)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._execute_prompts())
+
+    async def _shutdown(self):
+        self._worker.cancel()
+        for ws in list(self._sockets.values()):
+            await ws.close()
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _count_requests(self, request: web.Request, handler):
+        key = request.path.split("/")[1] or "/"
+        self.request_counts[key] = self.request_counts.get(key, 0) + 1
+        if self.config.fail_requests.get(key, 0) > 0:
+            self.config.fail_requests[key] -= 1
+            return web.Response(status=503, text="mock failure")
+        return await handler(request)
+
+    # ---------------------------------------
+    # HTTP API
+    # ---------------------------------------
+    async def _index(self, request: web.Request):
+        return web.Response(text="mock ComfyUI")
+
+    async def _post_prompt(self, request: web.Request):
+        data = await request.json()
+        record = _PromptRecord(
+            prompt_id=str(uuid.uuid4()),
+            client_id=data.get("client_id"),
+            prompt=data["prompt"],
+        )
+        self.prompts[record.prompt_id] = record
+        if not self.config.drop_prompts:
+            await self._queue.put(record)
+        return web.json_response(
+            {"prompt_id": record.prompt_id, "number": len(self.prompts), "node_errors": {}}
+        )
+
+    def _history_item(self, record: _PromptRecord) -> Dict:
+        return {
+            "prompt": [0, record.prompt_id, record.prompt, {}, list(record.outputs)],
+            "outputs": record.outputs,
+            "status": {
+                "status_str": record.status,
+                "completed": record.status == "success",
+                "messages": [],
+            },
+        }
+
+    async def _get_history(self, request: web.Request):
+        # /history/{prompt_id} or /history (all prompts, the query string is ignored)
+        prompt_id = request.match_info.get("prompt_id")
+        records = (
+            [self.prompts[prompt_id]]
+            if prompt_id in self.prompts
+            else [] if prompt_id else list(self.prompts.values())
+        )
+        return web.json_response(
+            {r.prompt_id: self._history_item(r) for r in records if r.finished_at}
+        )
+
+    async def _get_view(self, request: web.Request):
+        data = self._files.get(request.query.get("filename"))
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data, content_type="image/png")
+
+    async def _get_object_info(self, request: web.Request):
+        info = {
+            "CheckpointLoaderSimple": {
+                "input": {"required": {"ckpt_name": [self.config.checkpoints]}}
+            },
+            "LoraLoader": {"input": {"required": {"lora_name": [self.config.loras]}}},
+            "UpscaleModelLoader": {
+                "input": {"required": {"model_name": [self.config.upscalers]}}
+            },
+        }
+        node_class = request.match_info.get("node_class")
+        if node_class is not None:
+            info = {node_class: info[node_class]} if node_class in info else {}
+        return web.json_response(info)
+
+    async def _post_interrupt(self, request: web.Request):
+        # interrupts the running prompt (if any)
+        self._interrupt = any(
+            r.started_at and not r.finished_at for r in self.prompts.values()
+        )
+        return web.Response()
+
+    async def _post_queue(self, request: web.Request):
+        data = await request.json()
+        for prompt_id in data.get("delete", []):
+            if prompt_id in self.prompts and not self.prompts[prompt_id].started_at:
+                self.prompts[prompt_id].deleted = True
+        return web.Response()
+
+    async def _websocket(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or str(uuid.uuid4())
+        self._sockets[client_id] = ws
+        await ws.send_json(
+            {
+                "type": "status",
+                "data": {"status": {"exec_info": {"queue_remaining": self._queue.qsize()}}, "sid": client_id},
+            }
+        )
+        try:
+            async for msg in ws:
+                if msg.type in (WSMsgType.CLOSE, WSMsgType.ERROR):
+                    break
+        finally:
+            self._sockets.pop(client_id, None)
+        return ws
+
+    # ---------------------------------------
+    # prompt execution
+    # ---------------------------------------
+    async def _send(self, record: _PromptRecord, msg_type: str, data: Dict):
+        ws = self._sockets.get(record.client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_json({"type": msg_type, "data": {**data, "prompt_id": record.prompt_id}})
+
+    async def _send_bytes(self, record: _PromptRecord, data: bytes):
+        ws = self._sockets.get(record.client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_bytes(data)
+
+    def _make_output(self, record: _PromptRecord, node_id: str, node: Dict) -> Dict:
+        inputs = node.get("inputs", {})
+        extension = "gif" if node["class_type"] == "VHS_VideoCombine" else "png"
+        filename = f"ComfyUI_{record.prompt_id[:8]}_{node_id}.{extension}"
+        self._files[filename] = self._image_bytes()
+        return {
+            OUTPUT_NODE_TYPES[node["class_type"]]: [
+                {
+                    "filename": filename,
+                    "subfolder": "",
+                    "type": "output" if inputs.get("save_output", True) else "temp",
+                }
+            ]
+        }
+
+    def _image_bytes(self) -> bytes:
+        with io.BytesIO() as f:
+            Image.new("RGB", self.config.output_size, (128, 64, 32)).save(f, format="PNG")
+            data = f.getvalue()
+        if len(data) < self.config.output_bytes:
+            data += b"\0" * (self.config.output_bytes - len(data))
+        return data
+
+    def _preview_frame(self) -> bytes:
+        with io.BytesIO() as f:
+            Image.new("RGB", (32, 32)).save(f, format="JPEG")
+            return struct.pack(">II", 1, 1) + f.getvalue()
+
+    async def _execute_prompts(self):
+        while True:
+            record: _PromptRecord = await self._queue.get()
+            if record.deleted:
+                continue
+            record.started_at = time.perf_counter()
+            self._interrupt = False
+            await self._send(record, "execution_start", {})
+            cache_key = json.dumps(record.prompt, sort_keys=True)
+            if self.config.cache_prompts and cache_key in self._cache:
+                # all nodes cached: no `executed` messages, outputs in /history only
+                await self._send(record, "execution_cached", {"nodes": list(record.prompt)})
+                record.outputs = dict(self._cache[cache_key])
+            else:
+                cached = self._cached_loaders(record) if self.config.cache_loaders else []
+                if cached:
+                    await self._send(record, "execution_cached", {"nodes": cached})
+                await self._execute_nodes(record, skip=set(cached))
+                if record.status == "success":
+                    self._cache[cache_key] = dict(record.outputs)
+
+            record.finished_at = time.perf_counter()
+            await self._send(record, "executing", {"node": None})
+
+    def _cached_loaders(self, record: _PromptRecord) -> List[str]:
+        # ids of the loader nodes (checkpoint, lora, ...) run by an earlier prompt
+        cached = []
+        for node_id, node in record.prompt.items():
+            if "Loader" not in (node.get("class_type") or ""):
+                continue
+            key = json.dumps(node, sort_keys=True)
+            if key in self._loader_cache:
+                cached.append(node_id)
+            self._loader_cache.add(key)
+        return cached
+
+    async def _execute_nodes(self, record: _PromptRecord, skip: set = frozenset()):
+        executed = []
+        for node_id, node in record.prompt.items():
+            class_type = node.get("class_type")
+            if node_id in skip:
+                continue
+            await self._send(record, "executing", {"node": node_id})
+            if class_type in self.config.error_node_types:
+                record.status = "error"
+                await self._send(
+                    record,
+                    "execution_error",
+                    {
+                        "node_id": node_id,
+                        "node_type": class_type,
+                        "executed": executed,
+                        "exception_type": "RuntimeError",
+                        "exception_message": f"mock failure in {class_type}",
+                        "traceback": [],
+                    },
+                )
+                return
+
+            if class_type in SAMPLER_NODE_TYPES:
+                for step in range(1, self.config.steps + 1):
+                    await asyncio.sleep(self.config.step_latency)
+                    if self._interrupt:
+                        break
+                    await self._send(
+                        record,
+                        "progress",
+                        {"value": step, "max": self.config.steps, "node": node_id},
+                    )
+                    if self.config.send_previews:
+                        await self._send_bytes(record, self._preview_frame())
+            else:
+                await asyncio.sleep(self.config.node_latency)
+
+            if self._interrupt:
+                record.status = "error"
+                await self._send(
+                    record,
+                    "execution_interrupted",
+                    {"node_id": node_id, "node_type": class_type, "executed": executed},
+                )
+                return
+
+            if class_type in WEBSOCKET_OUTPUT_NODE_TYPES:
+                await self._send_bytes(record, struct.pack(">II", 1, 2) + self._image_bytes())
+            elif class_type in OUTPUT_NODE_TYPES:
+                output = self._make_output(record, node_id, node)
+                record.outputs[node_id] = output
+                await self._send(record, "executed", {"node": node_id, "output": output})
+            executed.append(node_id)
@@ -0,0 +1,170 @@
+import io
+import time
+import tempfile
+import unittest
+
+import aiohttp
+from PIL import Image
+
+from app.settings import Settings
+from app.sd_apis.a1111_api import A1111API
+from app.sd_apis.backend_health import is_backend_error
+from app.sd_apis.timeouts import DeadlineExceededError
+from .mock_a1111_server import MockA1111Config, MockA1111Server
+
+
+class TestA1111API(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockA1111Server(MockA1111Config()).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        self._old_server = Settings.server.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        self.server.requests.clear()
+        self.server.request_counts.clear()
+        self.api = A1111API(self.server.url)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.config.embed_parameters = False
+        self.server.config.send_previews = False
+        self.server.config.steps = 4
+        self.server.config.step_latency = 0.0
+        Settings.files = self._old_files
+        Settings.server = self._old_server
+        self._tmp.cleanup()
+
+    def _parameters(self, image) -> str:
+        with Image.open(io.BytesIO(image.image_object)) as pil_image:
+            return pil_image.info.get("parameters")
+
+    def test_generate_image(self):
+        image = self.api.generate_image(
+            prompt="cat",
+            negativeprompt="dog",
+            seed=5,
+            sub_seed=6,
+            variation_strength=0.1,
+            sd_model="v1-5-pruned-emaonly.ckpt",
+            workflow={},  # ComfyUI settings are ignored
+        )
+        self.assertEqual(self._parameters(image), "cat\nSteps: 20, Seed: 5")
+        # the parameters are read from the txt2img response
+        self.assertNotIn("png-info", self.server.request_counts)
+
+        payload = self.server.requests[0]
+        self.assertEqual(payload["subseed"], 6)
+        self.assertEqual(payload["subseed_strength"], 0.1)
+        self.assertEqual(
+            payload["override_settings"], {"sd_model_checkpoint": "v1-5-pruned-emaonly.ckpt"}
+        )
+
+    def test_embedded_parameters(self):
+        # images with parameters written by the host are stored as they are
+        self.server.config.embed_parameters = True
+        image = self.api.generate_image(prompt="cat", negativeprompt="", seed=1, sub_seed=1)
+        self.assertEqual(self._parameters(image), "cat\nSteps: 20, Seed: 1")
+
+    def test_batch(self):
+        images = self.api.generate_images(
+            prompt="cat", negativeprompt="", seed=10, sub_seed=0, n_iter=2, batch_size=2
+        )
+        # the grid image is skipped
+        self.assertEqual(len(images), 4)
+        self.assertEqual(
+            [self._parameters(i).rsplit(" ", 1)[-1] for i in images],
+            ["10", "11", "12", "13"],
+        )
+        self.assertEqual(self.server.request_counts["txt2img"], 1)
+
+    def test_model_names(self):
+        self.assertEqual(
+            self.api.get_checkpoint_names(),
+            ["v1-5-pruned-emaonly.ckpt", "sdxl/sd_xl_base_1.0.safetensors"],
+        )
+        self.assertEqual(self.api.get_lora_names(), ["add_detail"])
+        self.assertEqual(self.api.get_upscaler_names(), ["4x_NMKD-Siax_200k.pth"])
+        self.assertEqual(
+            self.api.get_model_names(),
+            {
+                "checkpoint": ["v1-5-pruned-emaonly.ckpt", "sdxl/sd_xl_base_1.0.safetensors"],
+                "lora": ["add_detail"],
+                "upscaler": ["4x_NMKD-Siax_200k.pth"],
+            },
+        )
+
+    def test_upscale_image(self):
+        image = self.api.generate_image(prompt="cat", negativeprompt="", seed=1, sub_seed=1)
+        self.assertTrue(self.api.set_upscaler_model("4x_NMKD-Siax_200k.pth"))
+        upscaled = self.api.upscale_image(image)
+        self.assertEqual(upscaled.size, (256, 256))
+
+    def test_unsupported(self):
+        with self.assertRaises(NotImplementedError):
+            self.api.generate_image(prompt="cat", seed=1, video_format="gif")
+
+    def test_backend_errors(self):
+        # a host that is down counts against its circuit breaker
+        api = A1111API("127.0.0.1:1")
+        try:
+            with self.assertRaises(Exception) as cm:
+                api.get_checkpoint_names()
+            self.assertTrue(is_backend_error(cm.exception))
+        finally:
+            api.close()
+        error = aiohttp.ClientResponseError(None, (), status=404)
+        self.assertFalse(is_backend_error(error))
+
+    def test_progress_previews(self):
+        self.server.config.steps = 5
+        self.server.config.step_latency = 0.1
+        self.server.config.send_previews = True
+        Settings.server.progress_poll_min = 0.02
+        Settings.server.progress_poll_max = 0.05
+        previews = []
+        self.api.generate_image(
+            prompt="cat",
+            seed=1,
+            on_preview=lambda data, ext, progress: previews.append((data, ext, progress)),
+        )
+        self.assertGreater(len(previews), 1)
+        data, ext, (step, steps) = previews[0]
+        self.assertEqual(ext, "png")
+        self.assertEqual(steps, 5)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (64, 64))
+        # only new preview images are passed on
+        self.assertEqual(len({p[0] for p in previews}), len(previews))
+
+    def test_get_status(self):
+        status = self.api.get_status()
+        self.assertEqual(status["state"]["job_count"], 0)
+        self.assertIsNone(status["current_image"])
+
+    def test_deadline_interrupt(self):
+        # the job is interrupted on the host when the bot gives up on it
+        self.server.config.steps = 100
+        self.server.config.step_latency = 0.05
+        Settings.server.job_timeout_base = 0.3
+        Settings.server.job_timeout_per_mpixel = 0
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceededError):
+            self.api.generate_image(prompt="cat", seed=1)
+        self.assertLess(time.perf_counter() - start, 2)
+        for _ in range(50):
+            if self.server.interrupted:
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.server.interrupted, 1)
+        self.assertEqual(self.server.request_counts["interrupt"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
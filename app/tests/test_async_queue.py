@@ -1,7 +1,9 @@
 import unittest
 import asyncio
 from time import sleep
-from app.utils.async_task_queue import Task, TaskState, _AsyncTaskQueue
+from unittest import mock
+from app.settings import Settings
+from app.utils.async_task_queue import Task, TaskState, _AsyncTaskQueue, as_completed
 
 
 # These test function are intended to be synchronous
@@ -19,6 +21,12 @@ async def async_long_task(delay: int = 5):
     return delay
 
 
+# batch_func of long_task: the args of each task, one result per task
+def long_task_batch(calls):
+    sleep(max(delay for delay, in calls))
+    return [ValueError("bad task") if delay < 0 else delay for delay, in calls]
+
+
 # Note: The following cases test individual methods of the AsyncTaskQueue
 # Due to unittest's conflicting event loops working with the singleton AsyncTaskQueue,
 # a seperate `AQ` instance is created for each test case.
@@ -175,3 +183,156 @@ class TestAsyncTaskQueue(unittest.IsolatedAsyncioTestCase):
 
         # first task was already started when others were canceled, so 8 tasks should be canceled
         self.assertEqual(n_canceled, 8)
+
+    async def test_wait_result_timeout(self):
+        AQ = _AsyncTaskQueue()
+        t = await AQ.create_and_add_task(
+            long_task, task_owner="me", kwargs=dict(delay=0.5)
+        )
+        with self.assertRaises(asyncio.TimeoutError):
+            await t.wait_result(timeout=0.1)
+        # the task keeps running, a later wait gets the result
+        self.assertEqual(await t.wait_result(timeout=5), 0.5)
+        # waiting after the task finished returns at once
+        self.assertEqual(await t.wait_result(timeout=0.01), 0.5)
+
+    async def test_wait_result_failed_and_cancelled(self):
+        AQ = _AsyncTaskQueue()
+        a = await AQ.create_and_add_task(bad_task, task_owner="me")
+        b = await AQ.create_and_add_task(
+            long_task, task_owner="me", kwargs=dict(delay=3)
+        )
+        waiter = asyncio.ensure_future(b.wait_result())
+        await asyncio.sleep(0)
+        b.cancel()
+        self.assertIsNone(await asyncio.wait_for(a.wait_result(), 2))
+        self.assertIsInstance(a.error, ValueError)
+        self.assertIsNone(await asyncio.wait_for(waiter, 2))
+        await AQ.join()
+
+    async def test_as_completed(self):
+        AQ = _AsyncTaskQueue(num_workers=3)
+        tasks = [
+            await AQ.create_and_add_task(
+                long_task, task_owner="me", kwargs=dict(delay=d)
+            )
+            for d in (0.6, 0.1, 0.3)
+        ]
+        order = [t.result async for t in as_completed(tasks)]
+        self.assertEqual(order, [0.1, 0.3, 0.6])
+
+        slow = await AQ.create_and_add_task(
+            long_task, task_owner="me", kwargs=dict(delay=1)
+        )
+        with self.assertRaises(asyncio.TimeoutError):
+            async for _ in as_completed([slow], timeout=0.1):
+                pass
+        await AQ.join()
+
+    async def test_queue_affinity_order(self):
+        old_skips = Settings.server.affinity_max_skips
+        try:
+            for max_skips, expected in [
+                (4, ["A1", "A2", "A3", "B1", "B2"]),
+                (1, ["A1", "A2", "B1", "B2", "A3"]),
+                (0, ["A1", "B1", "A2", "A3", "B2"]),
+            ]:
+                Settings.server.affinity_max_skips = max_skips
+                AQ = _AsyncTaskQueue(max_jobs=10)
+                for name in ["A1", "B1", "A2", "A3", "B2"]:
+                    # put directly, so no workers are started
+                    await AQ.put(
+                        Task(long_task, task_owner=name, affinity_key=name[0])
+                    )
+                order = [AQ.get_nowait().task_owner for _ in range(5)]
+                self.assertEqual(order, expected)
+        finally:
+            Settings.server.affinity_max_skips = old_skips
+
+    async def test_queue_affinity_per_worker(self):
+        # each worker keeps to the model of its own previous task
+        old_skips = Settings.server.affinity_max_skips
+        try:
+            Settings.server.affinity_max_skips = 4
+            AQ = _AsyncTaskQueue(max_jobs=10)
+            for name in ["A1", "B1", "B2", "A2"]:
+                await AQ.put(Task(long_task, task_owner=name, affinity_key=name[0]))
+
+            order = []
+            for worker in ["a", "b", "a", "b"]:
+                # the worker is the asyncio task calling get
+                with mock.patch.object(asyncio, "current_task", return_value=worker):
+                    order.append((worker, AQ.get_nowait().task_owner))
+            self.assertEqual(order, [("a", "A1"), ("b", "B1"), ("a", "A2"), ("b", "B2")])
+        finally:
+            Settings.server.affinity_max_skips = old_skips
+
+    async def test_queue_resize_workers(self):
+        AQ = _AsyncTaskQueue(num_workers=1, max_jobs=10)
+        await AQ.start_workers()
+        AQ.num_workers = 3
+        self.assertEqual(AQ.num_active_workers, 3)
+
+        # the running task keeps its worker, idle workers are stopped
+        t = await AQ.create_and_add_task(long_task, task_owner="me", kwargs=dict(delay=0.5))
+        await asyncio.sleep(0.1)
+        AQ.num_workers = 1
+        await asyncio.sleep(0)
+        self.assertEqual(AQ.num_active_workers, 1)
+        self.assertEqual(t.state, TaskState.RUNNING)
+
+        await AQ.join()
+        self.assertEqual(t.state, TaskState.COMPLETED)
+        self.assertEqual(len(AQ._workers), 1)
+        AQ.cancel_all_tasks()
+
+    async def test_queue_batch(self):
+        old = Settings.server.batch_max_size, Settings.server.batch_window
+        try:
+            Settings.server.batch_max_size, Settings.server.batch_window = 3, 0.1
+            AQ = _AsyncTaskQueue(num_workers=1, max_jobs=10)
+            tasks = [
+                await AQ.create_and_add_task(
+                    long_task,
+                    task_owner=owner,
+                    args=(delay,),
+                    batch_key=key,
+                    batch_func=long_task_batch,
+                )
+                for owner, key, delay in [
+                    ("me", "A", 0.2),
+                    ("you", "B", 0.1),
+                    ("you", "A", -1),
+                    ("me", "A", 0.3),
+                    ("me", "A", 0.1),
+                ]
+            ]
+            await AQ.join()
+            a1, b1, a2, a3, a4 = tasks
+            # a1, a2 and a3 run as one batch, a4 is over batch_max_size
+            self.assertEqual(a1.started_at, a3.started_at)
+            self.assertLess(a3.started_at, a1.finished_at)
+            self.assertLess(a3.finished_at, b1.started_at)
+            self.assertLess(b1.finished_at, a4.started_at)
+            self.assertEqual([t.result for t in (a1, b1, a3, a4)], [0.2, 0.1, 0.3, 0.1])
+            # a failed item fails only its own task
+            self.assertEqual(a2.state, TaskState.FAILED)
+            self.assertIsNone(await a2.wait_result())
+
+            # off: every task runs on its own
+            Settings.server.batch_max_size = 1
+            tasks = [
+                await AQ.create_and_add_task(
+                    long_task,
+                    task_owner="me",
+                    args=(0.1,),
+                    batch_key="A",
+                    batch_func=long_task_batch,
+                )
+                for _ in range(2)
+            ]
+            await AQ.join()
+            self.assertLessEqual(tasks[0].finished_at, tasks[1].started_at)
+            AQ.cancel_all_tasks()
+        finally:
+            Settings.server.batch_max_size, Settings.server.batch_window = old
@@ -0,0 +1,110 @@
+import os
+import io
+import tempfile
+import unittest
+from types import SimpleNamespace
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from PIL import Image
+
+from app.settings import Settings
+from app.utils.image_storage import ImageStorage
+from app.utils.attachment_ingest import (
+    _AttachmentIngest,
+    IngestError,
+    sniff_image_header,
+)
+from .test_image_file import TEST_INPUT_FILE
+
+
+def make_image_bytes(size=(64, 32), format="PNG") -> bytes:
+    with io.BytesIO() as f:
+        Image.new("RGB", size).save(f, format=format)
+        return f.getvalue()
+
+
+class TestAttachmentIngest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_settings = Settings.files.model_copy()
+        Settings.files.image_folder = self._tmp.name
+
+        self.files = {}
+        self.requests = 0
+
+        async def handler(request: web.Request):
+            self.requests += 1
+            return web.Response(body=self.files[request.match_info["name"]])
+
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.ingest = _AttachmentIngest()
+
+    async def asyncTearDown(self):
+        await self.ingest.close()
+        await self.server.close()
+        Settings.files = self._old_settings
+        self._tmp.cleanup()
+
+    def attachment(self, name: str, data: bytes, content_type="image/png", **kwargs):
+        self.files[name] = data
+        return SimpleNamespace(
+            url=str(self.server.make_url(f"/{name}")),
+            content_type=content_type,
+            size=kwargs.get("size", len(data)),
+            width=kwargs.get("width"),
+            height=kwargs.get("height"),
+        )
+
+    def test_sniff_header(self):
+        self.assertEqual(sniff_image_header(make_image_bytes()), ("png", (64, 32)))
+        self.assertEqual(
+            sniff_image_header(make_image_bytes(format="JPEG")), ("jpeg", (64, 32))
+        )
+        self.assertEqual(sniff_image_header(b"not an image"), (None, None))
+
+    async def test_ingest(self):
+        with open(TEST_INPUT_FILE, "rb") as f:
+            data = f.read()
+        image, size = await self.ingest.ingest(self.attachment("a.png", data))
+        self.assertEqual(size, (74, 73))
+        self.assertTrue(os.path.exists(image.image_filename))
+        self.assertEqual(ImageStorage.ref_count(image.image_filename), 1)
+        with open(image.image_filename, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+        # same image again is deduplicated
+        image_2, _ = await self.ingest.ingest(self.attachment("b.png", data))
+        self.assertEqual(image.image_filename, image_2.image_filename)
+        ImageStorage.release(image.image_filename, image_2.image_filename)
+
+    async def test_reject_before_download(self):
+        with self.assertRaises(IngestError):
+            await self.ingest.ingest(
+                self.attachment("a.gif", b"GIF89a", content_type="image/gif")
+            )
+        with self.assertRaises(IngestError):
+            await self.ingest.ingest(
+                self.attachment("a.png", b"", width=2000, height=2000),
+                max_width=1200,
+                max_height=1200,
+            )
+        with self.assertRaises(IngestError):
+            await self.ingest.ingest(self.attachment("a.png", b"", size=2**30))
+        self.assertEqual(self.requests, 0)
+
+    async def test_reject_from_header(self):
+        data = make_image_bytes(size=(300, 300), format="JPEG")
+        with self.assertRaises(IngestError):
+            await self.ingest.ingest(
+                self.attachment("a.png", data),  # wrong size, not reported
+                max_width=200,
+                max_height=200,
+            )
+        with self.assertRaises(IngestError):
+            await self.ingest.ingest(self.attachment("b.png", b"not an image" * 10))
+
+        self.assertEqual(self.requests, 2)
+        self.assertEqual(os.listdir(self._tmp.name), [])
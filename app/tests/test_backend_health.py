@@ -0,0 +1,142 @@
+import time
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.settings import Settings
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.sd_apis.model_inventory import _ModelInventory, BackendInventory
+from app.sd_apis.backend_pool import BackendPool
+from app.sd_apis.backend_health import (
+    CircuitBreaker,
+    CircuitState,
+    BackendUnavailableError,
+    _BackendHealth,
+)
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+DEAD_URL = "127.0.0.1:1"
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_after_failures(self):
+        breaker = CircuitBreaker("host", failure_threshold=2, open_seconds=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_ramp(self):
+        breaker = CircuitBreaker("host", failure_threshold=1, ramp_successes=3)
+        breaker.record_failure()
+        breaker.probe_succeeded()
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+
+        # 1, 2, 4 jobs in flight, then closed
+        self.assertEqual(breaker.capacity, 1)
+        self.assertFalse(breaker.allow(in_flight=1))
+        breaker.record_success()
+        self.assertEqual(breaker.capacity, 2)
+        breaker.record_success()
+        self.assertEqual(breaker.capacity, 4)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        self.assertIsNone(breaker.capacity)
+
+    def test_reopen_backoff(self):
+        breaker = CircuitBreaker(
+            "host", failure_threshold=1, open_seconds=0.05, max_open_seconds=0.1
+        )
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        breaker.record_failure()  # failure while recovering, open for 0.1s
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+
+
+class TestFailover(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(MockComfyUIConfig(steps=1)).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        self._old_server = Settings.server.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        Settings.files.model_cache_file = None
+        Settings.server.breaker_failure_threshold = 1
+        Settings.server.breaker_open_seconds = 60
+
+        # the dead host is listed in the inventory (e.g. it died after discovery)
+        self.apis = {
+            url: ComfyUIAPI(url) for url in (DEAD_URL, self.server.url)
+        }
+        self.inventory = _ModelInventory()
+        for url in self.apis:
+            self.inventory._backends[url] = BackendInventory(
+                url, "ComfyUIAPI", {}, updated_at=time.time()
+            )
+        self.health = _BackendHealth()
+        self.pool = BackendPool(self.apis, inventory=self.inventory, health=self.health)
+
+    def tearDown(self):
+        Settings.files = self._old_files
+        Settings.server = self._old_server
+        self._tmp.cleanup()
+
+    def test_reroute(self):
+        self.pool._loaded[DEAD_URL] = "a.ckpt"  # preferred (warm) host
+        image = self.pool.generate_image(prompt="cat", seed=1, sd_model="a.ckpt")
+        self.assertIsNotNone(image)
+        self.assertEqual(self.health.breaker(DEAD_URL).state, CircuitState.OPEN)
+
+        # the open host is skipped without a connection attempt
+        self.assertEqual(self.pool.select("a.ckpt"), self.server.url)
+
+    def test_all_down(self):
+        Settings.server.backend_hold_seconds = 0
+        self.health.record_failure(self.server.url)
+        self.health.record_failure(DEAD_URL)
+        start = time.perf_counter()
+        with self.assertRaises(BackendUnavailableError):
+            self.pool.select("a.ckpt")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_model_host_down_and_back(self):
+        # the only host with the model goes down: the job is held (not failed as
+        # an unknown model) and runs when the host is back
+        Settings.server.backend_hold_seconds = 10
+        server = MockComfyUIServer(MockComfyUIConfig(steps=1, checkpoints=["x.ckpt"])).start()
+        apis = {url: ComfyUIAPI(url) for url in (server.url, self.server.url)}
+        inventory = _ModelInventory()
+        inventory.refresh(apis)
+        pool = BackendPool(apis, inventory=inventory, health=self.health)
+        try:
+            server.stop()
+            inventory.refresh(apis)
+            self.health.probe(apis)
+            self.assertEqual(self.health.breaker(server.url).state, CircuitState.OPEN)
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                selected = executor.submit(pool.select, "x.ckpt")
+                time.sleep(0.2)
+                self.assertFalse(selected.done())
+
+                server.start()
+                self.health.probe(apis)
+                self.assertEqual(selected.result(5), server.url)
+        finally:
+            server.stop()
+
+    def test_probe(self):
+        results = self.health.probe(self.apis)
+        self.assertEqual(results, {DEAD_URL: False, self.server.url: True})
+        self.assertEqual(self.health.breaker(DEAD_URL).state, CircuitState.OPEN)
+        self.assertEqual(self.health.breaker(self.server.url).state, CircuitState.CLOSED)
@@ -0,0 +1,111 @@
+import tempfile
+import unittest
+
+from app.settings import Settings
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.sd_apis.model_inventory import _ModelInventory
+from app.sd_apis.backend_pool import BackendPool, ModelNotAvailableError
+from app.sd_apis.backend_health import _BackendHealth
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+
+class TestBackendPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server_1 = MockComfyUIServer(
+            MockComfyUIConfig(steps=1, checkpoints=["a.ckpt", "b.ckpt"])
+        ).start()
+        cls.server_2 = MockComfyUIServer(
+            MockComfyUIConfig(steps=1, checkpoints=["b.ckpt"])
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server_1.stop()
+        cls.server_2.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_settings = Settings.files.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        Settings.files.model_cache_file = None
+
+        self.apis = {s.url: ComfyUIAPI(s.url) for s in (self.server_1, self.server_2)}
+        self.inventory = _ModelInventory()
+        self.inventory.discover(self.apis)
+        self.pool = BackendPool(
+            self.apis, inventory=self.inventory, health=_BackendHealth()
+        )
+
+    def tearDown(self):
+        self.server_2.config.checkpoints = ["b.ckpt"]
+        Settings.files = self._old_settings
+        self._tmp.cleanup()
+
+    def prompts_on(self, server: MockComfyUIServer):
+        return len(server.prompts)
+
+    def test_route_by_model(self):
+        self.assertEqual(self.pool.select("a.ckpt"), self.server_1.url)
+        n_prompts = self.prompts_on(self.server_1)
+        self.pool.generate_image(prompt="cat", seed=1, sd_model="a.ckpt")
+        self.assertEqual(self.prompts_on(self.server_1), n_prompts + 1)
+
+    def test_least_busy(self):
+        with self.pool._use(self.server_1.url):
+            self.assertEqual(self.pool.select("b.ckpt"), self.server_2.url)
+        self.assertEqual(self.pool.in_flight[self.server_1.url], 0)
+
+    def test_model_affinity(self):
+        url = self.pool.select("b.ckpt")
+        self.pool.generate_image(prompt="cat", seed=3, sd_model="b.ckpt")
+        self.assertEqual(self.pool.loaded_models[url], "b.ckpt")
+
+        # warm host is preferred, unless busier than the swap penalty
+        other = next(u for u in self.apis if u != url)
+        with self.pool._use(url):
+            self.assertEqual(self.pool.select("b.ckpt"), url)
+            with self.pool._use(url), self.pool._use(url):
+                self.assertEqual(self.pool.select("b.ckpt"), other)
+
+    def test_model_not_available(self):
+        with self.assertRaises(ModelNotAvailableError):
+            self.pool.select("missing.ckpt")
+
+    def test_model_miss_refresh_limited(self):
+        # the hosts are queried once for a missing model, not for every job
+        count = self.server_1.request_counts.get("object_info", 0)
+        for _ in range(3):
+            with self.assertRaises(ModelNotAvailableError):
+                self.pool.select("missing.ckpt")
+        self.assertEqual(self.server_1.request_counts["object_info"], count + 1)
+
+    def test_model_added_later(self):
+        # host loads a new model after startup, picked up on demand
+        self.server_2.config.checkpoints = ["b.ckpt", "c.ckpt"]
+        self.assertEqual(self.pool.select("c.ckpt"), self.server_2.url)
+        self.assertEqual(self.inventory.backends_with("c.ckpt"), [self.server_2.url])
+
+    def test_upscale(self):
+        image = self.pool.generate_image(prompt="cat", seed=2, sd_model="b.ckpt")
+        self.pool.set_upscaler_model(self.server_1.config.upscalers[0])
+        upscaled = self.pool.upscale_image(image)
+        self.assertIsNotNone(upscaled.image_filename)
+
+
+class TestKeepMissingModels(unittest.TestCase):
+    def setUp(self):
+        self._old_settings = Settings.txt2img.model_copy(deep=True)
+
+    def tearDown(self):
+        Settings.txt2img = self._old_settings
+
+    def test_keep_missing(self):
+        models = dict(Settings.txt2img.models)
+        valid = dict(valid_loras=[], valid_upscalers=[])
+        self.assertFalse(
+            Settings.check_for_valid_models(
+                valid_checkpoints=[], keep_missing=True, **valid
+            )
+        )
+        self.assertEqual(Settings.txt2img.models.keys(), models.keys())
@@ -0,0 +1,235 @@
+import time
+import tempfile
+import unittest
+
+from app.settings import Settings
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.sd_apis.comfyUI_execution import (
+    ComfyUIExecutionError,
+    ComfyUIInterruptedError,
+    PromptExecution,
+)
+from app.sd_apis.timeouts import Deadline, DeadlineExceededError
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+
+def message(msg_type: str, prompt_id: str = "p1", **data):
+    return {"type": msg_type, "data": {"prompt_id": prompt_id, **data}}
+
+
+class TestPromptExecution(unittest.TestCase):
+    def test_messages(self):
+        execution = PromptExecution("p1")
+        self.assertFalse(execution.handle(message("execution_start")))
+        execution.handle(message("executing", node="3"))
+        execution.handle(message("progress", node="3", value=2, max=20))
+        self.assertEqual(execution.progress, (2, 20))
+        execution.handle(message("executed", node="9", output={"images": []}))
+        self.assertFalse(execution.handle(message("executing", "other", node=None)))
+        self.assertTrue(execution.handle(message("executing", node=None)))
+        self.assertEqual(execution.outputs, {"9": {"images": []}})
+        self.assertFalse(execution.needs_history)
+
+    def test_cached(self):
+        execution = PromptExecution("p1")
+        execution.handle(message("execution_start"))
+        execution.handle(message("execution_cached", nodes=["4", "9"]))
+        self.assertTrue(execution.handle(message("execution_success")))
+        self.assertTrue(execution.needs_history)
+
+    def test_cached_inputs(self):
+        # cached loaders, the output node ran: its output came with `executed`
+        node_types = {"4": "CheckpointLoaderSimple", "9": "SaveImage"}
+        execution = PromptExecution("p1", node_types)
+        execution.handle(message("execution_cached", nodes=["4"]))
+        execution.handle(message("executed", node="9", output={"images": []}))
+        self.assertFalse(execution.needs_history)
+
+        execution = PromptExecution("p1", node_types)
+        execution.handle(message("execution_cached", nodes=["4", "9"]))
+        execution.handle(message("executed", node="10", output={"images": []}))
+        self.assertTrue(execution.needs_history)
+
+        # declared output nodes
+        execution = PromptExecution("p1", node_types, output_nodes=[10])
+        execution.handle(message("execution_cached", nodes=["4", "9"]))
+        execution.handle(message("executed", node="10", output={"images": []}))
+        self.assertFalse(execution.needs_history)
+
+    def test_errors(self):
+        execution = PromptExecution("p1")
+        with self.assertRaises(ComfyUIExecutionError) as cm:
+            execution.handle(
+                message(
+                    "execution_error",
+                    node_id="3",
+                    node_type="KSampler",
+                    exception_type="RuntimeError",
+                    exception_message="CUDA out of memory",
+                )
+            )
+        self.assertEqual(cm.exception.node_type, "KSampler")
+        with self.assertRaises(ComfyUIInterruptedError):
+            PromptExecution("p1").handle(message("execution_interrupted", node_id="3"))
+
+
+class TestComfyUIExecution(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(
+            MockComfyUIConfig(steps=2, cache_prompts=True)
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        self._old_server = Settings.server.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        self.api = ComfyUIAPI(self.server.url)
+
+    def tearDown(self):
+        self.server.config.error_node_types = []
+        self.server.config.steps = 2
+        Settings.files = self._old_files
+        Settings.server = self._old_server
+        self._tmp.cleanup()
+
+    def history_requests(self):
+        return self.server.request_counts.get("history", 0)
+
+    def test_outputs_without_history(self):
+        count = self.history_requests()
+        self.api.generate_image(prompt="cat", seed=11)
+        self.assertEqual(self.history_requests(), count)
+
+        # cached prompt: outputs are only listed in /history
+        image = self.api.generate_image(prompt="cat", seed=11)
+        self.assertIsNotNone(image.image_filename)
+        self.assertEqual(self.history_requests(), count + 1)
+
+    def test_cached_loaders_without_history(self):
+        # only the loaders are cached (same model, new seed): the output node
+        # runs and sends its output, no /history request
+        self.server.config.cache_loaders = True
+        try:
+            self.api.generate_image(prompt="dog", seed=14)
+            count = self.history_requests()
+            image = self.api.generate_image(prompt="dog", seed=15)
+            self.assertIsNotNone(image.image_filename)
+            record = list(self.server.prompts.values())[-1]
+            self.assertEqual(record.status, "success")
+            self.assertEqual(self.history_requests(), count)
+        finally:
+            self.server.config.cache_loaders = False
+
+    def test_execution_error(self):
+        self.server.config.error_node_types = ["VAEDecode"]
+        start = time.perf_counter()
+        with self.assertRaises(ComfyUIExecutionError) as cm:
+            self.api.generate_image(prompt="cat", seed=12)
+        self.assertEqual(cm.exception.node_type, "VAEDecode")
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_deadline_interrupts(self):
+        self.server.config.steps = 1000
+        Settings.server.job_timeout_base = 0.3
+        Settings.server.job_timeout_per_mpixel = 0
+        with self.assertRaises(DeadlineExceededError):
+            self.api.generate_image(prompt="cat", seed=13)
+
+        # the host stops the prompt (interrupt), instead of running all steps
+        time.sleep(0.2)
+        record = list(self.server.prompts.values())[-1]
+        self.assertIsNotNone(record.finished_at)
+        self.assertEqual(record.status, "error")
+
+
+class TestComfyUIOutputs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(MockComfyUIConfig(steps=1)).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        self.api = ComfyUIAPI(self.server.url)
+
+        # default workflow with a second (intermediate) output node
+        self.workflow = {"prompt": {**self.api.workflow["prompt"]}}
+        self.workflow["prompt"]["10"] = {
+            "class_type": "PreviewImage",
+            "inputs": {"images": ["8", 0]},
+        }
+
+    def tearDown(self):
+        Settings.files = self._old_files
+        self._tmp.cleanup()
+
+    def test_select_outputs(self):
+        outputs = {
+            "9": {"images": [{"filename": "a.png"}, {"filename": "b.png"}]},
+            "10": {"gifs": [{"filename": "c.gif"}]},
+            "11": {"text": ["no files"]},
+        }
+        self.assertEqual(
+            ComfyUIAPI._select_outputs(outputs), {"9": [{"filename": "b.png"}]}
+        )
+        self.assertEqual(
+            ComfyUIAPI._select_outputs(outputs, output_nodes=[10]),
+            {"10": [{"filename": "c.gif"}]},
+        )
+
+    def test_single_download(self):
+        count = self.server.request_counts.get("view", 0)
+        self.api.generate_image(prompt="cat", seed=21, workflow=self.workflow)
+        self.assertEqual(self.server.request_counts["view"], count + 1)
+
+    def test_declared_outputs(self):
+        count = self.server.request_counts.get("view", 0)
+        wf_map = {**self.api.workflow_map, "output_nodes": ["9", "10"]}
+        images = self.api._execute(
+            self.api._apply_settings({"seed": 22}, self.workflow, wf_map),
+            Deadline(10),
+            wf_map["output_nodes"],
+        )
+        self.assertEqual(list(images.keys()), ["9", "10"])
+        self.assertEqual(self.server.request_counts["view"], count + 2)
+
+    def test_websocket_outputs(self):
+        # images of a SaveImageWebsocket node need no /history or /view requests
+        workflow = {"prompt": {**self.api.workflow["prompt"]}}
+        workflow["prompt"]["9"] = {
+            "class_type": "SaveImageWebsocket",
+            "inputs": {"images": ["8", 0]},
+        }
+        counts = dict(self.server.request_counts)
+        image = self.api.generate_image(prompt="cat", seed=23, workflow=workflow)
+        self.assertIsNotNone(image.image_filename)
+        for route in ("history", "view"):
+            self.assertEqual(
+                self.server.request_counts.get(route, 0), counts.get(route, 0)
+            )
+
+    def test_previews(self):
+        previews = []
+        self.server.config.send_previews = True
+        self.server.config.steps = 3
+        try:
+            self.api.generate_image(
+                prompt="cat",
+                seed=24,
+                on_preview=lambda data, ext, progress: previews.append((ext, progress)),
+            )
+        finally:
+            self.server.config.send_previews = False
+            self.server.config.steps = 1
+        self.assertEqual(previews, [("jpeg", (i, 3)) for i in range(1, 4)])
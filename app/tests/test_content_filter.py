@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+import discord
+
+from app.settings import Settings
+from app.utils import Orientation, PromptConstants
+from app.utils.async_task_queue import AsyncTaskQueue
+from app.utils.content_filter import _ContentFilter
+from app.commands.txt2img_cmds import Txt2ImageCommands
+from .fake_discord import CallRecorder, FakeApplicationContext, FakeUser
+
+
+class TestContentFilter(unittest.TestCase):
+    def setUp(self):
+        self._old_server = Settings.server.model_copy()
+        Settings.server.content_filter = ["nude", "nsfw", "porn*"]
+        self.filter = _ContentFilter()
+
+    def tearDown(self):
+        Settings.server = self._old_server
+
+    def test_find(self):
+        self.assertEqual(self.filter.find("a NSFW! cat"), ["NSFW"])
+        self.assertEqual(self.filter.find("n.s.f.w, Nude"), ["n.s.f.w", "Nude"])
+        self.assertEqual(self.filter.find("pornographic art"), ["pornographic"])
+        # on word boundaries
+        self.assertEqual(self.filter.find("a denuded tree, nsfwx"), [])
+        self.assertEqual(self.filter.remove("a nude  cat"), "a cat")
+
+    def test_settings_reload(self):
+        self.assertTrue(self.filter.find("nude"))
+        Settings.server.content_filter = ["dog"]
+        self.assertEqual(self.filter.find("nude dog"), ["dog"])
+        Settings.server.content_filter = []
+        self.assertEqual(self.filter.find("nude dog"), [])
+
+    def test_stats(self):
+        for text in ["a cat", "nsfw", "NSFW nude"]:
+            self.filter.check(text)
+        self.assertEqual(
+            self.filter.stats(),
+            {"checked": 3, "flagged": 2, "hits": {"nsfw": 2, "nude": 1}},
+        )
+
+
+# the rejected prompt never reaches the task queue
+class TestContentFilterCommand(unittest.TestCase):
+    def test_rejected_before_queue(self):
+        recorder = CallRecorder()
+        commands = Txt2ImageCommands(
+            discord.SlashCommandGroup("txt2img", "test"), commands=["image"]
+        )
+        queued = AsyncTaskQueue.qsize()
+
+        asyncio.run(
+            commands.generate_image(
+                FakeApplicationContext(FakeUser(id=5), recorder),
+                prompt="a nsfw cat",
+                style=PromptConstants.NO_STYLE_PRESET,
+                model=list(Settings.txt2img.models.keys())[0],
+                orientation=Orientation.SQUARE,
+                negative_prompt="",
+            )
+        )
+        self.assertEqual(AsyncTaskQueue.qsize(), queued)
+        self.assertEqual([c.name for c in recorder.calls], ["response.send_message"])
+        self.assertIn("not allowed", recorder.calls[0].kwargs["content"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import discord
+
+from app.settings import Settings
+from app.sd_apis.api_handler import Sd
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.utils.async_task_queue import _AsyncTaskQueue
+from app.utils.image_file import ImageFile
+from app.commands.img2img_cmds import Img2ImageCommands
+from .fake_discord import CallRecorder, FakeApplicationContext, FakeUser
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+from .load_test_commands import patched_task_queue, run_load_test
+from .test_image_file import TEST_INPUT_FILE
+
+
+class TestFakeDiscord(unittest.IsolatedAsyncioTestCase):
+    async def test_respond_then_followup(self):
+        recorder = CallRecorder()
+        ctx = FakeApplicationContext(FakeUser(id=7), recorder)
+
+        response = await ctx.respond("first", ephemeral=True)
+        await response.edit_original_response(content="edited")
+        message = await ctx.respond("second")
+        await message.add_reaction("👍")
+        await response.delete_original_response()
+
+        self.assertEqual(
+            [c.name for c in recorder.calls],
+            [
+                "response.send_message",
+                "edit_original_response",
+                "followup.send",
+                "message.add_reaction",
+                "delete_original_response",
+            ],
+        )
+        self.assertTrue(all(c.user_id == 7 for c in recorder.calls))
+        self.assertEqual(len(recorder.filter(interaction_id=ctx.interaction.id)), 5)
+        self.assertEqual(message.reactions, ["👍"])
+        self.assertTrue(response.original_deleted)
+
+
+# End-to-end: txt2img command + view buttons against the mock ComfyUI server
+class TestLoadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(
+            MockComfyUIConfig(steps=2, step_latency=0.001)
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def test_load_test(self):
+        result = run_load_test(self.server, n_users=3, presses=1, max_jobs=100)
+        self.assertEqual(result.errors, 0)
+        self.assertEqual(result.rejected, 0)
+        # command + one button press per user
+        self.assertEqual(len(result.all_latencies), 6)
+        self.assertGreater(result.edits, 0)
+        self.assertLessEqual(result.fairness, 1.0)
+
+    def test_queue_full_rejected(self):
+        result = run_load_test(self.server, n_users=3, presses=0, max_jobs=1)
+        self.assertEqual(result.errors, 0)
+        self.assertGreater(result.rejected, 0)
+
+    def test_incremental_delivery(self):
+        incremental_delivery = Settings.server.incremental_delivery
+        try:
+            Settings.server.incremental_delivery = False
+            result = run_load_test(self.server, n_users=1, presses=0, max_jobs=100)
+            # the images arrive all at once, with the final message
+            self.assertEqual(result.first_latencies, result.all_latencies)
+
+            Settings.server.incremental_delivery = True
+            result = run_load_test(self.server, n_users=1, presses=0, max_jobs=100)
+            self.assertEqual(result.errors, 0)
+            self.assertLess(result.first_latencies[0], result.all_latencies[0])
+        finally:
+            Settings.server.incremental_delivery = incremental_delivery
+
+    def _upscale(self, recorder: CallRecorder, model_def):
+        # the upscale command (after the attachment is stored), returns the mock
+        # of the queue's create_and_add_task
+        commands = Img2ImageCommands(discord.SlashCommandGroup("img2img", "test"))
+        queue = _AsyncTaskQueue(num_workers=1, max_jobs=10)
+
+        async def upscale():
+            with patched_task_queue(queue):
+                ctx = FakeApplicationContext(FakeUser(id=9), recorder)
+                response = await ctx.respond("Upscaling image...", ephemeral=True)
+                itask = asyncio.create_task(asyncio.sleep(60))
+                image = ImageFile(image_filename=TEST_INPUT_FILE)
+                try:
+                    await commands._upscale_image(ctx, response, itask, image, model_def)
+                finally:
+                    queue.cancel_all_tasks()
+
+        old_files = Settings.files.model_copy()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            queue, "create_and_add_task", wraps=queue.create_and_add_task
+        ) as create_task:
+            Settings.files.image_folder = tmp
+            with mock.patch.object(Sd, "api", ComfyUIAPI(self.server.url), create=True):
+                try:
+                    asyncio.run(upscale())
+                finally:
+                    Settings.files = old_files
+        return create_task
+
+    def test_upscale_command(self):
+        recorder = CallRecorder()
+        model_def = list(Settings.upscaler.models.values())[0]
+        create_task = self._upscale(recorder, model_def)
+
+        # grouped with the other jobs of the same upscaler model
+        self.assertEqual(create_task.call_args.kwargs["affinity_key"], model_def.sd_model)
+        sent = [c for c in recorder.calls if c.kwargs.get("file")]
+        self.assertEqual(len(sent), 1)
+        self.assertIn("Upscaled image", sent[0].kwargs["content"])
+
+    def test_upscale_command_failed(self):
+        recorder = CallRecorder()
+        self.server.config.error_node_types = ["ImageUpscaleWithModel"]
+        try:
+            self._upscale(recorder, list(Settings.upscaler.models.values())[0])
+        finally:
+            self.server.config.error_node_types = []
+        self.assertFalse([c for c in recorder.calls if c.kwargs.get("file")])
+        self.assertEqual(
+            recorder.calls[-1].kwargs["content"], "Generation failed, please try again"
+        )
@@ -0,0 +1,155 @@
+import os
+import time
+import tempfile
+import unittest
+
+from app.settings import Settings
+from app.utils.image_file import ImageFile
+from app.utils.image_storage import _ImageStorage, ImageStorage, StorageTier
+from .test_image_file import TEST_INPUT_FILE
+
+
+class TestImageStorage(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_settings = Settings.files.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        Settings.files.storage_gc_grace_seconds = 0
+
+    def tearDown(self):
+        Settings.files = self._old_settings
+        self._tmp.cleanup()
+
+    def make_file(self, storage: _ImageStorage, tier: str, age: float, size: int):
+        name = f"{tier}_{age}_{size}"
+        path = storage.new_path(name, "png", tier)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_new_path_tiers(self):
+        storage = _ImageStorage()
+        path = storage.new_path("abcdef", "png", StorageTier.INPUTS)
+        self.assertEqual(os.path.dirname(path), os.path.join(self._tmp.name, "inputs"))
+        self.assertEqual(storage.tier_of(path), StorageTier.INPUTS)
+
+        Settings.files.shard_image_folder = True
+        path = storage.new_path("abcdef", "png", StorageTier.OUTPUTS)
+        self.assertEqual(
+            os.path.dirname(path), os.path.join(self._tmp.name, "outputs", "ab")
+        )
+        self.assertEqual(storage.tier_of(path), StorageTier.OUTPUTS)
+
+        with self.assertRaises(ValueError):
+            storage.new_path("abcdef", "png", "bad_tier")
+
+    def test_image_file_registers(self):
+        with open(TEST_INPUT_FILE, "rb") as f:
+            image = ImageFile(image_bytes=f.read())
+        image.save(tier=StorageTier.INPUTS)
+        self.assertIn(image.image_filename, ImageStorage)
+        self.assertEqual(ImageStorage.tier_of(image.image_filename), StorageTier.INPUTS)
+
+    def test_files_outside_folder_not_managed(self):
+        storage = _ImageStorage()
+        storage.register(TEST_INPUT_FILE)
+        self.assertNotIn(TEST_INPUT_FILE, storage)
+
+    def test_retention(self):
+        Settings.files.input_retention_hours = 1
+        Settings.files.output_retention_hours = 10
+        storage = _ImageStorage()
+        old_input = self.make_file(storage, StorageTier.INPUTS, 7200, 10)
+        new_input = self.make_file(storage, StorageTier.INPUTS, 60, 10)
+        old_output = self.make_file(storage, StorageTier.OUTPUTS, 7200, 10)
+
+        self.assertEqual(storage.collect(), 1)
+        self.assertFalse(os.path.exists(old_input))
+        self.assertTrue(os.path.exists(new_input))
+        self.assertTrue(os.path.exists(old_output))
+
+    def test_size_budget(self):
+        Settings.files.input_retention_hours = 0
+        Settings.files.output_retention_hours = 0
+        Settings.files.max_storage_mb = 1
+        storage = _ImageStorage()
+        output = self.make_file(storage, StorageTier.OUTPUTS, 300, 2**19)
+        old_input = self.make_file(storage, StorageTier.INPUTS, 200, 2**19)
+        new_input = self.make_file(storage, StorageTier.INPUTS, 100, 2**19)
+
+        # inputs are evicted before outputs, oldest first
+        self.assertEqual(storage.collect(), 1)
+        self.assertFalse(os.path.exists(old_input))
+        self.assertTrue(os.path.exists(new_input))
+        self.assertTrue(os.path.exists(output))
+        self.assertLessEqual(storage.total_size, 2**20)
+
+    def test_referenced_files_kept(self):
+        Settings.files.input_retention_hours = 1
+        storage = _ImageStorage()
+        path = self.make_file(storage, StorageTier.INPUTS, 7200, 10)
+        storage.acquire(path)
+        storage.acquire(path)
+        self.assertEqual(storage.collect(), 0)
+
+        storage.release(path)
+        self.assertEqual(storage.ref_count(path), 1)
+        self.assertEqual(storage.collect(), 0)
+
+        storage.release(path)
+        self.assertEqual(storage.collect(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_deduplicated_store(self):
+        storage = _ImageStorage()
+        with open(TEST_INPUT_FILE, "rb") as f:
+            data = f.read()
+
+        path_1 = storage.store_bytes(data, "png")
+        path_2 = storage.store_bytes(data, "png")
+        self.assertEqual(path_1, path_2)
+        self.assertEqual(storage.dedup_hits, 1)
+        self.assertEqual(storage.ref_count(path_1), 2)
+        self.assertEqual(storage.tier_of(path_1), StorageTier.INPUTS)
+        self.assertEqual(len(storage.files(StorageTier.INPUTS)), 1)
+
+        path_3 = storage.store_bytes(data + b"\0", "png")
+        self.assertNotEqual(path_1, path_3)
+
+    def test_store_during_collect(self):
+        # the file is stored (and referenced) again after the GC took it as a candidate
+        Settings.files.input_retention_hours = 1
+        storage = _ImageStorage()
+        with open(TEST_INPUT_FILE, "rb") as f:
+            data = f.read()
+        path = storage.store_bytes(data, "png")
+        storage.release(path)
+        os.utime(path, (time.time() - 7200, time.time() - 7200))
+        storage.scan()
+
+        retention_seconds = storage._retention_seconds
+
+        def store_again(tier):
+            if storage.ref_count(path) == 0:
+                self.assertEqual(storage.store_bytes(data, "png"), path)
+            return retention_seconds(tier)
+
+        storage._retention_seconds = store_again
+        self.assertEqual(storage.collect(), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(storage.ref_count(path), 1)
+
+    def test_image_file_save_deduplicated(self):
+        with open(TEST_INPUT_FILE, "rb") as f:
+            image_1 = ImageFile(image_bytes=f.read())
+        image_2 = ImageFile(image_filename=TEST_INPUT_FILE)
+
+        self.assertEqual(image_1.content_hash, image_2.content_hash)
+        image_1.save_deduplicated()
+        image_2.save_deduplicated()
+        self.assertEqual(image_1.image_filename, image_2.image_filename)
+        self.assertIn(image_1.content_hash, os.path.basename(image_1.image_filename))
+        ImageStorage.release(image_1.image_filename, image_2.image_filename)
+        self.assertEqual(ImageStorage.ref_count(image_1.image_filename), 0)
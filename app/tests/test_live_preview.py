@@ -0,0 +1,125 @@
+import io
+import asyncio
+import unittest
+from unittest import mock
+
+import discord
+from PIL import Image
+
+from app.settings import Settings
+from app.utils import Orientation, PromptConstants
+from app.utils.async_task_queue import Task
+from app.commands import txt_base_cmds
+from app.commands.txt2vid_cmds import Txt2Video1StepCommands
+from app.views.view_helpers import LivePreview
+from .fake_discord import CallRecorder, FakeApplicationContext, FakeUser
+
+
+def _png(size=(512, 384)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 20, 20)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestLivePreview(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.recorder = CallRecorder()
+        self.ctx = FakeApplicationContext(FakeUser(id=3), self.recorder)
+        self.response = await self.ctx.respond("Creating video...", ephemeral=True)
+
+    def _previews(self):
+        return [
+            c
+            for c in self.recorder.filter(name="edit_original_response")
+            if c.kwargs.get("file")
+        ]
+
+    async def _feed(self, preview: LivePreview, frames):
+        # frames are sent from the job thread, as by the SD api
+        def feed():
+            for data, progress in frames:
+                preview(data, "png", progress)
+                if preview._pending is not None:
+                    preview._pending.result()
+
+        await asyncio.to_thread(feed)
+
+    def test_opt_in(self):
+        live_previews = Settings.server.live_previews
+        try:
+            Settings.server.live_previews = False
+            self.assertIsNone(LivePreview.create(self.response))
+        finally:
+            Settings.server.live_previews = live_previews
+
+    async def test_every_steps(self):
+        preview = LivePreview(self.response, every_steps=5, min_interval=0)
+        data = _png()
+        # steps 1..10 of a sampler, then a second sampler node from step 1
+        frames = [(data, (s, 10)) for s in range(1, 11)]
+        frames += [(data, (s, 10)) for s in range(1, 3)]
+        await self._feed(preview, frames)
+
+        self.assertEqual(preview.sent, 3)  # steps 1, 6 and 1 of the next node
+        previews = self._previews()
+        self.assertEqual(len(previews), 3)
+        self.assertEqual(previews[0].kwargs["file"], ["preview.jpg"])
+        self.assertEqual(previews[0].kwargs["attachments"], [])
+
+    async def test_min_interval(self):
+        preview = LivePreview(self.response, every_steps=1, min_interval=60)
+        data = _png()
+        await self._feed(preview, [(data, (s, 20)) for s in range(1, 21)])
+        self.assertEqual(preview.sent, 1)
+
+    async def test_downscale(self):
+        preview = LivePreview(self.response, max_size=128)
+        with Image.open(io.BytesIO(preview.downscale(_png((512, 384))))) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (128, 96))
+
+    async def test_closed_and_invalid(self):
+        preview = LivePreview(self.response, every_steps=1, min_interval=0)
+        await self._feed(preview, [(b"not an image", (1, 10))])
+        preview.close()
+        await self._feed(preview, [(_png(), (5, 10))])
+        self.assertEqual(preview.sent, 0)
+        self.assertEqual(self._previews(), [])
+
+
+    async def test_closed_on_queue_full(self):
+        # queue full after the first animation: the preview of the queued one is closed
+        live_previews = Settings.server.live_previews
+        Settings.server.live_previews = True
+        previews = []
+
+        def create(interaction):
+            previews.append(LivePreview(interaction))
+            return previews[-1]
+
+        queued = Task(asyncio.sleep, task_owner=3, task_id=1, args=(0,))
+        commands = Txt2Video1StepCommands(discord.SlashCommandGroup("txt2vid", "test"))
+        try:
+            with mock.patch.object(
+                txt_base_cmds.LivePreview, "create", side_effect=create
+            ), mock.patch.object(
+                txt_base_cmds.AsyncTaskQueue,
+                "create_and_add_task",
+                side_effect=[queued, None],
+            ):
+                await commands.generate_animation_1step(
+                    FakeApplicationContext(FakeUser(id=3), self.recorder),
+                    prompt="a cat",
+                    style=PromptConstants.NO_STYLE_PRESET,
+                    model=list(Settings.txt2vid1step.models.keys())[0],
+                    orientation=Orientation.SQUARE,
+                    negative_prompt="",
+                )
+        finally:
+            Settings.server.live_previews = live_previews
+        self.assertEqual(len(previews), 1)
+        self.assertTrue(previews[0].closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
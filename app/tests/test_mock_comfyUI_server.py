@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from app.settings import Settings
+from app.utils.prompts import PromptConstants
+from app.sd_apis.comfyUI_api import ComfyUIAPI, merge_workflows
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+from .benchmark_generation import run_benchmark, percentile
+
+
+# Runs the ComfyUIAPI against the local mock server (no real SD host required)
+class TestMockComfyUIServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(
+            MockComfyUIConfig(steps=5, step_latency=0.001, output_size=(32, 16))
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_settings = Settings.files.model_copy()
+        Settings.files.image_folder = self._tmp.name
+
+    def tearDown(self):
+        Settings.files = self._old_settings
+        self._tmp.cleanup()
+
+    def test_host_and_models(self):
+        api = ComfyUIAPI(self.server.url)
+        self.assertTrue(api.check_sd_host())
+        self.assertEqual(api.get_checkpoint_names(), self.server.config.checkpoints)
+        self.assertEqual(api.get_upscaler_names(), self.server.config.upscalers)
+
+    def test_generate_image(self):
+        api = ComfyUIAPI(self.server.url)
+        image = api.generate_image(prompt="a cat", seed=1234)
+        self.assertEqual(image.size, (32, 16))
+        self.assertTrue(os.path.exists(image.image_filename))
+
+        record = list(self.server.prompts.values())[-1]
+        self.assertEqual(record.prompt["3"]["inputs"]["seed"], 1234)
+        self.assertLessEqual(record.started_at, record.finished_at)
+
+    def test_generate_image_batch(self):
+        api = ComfyUIAPI(self.server.url)
+        n_prompts = len(self.server.prompts)
+        images = api.generate_image_batch(
+            [
+                {"prompt": "a cat", "seed": 1, "width": 512, "height": 512},
+                {"prompt": "a dog", "seed": 2, "width": 512, "height": 512},
+                {"prompt": "a cat", "seed": 3, "width": 512, "height": 512},
+            ]
+        )
+        self.assertEqual(len(images), 3)
+        self.assertEqual(len({i.image_filename for i in images}), 3)
+        self.assertTrue(all(i.size == (32, 16) for i in images))
+
+        # one prompt: shared loader, latent and negative prompt, a sampler per image
+        self.assertEqual(len(self.server.prompts), n_prompts + 1)
+        prompt = list(self.server.prompts.values())[-1].prompt
+        class_types = [node["class_type"] for node in prompt.values()]
+        self.assertEqual(class_types.count("CheckpointLoaderSimple"), 1)
+        self.assertEqual(class_types.count("EmptyLatentImage"), 1)
+        self.assertEqual(class_types.count("KSampler"), 3)
+        self.assertEqual(class_types.count("SaveImage"), 3)
+        # "a cat" is encoded once, with the negative prompt: 3 CLIPTextEncode
+        self.assertEqual(class_types.count("CLIPTextEncode"), 3)
+        seeds = sorted(n["inputs"]["seed"] for n in prompt.values() if "seed" in n["inputs"])
+        self.assertEqual(seeds, [1, 2, 3])
+
+    def test_conditioning_cache(self):
+        api = ComfyUIAPI(self.server.url)
+        template = PromptConstants.cast["negativeprompt_template"][PromptConstants.NATURAL]
+        Settings.server.conditioning_cache = True
+        try:
+            api.generate_image_batch(
+                [
+                    {"prompt": "a cat", "negativeprompt": "blurry, " + template, "seed": 1},
+                    {"prompt": "a dog", "negativeprompt": "dark, " + template, "seed": 2},
+                ]
+            )
+        finally:
+            Settings.server.conditioning_cache = False
+
+        prompt = list(self.server.prompts.values())[-1].prompt
+        texts = [n["inputs"]["text"] for n in prompt.values() if "text" in n["inputs"]]
+        # the template is encoded once, concatenated to each user's negative prompt
+        self.assertEqual(texts.count(template), 1)
+        self.assertIn("blurry", texts)
+        self.assertIn("dark", texts)
+        concats = [k for k, n in prompt.items() if n["class_type"] == "ConditioningConcat"]
+        self.assertEqual(len(concats), 2)
+        negatives = sorted(n["inputs"]["negative"][0] for n in prompt.values() if n["class_type"] == "KSampler")
+        self.assertEqual(negatives, sorted(concats))
+
+    def test_merge_workflows(self):
+        a = {"1": {"class_type": "Loader", "inputs": {"name": "m"}},
+             "2": {"class_type": "Sampler", "inputs": {"seed": 1, "model": ["1", 0]}}}
+        b = {"1": {"class_type": "Loader", "inputs": {"name": "m"}},
+             "2": {"class_type": "Sampler", "inputs": {"seed": 2, "model": ["1", 0]}}}
+        merged, id_maps = merge_workflows([a, {"prompt": b}])
+        self.assertEqual(id_maps, [{"1": "1", "2": "2"}, {"1": "1", "2": "1:2"}])
+        self.assertEqual(merged["1:2"]["inputs"], {"seed": 2, "model": ["1", 0]})
+        self.assertEqual(len(merged), 3)
+
+    def test_benchmark(self):
+        result = run_benchmark(self.server, concurrency=2, n_jobs=4)
+        self.assertEqual(result.jobs, 4)
+        self.assertEqual(result.failed, 0)
+        self.assertEqual(len(result.stages["fetch"]), 4)
+        self.assertGreater(result.summary()["throughput"], 0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 99), 3.0)
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from app.settings import Settings, ModelType, BackendModel
+from app.sd_apis.api_handler import Sd
+from app.sd_apis.model_inventory import _ModelInventory
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+
+class TestModelInventory(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server_1 = MockComfyUIServer(
+            MockComfyUIConfig(checkpoints=["a.ckpt", "b.ckpt"])
+        ).start()
+        cls.server_2 = MockComfyUIServer(
+            MockComfyUIConfig(checkpoints=["b.ckpt", "c.ckpt"])
+        ).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server_1.stop()
+        cls.server_2.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        self._old_server = Settings.server.model_copy()
+        Settings.files.model_cache_file = os.path.join(self._tmp.name, "cache.json")
+        Sd.configure_backends(
+            [
+                BackendModel(host=s.host, port=s.port)
+                for s in (self.server_1, self.server_2)
+            ]
+        )
+
+    def tearDown(self):
+        Settings.files = self._old_files
+        Settings.server = self._old_server
+        self._tmp.cleanup()
+
+    def test_discover(self):
+        inventory = _ModelInventory()
+        backends = inventory.discover(Sd.apis)
+        self.assertEqual(set(backends.keys()), {self.server_1.url, self.server_2.url})
+        self.assertEqual(
+            inventory.names(ModelType.checkpoint), ["a.ckpt", "b.ckpt", "c.ckpt"]
+        )
+        self.assertEqual(inventory.backends_with("c.ckpt"), [self.server_2.url])
+        self.assertEqual(len(inventory.backends_with("b.ckpt")), 2)
+        self.assertEqual(
+            inventory.names(ModelType.upscaler), self.server_1.config.upscalers
+        )
+
+    def test_cache(self):
+        Settings.server.model_cache_ttl = 3600
+        _ModelInventory().discover(Sd.apis)
+        count = self.server_1.request_counts.get("object_info", 0)
+
+        # fresh cache entries are used without querying the hosts
+        inventory = _ModelInventory()
+        inventory.discover(Sd.apis)
+        self.assertEqual(self.server_1.request_counts["object_info"], count)
+        self.assertEqual(len(inventory.backends_with("a.ckpt")), 1)
+
+        # expired entries are queried again
+        Settings.server.model_cache_ttl = 0
+        _ModelInventory().discover(Sd.apis)
+        self.assertEqual(self.server_1.request_counts["object_info"], count + 1)
+
+    def test_unreachable_backend(self):
+        Sd.configure_backends(
+            [BackendModel(host=self.server_1.host, port=self.server_1.port),
+             BackendModel(host="127.0.0.1", port=1)]
+        )
+        backends = _ModelInventory().discover(Sd.apis, use_cache=False)
+        self.assertEqual(list(backends.keys()), [self.server_1.url])
+
+    def test_default_backend(self):
+        Settings.server.backends = []
+        backends = Settings.server.get_backends()
+        self.assertEqual(len(backends), 1)
+        self.assertEqual(backends[0].url, f"{Settings.server.host}:{Settings.server.port}")
+
+    def test_refresh(self):
+        server = MockComfyUIServer(MockComfyUIConfig(checkpoints=["x.ckpt"])).start()
+        apis = {server.url: Sd.create_api(server.url, "comfyUI")}
+        inventory = _ModelInventory()
+        inventory.refresh(apis)
+        self.assertEqual(inventory.backends_with("x.ckpt"), [server.url])
+
+        # a host that stops answering keeps its last known models until it is back
+        server.stop()
+        inventory.refresh(apis)
+        self.assertTrue(inventory.backends[server.url].stale)
+        self.assertEqual(inventory.backends_with("x.ckpt"), [server.url])
+
+        server.start()
+        try:
+            inventory.refresh(apis)
+            self.assertFalse(inventory.backends[server.url].stale)
+        finally:
+            server.stop()
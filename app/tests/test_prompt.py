@@ -1,5 +1,16 @@
 import unittest
-from app.utils.prompts import GeneratePrompt, PromptConstants
+from unittest import mock
+from app.settings import Settings
+from app.utils import prompt_pool
+from app.utils.prompt_pool import _PromptPool
+from app.utils.prompts import (
+    GeneratePrompt,
+    PromptConstants,
+    CLIP_CHUNK_TOKENS,
+    count_tokens,
+    generate_random_prompts,
+    truncate_prompt,
+)
 
 
 class TestGeneratePrompt(unittest.TestCase):
@@ -36,3 +47,110 @@ class TestGeneratePrompt(unittest.TestCase):
         prompt = GeneratePrompt()
         prompt.make_random_prompt()
         self.assertIsNotNone(prompt.prompt)
+
+    def test_split_negative_prompt(self):
+        for style in PromptConstants.get_style_presets():
+            template = PromptConstants.cast["negativeprompt_template"][style]
+            prompt = GeneratePrompt("a cat", "blurry, dark", style)
+            self.assertEqual(
+                PromptConstants.split_negative_prompt(prompt.negativeprompt),
+                ("blurry, dark", template),
+            )
+            prompt = GeneratePrompt("a cat", "", style)
+            self.assertEqual(
+                PromptConstants.split_negative_prompt(prompt.negativeprompt), ("", template)
+            )
+        self.assertEqual(PromptConstants.split_negative_prompt("blurry"), ("blurry", ""))
+
+    def test_setters(self):
+        prompt = GeneratePrompt("a cat", "dark", PromptConstants.COMIC)
+        self.assertEqual(prompt.prompt, "Retro comic style artwork, a a cat, comic, anime style, 1970's, vibrant")
+        prompt.input_prompt = "a dog"
+        prompt.input_negativeprompt = ""
+        prompt.style = PromptConstants.NO_STYLE_PRESET
+        self.assertEqual(prompt.prompt, "a dog")
+        self.assertEqual(
+            prompt.negativeprompt,
+            PromptConstants.cast["negativeprompt_template"][PromptConstants.NO_STYLE_PRESET],
+        )
+
+    def test_truncate_prompt(self):
+        self.assertEqual(count_tokens("a cat, 4k"), 5)  # a, cat, ",", 4, k
+        self.assertEqual(truncate_prompt("a cat, 4k, sharp", 4), "a cat")
+        self.assertEqual(truncate_prompt("a cat", 75), "a cat")
+
+        max_chunks = Settings.server.prompt_max_chunks
+        try:
+            Settings.server.prompt_max_chunks = 1
+            prompt = GeneratePrompt("cat " * 100, "", PromptConstants.CINEMATIC)
+            self.assertLessEqual(count_tokens(prompt.prompt), CLIP_CHUNK_TOKENS)
+            self.assertTrue(prompt.prompt.startswith("RAW cinematic picture of a cat cat"))
+            self.assertLessEqual(count_tokens(prompt.negativeprompt), CLIP_CHUNK_TOKENS)
+
+            Settings.server.prompt_max_chunks = 0
+            prompt = GeneratePrompt("cat " * 100, "", PromptConstants.CINEMATIC)
+            self.assertGreater(count_tokens(prompt.prompt), 100)
+        finally:
+            Settings.server.prompt_max_chunks = max_chunks
+
+
+class TestPromptPool(unittest.TestCase):
+    def setUp(self):
+        self._old_server = Settings.server.model_copy()
+        Settings.server.prompt_pool_size = 6
+        Settings.server.prompt_pool_batch = 4
+        self.pool = _PromptPool()
+        self.batches = []
+
+        def _generate(n):
+            self.batches.append(n)
+            return generate_random_prompts(n)
+
+        patcher = mock.patch.object(prompt_pool, "generate_random_prompts", _generate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.stop()
+        Settings.server = self._old_server
+
+    def test_generate_random_prompts(self):
+        prompts = generate_random_prompts(3)
+        self.assertEqual(len(prompts), 3)
+        for prompt, negative_prompt in prompts:
+            self.assertTrue(prompt.endswith(", colorful, sharp focus"))
+            self.assertIn("low quality", negative_prompt)
+
+    def test_fill_and_take(self):
+        # filled in batches up to the pool size
+        self.assertEqual(self.pool.fill(), 4)
+        self.assertEqual(self.pool.fill(), 2)
+        self.assertEqual(self.pool.fill(), 0)
+        self.assertEqual(self.batches, [4, 2])
+        self.assertEqual(len(self.pool.take(4)), 4)
+        self.assertEqual(self.batches, [4, 2])
+        # the missing prompts are generated on request, in one batch
+        self.assertEqual(len(self.pool.take(3)), 3)
+        self.assertEqual(self.batches, [4, 2, 1])
+        self.assertEqual(self.pool.stats(), {"size": 0, "hits": 6, "misses": 1})
+
+    def test_refill_thread(self):
+        self.pool.start()
+        for _ in range(100):
+            if len(self.pool) == 6:
+                break
+            self.pool._stop.wait(0.02)
+        self.assertEqual(len(self.pool), 6)
+        self.pool.take(2)
+        for _ in range(100):
+            if len(self.pool) == 6:
+                break
+            self.pool._stop.wait(0.02)
+        self.assertEqual(len(self.pool), 6)
+        self.assertEqual(self.pool.stats()["misses"], 0)
+
+    def test_disabled(self):
+        Settings.server.prompt_pool_size = 0
+        self.assertEqual(self.pool.fill(), 0)
+        self.assertEqual(len(self.pool.take(2)), 2)
+        self.assertEqual(self.batches, [2])
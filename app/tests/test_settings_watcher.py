@@ -0,0 +1,88 @@
+import os
+import json
+import tempfile
+import unittest
+
+from app.settings import Settings, _Settings
+from app.utils.settings_watcher import _SettingsWatcher
+
+
+class TestSettingsWatcher(unittest.TestCase):
+    def setUp(self):
+        self._old_settings = Settings.model_copy(deep=True)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self._tmp.name, "bot_settings.json")
+        Settings.save_json(self.json_file)
+
+        self.watcher = _SettingsWatcher()
+        self.watcher.watch(self.json_file)
+
+    def tearDown(self):
+        Settings.apply(self._old_settings)
+        self._tmp.cleanup()
+
+    def write_settings(self, update):
+        with open(self.json_file, "r") as f:
+            settings = json.load(f)
+        update(settings)
+        with open(self.json_file, "w") as f:
+            json.dump(settings, f)
+        # force a different mtime (coarse file system timestamps)
+        st = os.stat(self.json_file)
+        os.utime(self.json_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def test_no_change(self):
+        self.assertFalse(self.watcher.check())
+
+    def test_reload(self):
+        calls = []
+        self.watcher.add_listener(lambda old, new: calls.append((old, new)))
+        old_files = Settings.files
+        old_max_jobs = Settings.server.max_jobs
+
+        self.write_settings(lambda s: s["server"].update(max_jobs=old_max_jobs + 1))
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(Settings.server.max_jobs, old_max_jobs + 1)
+        self.assertEqual(self.watcher.reload_count, 1)
+
+        # listeners get the old snapshot, objects held elsewhere are not mutated
+        old, new = calls[0]
+        self.assertEqual(old.server.max_jobs, old_max_jobs)
+        self.assertIs(new, Settings)
+        self.assertIsNot(Settings.files, old_files)
+
+    def test_invalid_settings(self):
+        max_jobs = Settings.server.max_jobs
+        with open(self.json_file, "w") as f:
+            f.write('{"server": {"max_jobs": ')
+        os.utime(self.json_file, ns=(0, 10**9))
+        self.assertFalse(self.watcher.check())
+        self.assertIsNotNone(self.watcher.last_error)
+        self.assertEqual(Settings.server.max_jobs, max_jobs)
+
+        # the same (invalid) file is not reloaded again
+        self.assertFalse(self.watcher.check())
+
+    def test_removed_model(self):
+        name = list(Settings.txt2img.models.keys())[0]
+        self.write_settings(lambda s: s["txt2img"]["models"].pop(name))
+        self.assertFalse(self.watcher.check())
+        self.assertIn(name, Settings.txt2img.models)
+
+    def test_restart_settings(self):
+        bot_command = Settings.server.bot_command
+        self.write_settings(lambda s: s["server"].update(bot_command="other"))
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(Settings.server.bot_command, bot_command)
+
+        # the image storage and the workflows stay in the folders they were loaded from
+        image_folder = Settings.files.image_folder
+        self.write_settings(lambda s: s["files"].update(image_folder="./elsewhere"))
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(Settings.files.image_folder, image_folder)
+
+    def test_apply(self):
+        new_settings = _Settings()
+        new_settings.server.max_jobs = 7
+        Settings.apply(new_settings)
+        self.assertEqual(Settings.server.max_jobs, 7)
@@ -0,0 +1,34 @@
+import os
+import sys
+import subprocess
+import unittest
+
+from app.utils.startup_profile import _StartupProfile
+
+
+class TestStartupProfile(unittest.TestCase):
+    def test_phase(self):
+        profile = _StartupProfile()
+        profile.enabled = True
+        with profile.phase("json"):
+            import json  # noqa: F401 (may already be imported)
+        report = profile.report()
+        self.assertIn("json", report)
+        self.assertEqual(len(profile._phases), 1)
+
+    def test_disabled(self):
+        profile = _StartupProfile()
+        profile.enabled = False
+        with profile.phase("nothing"):
+            pass
+        self.assertEqual(profile._phases, [])
+
+    def test_prompts_lazy_import(self):
+        # the GPT-2 model (transformers/torch) is only loaded on first use
+        code = (
+            "import sys, app.utils.prompts; "
+            "sys.exit('transformers' in sys.modules)"
+        )
+        env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+        result = subprocess.run([sys.executable, "-c", code], env=env)
+        self.assertEqual(result.returncode, 0)
@@ -0,0 +1,107 @@
+import time
+import tempfile
+import unittest
+
+from app.settings import Settings
+from app.sd_apis.comfyUI_api import ComfyUIAPI
+from app.sd_apis.timeouts import (
+    Deadline,
+    DeadlineExceededError,
+    job_budget,
+    retry_call,
+)
+from .mock_comfyUI_server import MockComfyUIConfig, MockComfyUIServer
+
+
+class TestDeadline(unittest.TestCase):
+    def setUp(self):
+        self._old_server = Settings.server.model_copy()
+
+    def tearDown(self):
+        Settings.server = self._old_server
+
+    def test_job_budget(self):
+        Settings.server.job_timeout_base = 10
+        Settings.server.job_timeout_per_mpixel = 100
+        Settings.server.job_timeout_max = 1000
+        self.assertEqual(job_budget(), 10)
+        self.assertAlmostEqual(job_budget(1000, 1000), 110)
+        self.assertAlmostEqual(job_budget(1000, 1000, frames=5), 510)
+        self.assertEqual(job_budget(1000, 1000, frames=100), 1000)
+
+        Settings.server.job_timeout_max = 0
+        self.assertIsNone(job_budget(1000, 1000))
+
+    def test_deadline(self):
+        deadline = Deadline(0.05)
+        self.assertLessEqual(deadline.timeout(10), 0.05)
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceededError):
+            deadline.check()
+        self.assertEqual(Deadline(None).timeout(10), 10)
+
+    def test_retry(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionResetError("reset")
+            return "ok"
+
+        retry_on = lambda e: isinstance(e, ConnectionError)
+        self.assertEqual(retry_call(flaky, retry_on, attempts=3, backoff=0.001), "ok")
+        self.assertEqual(len(calls), 3)
+
+        # errors that are not retried are raised at once
+        calls.clear()
+        with self.assertRaises(ConnectionResetError):
+            retry_call(flaky, lambda e: False, attempts=3, backoff=0.001)
+        self.assertEqual(len(calls), 1)
+
+
+class TestComfyUITimeouts(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockComfyUIServer(MockComfyUIConfig(steps=1)).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._old_files = Settings.files.model_copy()
+        self._old_server = Settings.server.model_copy()
+        Settings.files.image_folder = self._tmp.name
+        Settings.server.retry_backoff = 0.01
+        self.api = ComfyUIAPI(self.server.url)
+
+    def tearDown(self):
+        self.server.config.drop_prompts = False
+        self.server.config.fail_requests = {}
+        Settings.files = self._old_files
+        Settings.server = self._old_server
+        self._tmp.cleanup()
+
+    def test_dropped_prompt(self):
+        # the job fails at its deadline instead of waiting forever
+        self.server.config.drop_prompts = True
+        Settings.server.job_timeout_base = 0.5
+        Settings.server.request_timeout = 0.2
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceededError):
+            self.api.generate_image(prompt="cat", seed=1)
+        self.assertLess(time.perf_counter() - start, 2)
+
+    def test_transient_errors(self):
+        self.server.config.fail_requests = {"view": 2}
+        image = self.api.generate_image(prompt="cat", seed=2)
+        self.assertIsNotNone(image.image_filename)
+        self.assertEqual(self.server.config.fail_requests, {"view": 0})
+
+    def test_model_names_retried(self):
+        self.server.config.fail_requests = {"object_info": 2}
+        self.assertEqual(self.api.get_checkpoint_names(), self.server.config.checkpoints)
+        self.assertEqual(self.server.config.fail_requests, {"object_info": 0})
@@ -1,12 +1,14 @@
+import time
 import discord
 import atexit
 import asyncio
+import itertools
 from app.utils.logger import logger
-from typing import Callable, Any, List, Dict, cast
+from typing import AsyncIterator, Callable, Any, Hashable, Iterable, List, Dict, Optional, cast
 
 from app.settings import Settings
 
-__all__ = ["TaskState", "Task", "AsyncTaskQueue"]
+__all__ = ["TaskState", "Task", "AsyncTaskQueue", "as_completed"]
 
 
 class TaskState:
@@ -17,6 +19,9 @@ class TaskState:
     FAILED = "FAILED"
 
 
+FINISHED_STATES = (TaskState.CANCELLED, TaskState.COMPLETED, TaskState.FAILED)
+
+
 # Create async task object
 # - This is the object that will be added to the queue
 #   by and wraps around the function to be executed
@@ -24,6 +29,9 @@ class TaskState:
 #   and is specific to the AsyncTaskQueue to run with a synchronous API
 #   (i.e. the SD API is synchronous, so we need to run each task seperately, and in a synchronous manner.
 #    the number of threads can be increased when we have multiple APIs)
+# - the end of the task (completed, failed or cancelled) resolves a future,
+#   so any number of waiters (wait_result, as_completed) wake up at once, also
+#   when they start waiting after the task finished
 #
 class Task:
 
@@ -35,6 +43,9 @@ class Task:
         task_id: int = None,
         args: List = [],
         kwargs: Dict = {},
+        affinity_key: Optional[str] = None,
+        batch_key: Optional[Hashable] = None,
+        batch_func: Optional[Callable] = None,
     ):
         self.func = func
         self._task_id = task_id
@@ -44,7 +55,19 @@ class Task:
         self._result: Any = None
         self.args: List = args
         self.kwargs: Dict = kwargs
-        self._cond = asyncio.Condition()
+        self.affinity_key = affinity_key  # e.g. the model, tasks with the same key are grouped
+        self.skipped = 0  # number of times the task was passed over in the queue
+        # micro-batching: queued tasks with the same batch_key can be run together,
+        # batch_func(list of the tasks' args) -> one result per task
+        self.batch_key = batch_key if batch_func is not None else None
+        self.batch_func = batch_func
+        self.error: Optional[BaseException] = None  # exception of a failed task
+        # created on first use, bound to the running loop (tasks can be created without one)
+        self._future: Optional[asyncio.Future] = None
+        # timestamps (time.perf_counter) for queue/latency measurements
+        self.created_at: float = time.perf_counter()
+        self.started_at: float = None
+        self.finished_at: float = None
 
     def __repr__(self):
         return (
@@ -76,11 +99,32 @@ class Task:
     def result(self, value: Any):
         self._result = value
 
+    @property
+    def future(self) -> asyncio.Future:
+        # resolves to the task itself when it finished
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+            if self.done():
+                self._future.set_result(self)
+        return self._future
+
+    def done(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def _finish(self, state: TaskState):
+        self.finished_at = time.perf_counter()
+        self.state = state
+        if self._future is not None and not self._future.done():
+            try:
+                self._future.set_result(self)
+            except RuntimeError:
+                pass  # loop already closed (cancel_all_tasks at exit)
+
     def cancel(self):
         if self.state in [TaskState.RUNNING, TaskState.COMPLETED, TaskState.FAILED]:
             return False
 
-        self._state = TaskState.CANCELLED
+        self._finish(TaskState.CANCELLED)
         return True
 
     async def run(self):
@@ -92,6 +136,7 @@ class Task:
             return None
 
         try:
+            self.started_at = time.perf_counter()
             self.state = TaskState.RUNNING
             if self._is_async:
                 self.result = await self.func(*self.args, **self.kwargs)
@@ -99,23 +144,69 @@ class Task:
                 self.result = await asyncio.to_thread(
                     self.func, *self.args, **self.kwargs
                 )
-            self.state = TaskState.COMPLETED
-            async with self._cond:
-                self._cond.notify_all()
+            self._finish(TaskState.COMPLETED)
             return True
-        except:
-            self.state = TaskState.FAILED
+        except BaseException as e:
+            # also a cancelled worker (cancel_all_tasks): the waiters get None,
+            # the worker keeps draining the (cancelled) tasks left in the queue
+            self.error = e
+            self._finish(TaskState.FAILED)
+            return None
+
+    @staticmethod
+    async def run_batch(tasks: List["Task"]):
+        # runs compatible tasks with one call of the batch_func of the first one;
+        # a result that is an exception fails only its task
+        tasks = [task for task in tasks if task.state == TaskState.PENDING]
+        if not tasks:
+            return False
+        batch_func = tasks[0].batch_func
+        started_at = time.perf_counter()
+        for task in tasks:
+            task.started_at = started_at
+            task.state = TaskState.RUNNING
+        try:
+            calls = [task.args for task in tasks]
+            if asyncio.iscoroutinefunction(batch_func):
+                results = await batch_func(calls)
+            else:
+                results = await asyncio.to_thread(batch_func, calls)
+        except BaseException as e:
+            for task in tasks:
+                task.error = e
+                task._finish(TaskState.FAILED)
             return None
 
-    async def wait_result(self):
-        async with self._cond:
-            await self._cond.wait()
+        for task, result in zip(tasks, results):
+            if isinstance(result, BaseException):
+                task.error = result
+                task._finish(TaskState.FAILED)
+            else:
+                task.result = result
+                task._finish(TaskState.COMPLETED)
+        return all(task.state == TaskState.COMPLETED for task in tasks) or None
+
+    async def wait_result(self, timeout: Optional[float] = None):
+        # the result, None if the task failed or was cancelled;
+        # raises TimeoutError after `timeout` seconds (the task keeps running)
+        await asyncio.wait_for(asyncio.shield(self.future), timeout)
 
         if self.state in [TaskState.CANCELLED, TaskState.FAILED]:
             return None
         if self.state == TaskState.COMPLETED:
             return self.result
 
+
+async def as_completed(
+    tasks: Iterable[Task], timeout: Optional[float] = None
+) -> AsyncIterator[Task]:
+    # yields the tasks in the order they finish (check `state` / `result`),
+    # raises TimeoutError when they did not all finish within `timeout` seconds
+    futures = [task.future for task in tasks]
+    for next_done in asyncio.as_completed(futures, timeout=timeout):
+        yield await next_done
+
+
 # Semi-synchronous task queue:
 # - this is the parent object, the access to the queue is through the Singleton below
 # - The AsyncTaskQueue provides a method to feed the API with requests in a synchronous manner
@@ -136,7 +227,11 @@ class _AsyncTaskQueue(asyncio.Queue):
         self._num_workers = num_workers
         self._max_jobs = max_jobs
         self._workers = []
+        self._idle = set()  # workers waiting for a task
+        self._retire = 0  # workers to stop after their current task
+        self._loop: asyncio.AbstractEventLoop = None
         self._curr_id = 0
+        self._last_keys: Dict[asyncio.Task, str] = {}  # by worker, key of its last task
         atexit.register(self.cancel_all_tasks)
 
     @property
@@ -156,9 +251,25 @@ class _AsyncTaskQueue(asyncio.Queue):
     def num_workers(self) -> int:
         return self._num_workers
 
+    @num_workers.setter
+    def num_workers(self, value: int):
+        # running workers are resized live (can be set from any thread),
+        # otherwise takes effect when the workers are started
+        self._num_workers = max(1, value)
+        if not self._workers or self._loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._resize_workers()
+        else:
+            self._loop.call_soon_threadsafe(self._resize_workers)
+
     @property
     def num_active_workers(self) -> int:
-        return len(self._workers)
+        return len(self._workers) - self._retire
 
     def is_busy(self) -> bool:
         return self.qsize() > 0
@@ -182,6 +293,9 @@ class _AsyncTaskQueue(asyncio.Queue):
         task_owner: discord.Member,
         args: List = [],
         kwargs: Dict = {},
+        affinity_key: Optional[str] = None,
+        batch_key: Optional[Hashable] = None,
+        batch_func: Optional[Callable] = None,
     ) -> Task:
         task = Task(
             func,
@@ -189,6 +303,9 @@ class _AsyncTaskQueue(asyncio.Queue):
             task_id=self.new_id,
             args=args,
             kwargs=kwargs,
+            affinity_key=affinity_key,
+            batch_key=batch_key,
+            batch_func=batch_func,
         )
         ok = await self.add_task(task)
         if ok:
@@ -212,21 +329,119 @@ class _AsyncTaskQueue(asyncio.Queue):
             worker.cancel()
         return res
 
+    # Model affinity: the next task of a worker is one with the same affinity key
+    # (model) as its previous one, when queued, to avoid model swaps on the SD host.
+    # The key is kept per worker (called from the worker's `get`), a worker is not
+    # bound to a host, so with several hosts it is the model the worker last used.
+    # Tasks passed over are taken in order once they were skipped
+    # `affinity_max_skips` times.
+    def _get(self) -> Task:
+        max_skips = Settings.server.affinity_max_skips or 0
+        worker = asyncio.current_task()
+        last_key = self._last_keys.get(worker)
+        head: Task = self._queue[0]
+        if (
+            max_skips > 0
+            and last_key is not None
+            and head.affinity_key != last_key
+            and head.skipped < max_skips
+        ):
+            for i, task in enumerate(self._queue):
+                if task.affinity_key == last_key and task.state == TaskState.PENDING:
+                    for passed in itertools.islice(self._queue, i):
+                        passed.skipped += 1
+                    del self._queue[i]
+                    return task
+
+        task = self._queue.popleft()
+        if task.affinity_key is not None and worker is not None:
+            self._last_keys[worker] = task.affinity_key
+        return task
+
+    # Micro-batching: queued tasks with the same batch_key as the task taken by a
+    # worker are run with it, up to `batch_max_size` tasks. When the batch is not
+    # full, the worker waits `batch_window` seconds for more compatible tasks.
+    async def _take_batch(self, batch: List[Task]):
+        max_size = Settings.server.batch_max_size or 1
+        if batch[0].batch_key is None or max_size < 2:
+            return
+
+        self._take_compatible(batch, max_size)
+        window = Settings.server.batch_window or 0
+        if len(batch) < max_size and window > 0:
+            await asyncio.sleep(window)
+            self._take_compatible(batch, max_size)
+
+    def _take_compatible(self, batch: List[Task], max_size: int):
+        for task in list(self._queue):
+            if len(batch) >= max_size:
+                break
+            if task.batch_key == batch[0].batch_key and task.state == TaskState.PENDING:
+                self._queue.remove(task)
+                batch.append(task)
+
     async def start_workers(self):
+        self._loop = asyncio.get_running_loop()
         for _ in range(self._num_workers):
-            worker = asyncio.create_task(self._worker())
-            self._workers.append(worker)
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = asyncio.create_task(self._worker())
+        self._workers.append(worker)
+
+    def _resize_workers(self):
+        # grow: take back pending retirements first, then start new workers
+        # shrink: stop idle workers, busy ones stop after their current task
+        diff = self._num_workers - self.num_active_workers
+        if diff > 0:
+            resumed = min(diff, self._retire)
+            self._retire -= resumed
+            for _ in range(diff - resumed):
+                self._add_worker()
+        elif diff < 0:
+            for worker in list(self._idle)[:-diff]:
+                self._idle.discard(worker)
+                self._workers.remove(worker)
+                worker.cancel()
+                diff += 1
+            self._retire += -diff
+
+        if self._use_logger:
+            self.logger.info(f"TaskQueue resized to n_workers={self._num_workers}")
 
     async def _worker(self):
-        while True:
-            task: Task = await self.get()
-            res = await task.run()
-            if res and self._use_logger:
-                self.logger.info(f"Task {task!r} completed successfully.")
-            elif self._use_logger:
-                self.logger.error(f"Task {task!r} failed.")
-
-            self.task_done()
+        worker = asyncio.current_task()
+        try:
+            while True:
+                if self._retire > 0:
+                    self._retire -= 1
+                    return
+
+                self._idle.add(worker)
+                try:
+                    task: Task = await self.get()
+                finally:
+                    self._idle.discard(worker)
+
+                batch = [task]
+                try:
+                    await self._take_batch(batch)
+                    if len(batch) > 1:
+                        res = await Task.run_batch(batch)
+                    else:
+                        res = await task.run()
+                    if res and self._use_logger:
+                        self.logger.info(f"Task {task!r} completed successfully.")
+                    elif self._use_logger:
+                        self.logger.error(f"Task {task!r} failed: {task.error!r}")
+                finally:
+                    for batched in batch:
+                        batched.cancel()  # not run (worker cancelled while batching)
+                        self.task_done()
+        finally:
+            self._last_keys.pop(worker, None)
+            if worker in self._workers:
+                self._workers.remove(worker)
 
 
 # Singleton queue object;
@@ -0,0 +1,181 @@
+import os
+import struct
+import hashlib
+import aiohttp
+import discord
+from typing import Optional, Tuple
+
+from app.settings import Settings
+from app.utils.logger import logger
+from .image_file import ImageFile
+from .image_storage import ImageStorage, StorageTier
+
+__all__ = ["IngestError", "AttachmentIngest"]
+
+CHUNK_SIZE = 64 * 2**10
+MAX_HEADER_SIZE = 256 * 2**10  # give up looking for the image size after this
+
+
+class IngestError(ValueError):
+    # raised when an attachment is rejected, the message is shown to the user
+    pass
+
+
+# returns the image type and (width, height) from the start of an image file,
+# size is None when it is not contained in the given header bytes
+def sniff_image_header(header: bytes) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        if len(header) >= 24 and header[12:16] == b"IHDR":
+            return "png", struct.unpack(">II", header[16:24])
+        return "png", None
+
+    if header.startswith(b"\xff\xd8"):
+        # walk the JPEG segments up to the start of frame (SOFn) marker
+        i = 2
+        while i + 9 < len(header):
+            if header[i] != 0xFF:
+                i += 1
+                continue
+            marker = header[i + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                i += 1 if marker == 0xFF else 2
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", header[i + 5 : i + 9])
+                return "jpeg", (width, height)
+            (length,) = struct.unpack(">H", header[i + 2 : i + 4])
+            i += 2 + length
+        return "jpeg", None
+
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif", struct.unpack("<HH", header[6:10]) if len(header) >= 10 else None
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp", None
+
+    return None, None
+
+
+# Ingests discord attachments into the image storage
+# - rejects wrong type / oversize inputs from the attachment meta-data, before download
+# - the download is streamed to storage (hashed on the fly, no in-memory copy),
+#   and aborted as soon as the header shows a wrong type or oversize image
+class _AttachmentIngest:
+    def __init__(self):
+        self._session: aiohttp.ClientSession = None
+        self.logger = logger
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=Settings.server.interaction_timeout)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _check_type(image_type: Optional[str], description: str):
+        if image_type is None or image_type not in Settings.files.image_types:
+            raise IngestError(
+                f"Please provide an image file. Provided type was '{description}'"
+            )
+
+    @staticmethod
+    def _check_size(
+        size: Optional[Tuple[int, int]],
+        max_width: Optional[int],
+        max_height: Optional[int],
+    ):
+        if not size or not (max_width or max_height):
+            return
+        width, height = size
+        max_size = (max_width or max_height) * (max_height or max_width)
+        if width * height > max_size:
+            raise IngestError(f"Input image is too large. W,H= {width},{height}")
+
+    def _check_header(
+        self,
+        header: bytes,
+        content_type: str,
+        max_width: Optional[int],
+        max_height: Optional[int],
+    ) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+        image_type, size = sniff_image_header(header)
+        self._check_type(image_type, image_type or content_type)
+        self._check_size(size, max_width, max_height)
+        return image_type, size
+
+    async def ingest(
+        self,
+        attachment: discord.Attachment,
+        *,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        tier: str = StorageTier.INPUTS,
+    ) -> Tuple[ImageFile, Tuple[int, int]]:
+        # Returns the stored image and its size (w, h). A storage reference is held
+        # for the caller on the stored file, to be released with ImageStorage.release
+        content_type = attachment.content_type or ""
+        self._check_type(
+            content_type.split("/")[1] if content_type.startswith("image/") else None,
+            content_type,
+        )
+        max_bytes = (Settings.files.max_upload_mb or 0) * 2**20
+        if max_bytes and attachment.size and attachment.size > max_bytes:
+            raise IngestError(
+                f"Input image is too large. Size: {attachment.size/2**20:.3f}MB"
+            )
+        if attachment.width and attachment.height:
+            self._check_size((attachment.width, attachment.height), max_width, max_height)
+
+        session = await self._get_session()
+        tmp_path = ImageStorage.temp_path()
+        hasher = hashlib.blake2b(digest_size=16)
+        header, image_type, size, n_bytes = b"", None, None, 0
+        try:
+            async with session.get(attachment.url) as res:
+                if res.status != 200:
+                    raise IngestError(
+                        f"Failed to download image (status={res.status})"
+                    )
+                with open(tmp_path, "wb") as f:
+                    async for chunk in res.content.iter_chunked(CHUNK_SIZE):
+                        n_bytes += len(chunk)
+                        if max_bytes and n_bytes > max_bytes:
+                            raise IngestError(
+                                f"Input image is too large. Size: >{max_bytes/2**20:.3f}MB"
+                            )
+                        if size is None and len(header) < MAX_HEADER_SIZE:
+                            header += chunk
+                            if len(header) >= 32:
+                                image_type, size = self._check_header(
+                                    header, content_type, max_width, max_height
+                                )
+
+                        hasher.update(chunk)
+                        f.write(chunk)
+
+            if size is None:
+                image_type, size = self._check_header(
+                    header, content_type, max_width, max_height
+                )
+            if size is None:
+                raise IngestError("Could not read the image size, invalid image file")
+
+            extension = image_type if image_type in Settings.files.image_types else "png"
+            path = ImageStorage.store_file(tmp_path, hasher.hexdigest(), extension, tier)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        image = ImageFile(image_type=extension)
+        image.image_filename = path
+        return image, size
+
+
+AttachmentIngest = _AttachmentIngest()  # singleton instance
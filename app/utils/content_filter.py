@@ -0,0 +1,86 @@
+import re
+import threading
+from collections import Counter
+from typing import List, Optional, Pattern, Tuple
+
+from app.settings import Settings
+from app.utils.logger import logger
+
+__all__ = ["ContentFilter"]
+
+
+# Prompt content filter, the words of `server.content_filter` in one precompiled regex
+# - case-insensitive, on word boundaries ("NSFW!" matches, "snuder" does not),
+#   single punctuation between the letters is ignored ("n.s.f.w", "n-u-d-e")
+# - a trailing `*` matches any word ending ("porn*": "porn", "porno", ...)
+# - recompiled when the word list changes (settings hot reload)
+# - counts the checked prompts, the flagged ones and the hits by word
+class _ContentFilter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._words: Tuple[str, ...] = ()
+        self._pattern: Optional[Pattern] = None
+        self.checked = 0
+        self.flagged = 0  # prompts with disallowed words
+        self.hits: Counter = Counter()
+        self.logger = logger
+
+    @staticmethod
+    def compile(words: Tuple[str, ...]) -> Optional[Pattern]:
+        alternatives = []
+        for word in sorted({w.strip().lower() for w in words if w.strip()}, key=len, reverse=True):
+            wildcard = word.endswith("*")
+            letters = [re.escape(c) for c in word.rstrip("*")]
+            if not letters:
+                continue
+            alternatives.append(r"[^\w\s]?".join(letters) + (r"\w*" if wildcard else ""))
+        if not alternatives:
+            return None
+        return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+    @property
+    def pattern(self) -> Optional[Pattern]:
+        words = tuple(Settings.server.content_filter or ())
+        if words != self._words:
+            with self._lock:
+                self._pattern = self.compile(words)
+                self._words = words
+        return self._pattern
+
+    def find(self, text: str) -> List[str]:
+        # the disallowed words in the text (as written)
+        pattern = self.pattern
+        if pattern is None or not text:
+            return []
+        return [m.group() for m in pattern.finditer(text)]
+
+    def check(self, text: str) -> List[str]:
+        # find, counted in the metrics
+        found = self.find(text)
+        with self._lock:
+            self.checked += 1
+            if found:
+                self.flagged += 1
+                self.hits.update(re.sub(r"[^\w]", "", f.lower()) for f in found)
+        if found:
+            self.logger.info(f"Content filter: {', '.join(found)} in a prompt")
+        return found
+
+    def remove(self, text: str) -> str:
+        # the text without the disallowed words
+        pattern = self.pattern
+        if pattern is None:
+            return text
+        return re.sub(r"\s{2,}", " ", pattern.sub("", text)).strip()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "flagged": self.flagged,
+                "hits": dict(self.hits),
+            }
+
+
+# Singleton content filter
+ContentFilter = _ContentFilter()
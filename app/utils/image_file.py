@@ -16,7 +16,7 @@ from app.settings import (
     Txt2Vid2StepSingleModel,
     Img2VidSingleModel,
 )
-from .helpers import get_base_dir
+from .image_storage import ImageStorage, StorageTier
 
 
 class ImageFile:
@@ -60,21 +60,23 @@ class ImageFile:
             return Image.open(self.image_object).size
 
     @staticmethod
-    def _random_filename(extension: str = Settings.files.default_image_type):
-        return os.path.abspath(
-            os.path.join(
-                get_base_dir(),
-                Settings.files.image_folder,
-                "".join(random.choices(string.ascii_letters + string.digits, k=24))
-                + "."
-                + extension,
-            )
+    def _random_filename(
+        extension: str = Settings.files.default_image_type,
+        tier: str = StorageTier.OUTPUTS,
+    ):
+        return ImageStorage.new_path(
+            "".join(random.choices(string.ascii_letters + string.digits, k=24)),
+            extension,
+            tier,
         )
 
     def create_file_name(
-        self, extension: str = Settings.files.default_image_type
+        self,
+        extension: str = Settings.files.default_image_type,
+        tier: str = StorageTier.OUTPUTS,
     ) -> str:
-        self.image_filename = self._random_filename(extension)
+        self.image_filename = self._random_filename(extension, tier)
+        ImageStorage.register(self.image_filename)
         return self.image_filename
 
     def from_b64(self, image_b64: str):
@@ -84,6 +86,9 @@ class ImageFile:
         self.image_object = io.BytesIO(image_bytes)
 
     def to_b64(self):
+        if self.image_object is None and self.image_filename is not None:
+            self.load()
+
         if isinstance(self.image_object, io.BytesIO):
             self.image_object = self.image_object.read()
         elif isinstance(self.image_object, Image.Image):
@@ -105,11 +110,34 @@ class ImageFile:
         with open(filename, "rb") as f:
             self.image_object = f.read()
 
+    def _buffer(self) -> bytes | memoryview:
+        if isinstance(self.image_object, io.BytesIO):
+            return self.image_object.getbuffer()
+        return self.image_object
+
+    @property
+    def content_hash(self) -> str:
+        return ImageStorage.content_hash(self._buffer())
+
+    def save_deduplicated(
+        self, extension: str = None, tier: str = StorageTier.INPUTS
+    ) -> str:
+        # store the image under its content hash, duplicate images share one file
+        # (a storage reference is held for the caller, see ImageStorage.store_bytes)
+        self.image_type = extension or self.image_type
+        self.image_filename = ImageStorage.store_bytes(
+            self._buffer(), self.image_type, tier
+        )
+        return self.image_filename
+
     def save(
-        self, filename: str = None, extension: str = Settings.files.default_image_type
+        self,
+        filename: str = None,
+        extension: str = Settings.files.default_image_type,
+        tier: str = StorageTier.OUTPUTS,
     ):
         self.image_type = extension or self.image_type
-        fname = filename or self.image_filename or self._random_filename()
+        fname = filename or self.image_filename or self._random_filename(tier=tier)
         self.image_filename = os.path.abspath(
             os.path.join(
                 os.path.dirname(fname),
@@ -120,6 +148,7 @@ class ImageFile:
 
         with open(self.image_filename, "wb") as f:
             f.write(self.image_object.getbuffer())
+        ImageStorage.register(self.image_filename)
 
 
 @dataclass
@@ -0,0 +1,323 @@
+import os
+import time
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional
+from dataclasses import dataclass
+
+from app.settings import Settings
+from app.utils.logger import logger
+from .helpers import get_base_dir
+
+__all__ = ["StorageTier", "ImageStorage"]
+
+
+class StorageTier:
+    # inputs are user uploads (cheap to re-upload), evicted first
+    # outputs are generated images / videos, kept longer
+    INPUTS = "inputs"
+    OUTPUTS = "outputs"
+
+    @classmethod
+    def get_tiers(cls) -> List[str]:
+        # ordered by eviction priority (first tier is evicted first)
+        return [cls.INPUTS, cls.OUTPUTS]
+
+
+@dataclass
+class _StoredFile:
+    path: str
+    tier: str
+    size: Optional[int] = None  # None until the file has been stat'ed
+    mtime: float = 0.0
+
+
+# Bounded, tiered storage for the generated images folder
+# - every file written by the bot is registered with the storage singleton
+# - views (and commands) hold references to files they may still need,
+#   referenced files are never evicted
+# - a background thread evicts files that are older than their tier retention,
+#   and the oldest unreferenced files while the folder is over its size budget
+class _ImageStorage:
+    def __init__(self):
+        self._files: Dict[str, _StoredFile] = {}
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._gc_thread: threading.Thread = None
+        self._stop = threading.Event()
+        self._scanned = False
+        self.dedup_hits = 0
+        self.logger = logger
+
+    @property
+    def root_folder(self) -> str:
+        return os.path.abspath(
+            os.path.join(get_base_dir(), Settings.files.image_folder)
+        )
+
+    @property
+    def managed_types(self) -> List[str]:
+        return Settings.files.image_types + Settings.files.video_types
+
+    @property
+    def total_size(self) -> int:
+        with self._lock:
+            return sum(f.size or 0 for f in self._files.values())
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.abspath(path) in self._files
+
+    def folder_for(self, name: str, tier: str = StorageTier.OUTPUTS) -> str:
+        if tier not in StorageTier.get_tiers():
+            raise ValueError(f"Invalid storage tier: {tier}")
+
+        folder = os.path.join(self.root_folder, tier)
+        if Settings.files.shard_image_folder:
+            folder = os.path.join(folder, name[:2])
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def new_path(
+        self, name: str, extension: str, tier: str = StorageTier.OUTPUTS
+    ) -> str:
+        return os.path.join(self.folder_for(name, tier), f"{name}.{extension}")
+
+    def tier_of(self, path: str) -> str:
+        rel = os.path.relpath(os.path.abspath(path), self.root_folder)
+        top = rel.split(os.sep)[0]
+        # legacy (flat) files are treated as outputs
+        return top if top in StorageTier.get_tiers() else StorageTier.OUTPUTS
+
+    def is_managed(self, path: str) -> bool:
+        root = self.root_folder
+        return os.path.commonpath([root, os.path.abspath(path)]) == root
+
+    def register(self, path: str):
+        # files outside of the image folder are never tracked (or evicted)
+        path = os.path.abspath(path)
+        if not self.is_managed(path):
+            return
+
+        with self._lock:
+            self._files[path] = _StoredFile(
+                path=path, tier=self.tier_of(path), mtime=time.time()
+            )
+
+    @staticmethod
+    def content_hash(data: bytes | memoryview) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def store_bytes(
+        self,
+        data: bytes | memoryview,
+        extension: str,
+        tier: str = StorageTier.INPUTS,
+        content_hash: Optional[str] = None,
+    ) -> str:
+        # Content addressed storage: identical data is stored once, under its hash.
+        # A reference is acquired for the caller, which must be released when done.
+        tmp_path = self.temp_path()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self.store_file(
+            tmp_path, content_hash or self.content_hash(data), extension, tier
+        )
+
+    def temp_path(self) -> str:
+        # temporary files are written next to the stored files (same file system),
+        # these are ignored by the GC since they have no managed extension
+        os.makedirs(self.root_folder, exist_ok=True)
+        return os.path.join(
+            self.root_folder, f".{threading.get_ident()}_{time.time_ns()}.tmp"
+        )
+
+    def store_file(
+        self,
+        tmp_path: str,
+        content_hash: str,
+        extension: str,
+        tier: str = StorageTier.INPUTS,
+    ) -> str:
+        # move a completely written temporary file into content addressed storage
+        path = self.new_path(content_hash, extension, tier)
+        # the existing file is referenced under the lock, so the GC (checking the
+        # references under the lock) cannot remove it between check and acquire
+        with self._lock:
+            exists = os.path.exists(path)
+            if exists:
+                self.dedup_hits += 1
+                os.utime(path)  # restart the retention period
+            else:
+                os.replace(tmp_path, path)
+            self.register(path)
+            self.acquire(path)
+
+        if exists:
+            os.remove(tmp_path)
+        return path
+
+    def acquire(self, *paths: Optional[str]):
+        # hold a reference to the files, preventing their eviction
+        with self._lock:
+            for path in filter(None, paths):
+                path = os.path.abspath(path)
+                self._refs[path] = self._refs.get(path, 0) + 1
+
+    def release(self, *paths: Optional[str]):
+        with self._lock:
+            for path in filter(None, paths):
+                path = os.path.abspath(path)
+                count = self._refs.get(path, 0) - 1
+                if count > 0:
+                    self._refs[path] = count
+                else:
+                    self._refs.pop(path, None)
+
+    def ref_count(self, path: str) -> int:
+        return self._refs.get(os.path.abspath(path), 0)
+
+    def scan(self):
+        # (re)build the index from the files on disk
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root_folder):
+            for filename in filenames:
+                if filename.split(".")[-1].lower() not in self.managed_types:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files[path] = _StoredFile(
+                    path=path,
+                    tier=self.tier_of(path),
+                    size=stat.st_size,
+                    mtime=stat.st_mtime,
+                )
+
+        with self._lock:
+            self._files = files
+            self._scanned = True
+
+    def _refresh_sizes(self):
+        with self._lock:
+            pending = [f for f in self._files.values() if f.size is None]
+
+        for f in pending:
+            try:
+                stat = os.stat(f.path)
+                f.size, f.mtime = stat.st_size, stat.st_mtime
+            except FileNotFoundError:
+                with self._lock:
+                    self._files.pop(f.path, None)
+
+    def _retention_seconds(self, tier: str) -> Optional[float]:
+        hours = {
+            StorageTier.INPUTS: Settings.files.input_retention_hours,
+            StorageTier.OUTPUTS: Settings.files.output_retention_hours,
+        }[tier]
+        return hours * 3600 if hours else None
+
+    def _evict(self, stored: _StoredFile) -> Optional[int]:
+        # returns the size freed, None if the file was not removed; the file may
+        # have been referenced again since the candidates were taken (re-checked
+        # under the lock, as store_file references it)
+        with self._lock:
+            if self._refs.get(stored.path, 0) > 0:
+                return None
+            try:
+                os.remove(stored.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"Failed to evict '{stored.path}': {e}")
+                return None
+            self._files.pop(stored.path, None)
+        return stored.size or 0
+
+    def collect(self, now: Optional[float] = None) -> int:
+        # Run a single eviction pass, returns the number of files removed
+        if not self._scanned:
+            self.scan()
+        self._refresh_sizes()
+
+        now = now or time.time()
+        grace = Settings.files.storage_gc_grace_seconds
+        with self._lock:
+            candidates = [
+                f
+                for f in self._files.values()
+                if f.path not in self._refs and now - f.mtime > grace
+            ]
+
+        # 1. tier retention
+        evicted = 0
+        remaining: List[_StoredFile] = []
+        for f in candidates:
+            retention = self._retention_seconds(f.tier)
+            if retention is not None and now - f.mtime > retention:
+                if self._evict(f) is not None:
+                    evicted += 1
+            else:
+                remaining.append(f)
+
+        # 2. size budget: lowest tier first, then oldest first
+        budget = (Settings.files.max_storage_mb or 0) * 2**20
+        if budget:
+            total = self.total_size
+            priority = StorageTier.get_tiers()
+            remaining.sort(key=lambda f: (priority.index(f.tier), f.mtime))
+            for f in remaining:
+                if total <= budget:
+                    break
+                freed = self._evict(f)
+                if freed is not None:
+                    total -= freed
+                    evicted += 1
+
+            if total > budget:
+                self.logger.warning(
+                    f"Image storage over budget ({total/2**20:.1f}MB > "
+                    f"{budget/2**20:.1f}MB), remaining files are in use"
+                )
+
+        if evicted:
+            self.logger.info(
+                f"Image storage: evicted {evicted} files, "
+                f"{len(self)} files ({self.total_size/2**20:.1f}MB) remaining"
+            )
+        return evicted
+
+    def start_gc(self, interval: Optional[int] = None):
+        interval = interval or Settings.files.storage_gc_interval
+        if self._gc_thread is not None or not interval:
+            return
+
+        def _gc_loop():
+            self.scan()
+            while not self._stop.wait(interval):
+                try:
+                    self.collect()
+                except Exception as e:
+                    self.logger.error(f"Image storage GC failed: {e}")
+
+        self._stop.clear()
+        self._gc_thread = threading.Thread(
+            target=_gc_loop, name="image-storage-gc", daemon=True
+        )
+        self._gc_thread.start()
+        self.logger.info(f"Image storage GC started, interval={interval}s")
+
+    def stop_gc(self):
+        self._stop.set()
+        self._gc_thread = None
+
+    def files(self, tier: Optional[str] = None) -> Iterable[str]:
+        with self._lock:
+            return [p for p, f in self._files.items() if tier in (None, f.tier)]
+
+
+ImageStorage = _ImageStorage()  # singleton instance
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from app.settings import Settings
+from app.utils.logger import logger
+from app.utils.prompts import generate_random_prompts, preload_prompt_model
+
+__all__ = ["PromptPool"]
+
+
+# Pool of random prompts generated ahead, for the random commands
+# - a ring buffer of `server.prompt_pool_size` (prompt, negative prompt) pairs,
+#   taken in O(1) without running the prompt model on request
+# - a background thread refills it in batches of `server.prompt_pool_batch`
+#   (one model.generate call per batch), woken up when prompts are taken
+# - an empty pool (or size 0) generates the missing prompts on request
+class _PromptPool:
+    def __init__(self):
+        self._pool: deque = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0  # prompts taken from the pool
+        self.misses = 0  # prompts generated on request
+        self.logger = logger
+
+    @property
+    def size(self) -> int:
+        return max(Settings.server.prompt_pool_size or 0, 0)
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    def fill(self, max_prompts: Optional[int] = None) -> int:
+        # generate one batch into the pool, returns the number of prompts added
+        missing = self.size - len(self._pool)
+        batch = max(Settings.server.prompt_pool_batch or 1, 1)
+        n = min(missing, batch, max_prompts or batch)
+        if n <= 0:
+            return 0
+        prompts = generate_random_prompts(n)
+        with self._lock:
+            self._pool.extend(prompts[: max(self.size - len(self._pool), 0)])
+        return len(prompts)
+
+    def take(self, n: int = 1) -> List[Tuple[str, str]]:
+        # n (prompt, negative prompt) pairs, oldest first
+        with self._lock:
+            prompts = [self._pool.popleft() for _ in range(min(n, len(self._pool)))]
+            self.hits += len(prompts)
+            self.misses += n - len(prompts)
+        if len(prompts) < n:
+            prompts += generate_random_prompts(n - len(prompts))
+        self._wake.set()
+        return prompts
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if not self.size:
+            # no pool, only load the model ahead
+            preload_prompt_model()
+            return
+
+        def _refill_loop():
+            while not self._stop.is_set():
+                try:
+                    if self.fill():
+                        continue
+                except Exception as e:
+                    self.logger.error(f"Prompt pool refill failed: {e}")
+                    self._stop.wait(60)
+                self._wake.wait()
+                self._wake.clear()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_refill_loop, name="prompt-pool", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Prompt pool started, size={self.size}")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._pool), "hits": self.hits, "misses": self.misses}
+
+
+PromptPool = _PromptPool()  # singleton instance
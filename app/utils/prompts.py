@@ -1,9 +1,70 @@
-from transformers import GPT2Tokenizer, GPT2LMHeadModel
+import re
+import math
 import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# The random prompt model (transformers/torch) is loaded on first use,
+# importing transformers alone takes seconds and it is only used for random prompts
+tokenizer = None
+model = None
+_model_lock = threading.Lock()
+
+
+def load_prompt_model():
+    global tokenizer, model
+    with _model_lock:
+        if model is None:
+            from transformers import GPT2Tokenizer, GPT2LMHeadModel
+
+            _tokenizer = GPT2Tokenizer.from_pretrained('distilgpt2')
+            # batches are left padded with the end token (a new [PAD] token would
+            # have no embedding in the model)
+            _tokenizer.pad_token = _tokenizer.eos_token
+            _tokenizer.padding_side = 'left'
+            model = GPT2LMHeadModel.from_pretrained('FredZhang7/distilgpt2-stable-diffusion-v2')
+            tokenizer = _tokenizer
+    return tokenizer, model
+
+
+def preload_prompt_model() -> threading.Thread:
+    # load the model in the background (e.g. after startup)
+    thread = threading.Thread(target=load_prompt_model, name="prompt-model", daemon=True)
+    thread.start()
+    return thread
+
+
+PROMPT_BEGINNINGS = [
+    "landscape of", "a beautiful", "digital concept art", "a", 
+    "abstract", "highly detailed", "landscape", "fantasy", 
+    "isometric", "Greg Rutkowski", "makoto shinkai", 
+    "undergrowth, lush", "volumetric lighting", "4k", 
+    "by", "dreamlike", "surreal", "lust city", "By Brad Rigney", "vivid colors"
+]
+RANDOM_NEGATIVE_PROMPT = "monochrome, nsfw, nude, borders, low quality, low resolution, greyscale"
+
+
+def generate_random_prompts(n: int) -> List[Tuple[str, str]]:
+    # n random (prompt, negative prompt) pairs, generated with a finetuned gpt 2
+    # in one batch (one model.generate call). Uses the transformers library.
+    tokenizer, model = load_prompt_model()
+    beginnings = [random.choice(PROMPT_BEGINNINGS) for _ in range(n)]
+    inputs = tokenizer(beginnings, return_tensors='pt', padding=True)
+
+    output = model.generate(
+        inputs.input_ids,
+        attention_mask=inputs.attention_mask,
+        pad_token_id=tokenizer.pad_token_id,
+        do_sample=True,
+        temperature=0.9,
+        top_k=50,
+        max_length=50,
+        num_return_sequences=1,
+        repetition_penalty=1.15,
+    )
+    texts = tokenizer.batch_decode(output, skip_special_tokens=True)
+    return [(f"{text.strip()}, colorful, sharp focus", RANDOM_NEGATIVE_PROMPT) for text in texts]
 
-tokenizer = GPT2Tokenizer.from_pretrained('distilgpt2')
-tokenizer.add_special_tokens({'pad_token': '[PAD]'})
-model = GPT2LMHeadModel.from_pretrained('FredZhang7/distilgpt2-stable-diffusion-v2')
 
 class PromptConstants:
     NO_STYLE_PRESET = 'No Style Preset'
@@ -128,6 +189,65 @@ class PromptConstants:
         ]
 
 
+    @classmethod
+    def split_negative_prompt(cls, negative_prompt: str) -> Tuple[str, str]:
+        # (user part, style template) of a negative prompt made by GeneratePrompt,
+        # the template is "" when the prompt does not end with one
+        for template in _NEGATIVE_TEMPLATES:
+            if negative_prompt == template:
+                return "", template
+            if negative_prompt.endswith(", " + template):
+                return negative_prompt[: -len(template) - 2], template
+        return negative_prompt, ""
+
+
+# longest first, a template may end with another one
+_NEGATIVE_TEMPLATES = sorted(
+    set(PromptConstants.cast["negativeprompt_template"].values()), key=len, reverse=True
+)
+
+# (preprompt, afterprompt, negative prompt template) by style, looked up once
+_STYLE_PARTS: Dict[str, Tuple[str, str, str]] = {
+    style: tuple(
+        PromptConstants.cast[part].get(style, PromptConstants.cast[part]["default"])
+        for part in ("preprompt", "afterprompt", "negativeprompt_template")
+    )
+    for style in PromptConstants.get_style_presets()
+}
+_DEFAULT_STYLE_PARTS = _STYLE_PARTS[PromptConstants.NO_STYLE_PRESET]
+
+# CLIP encodes prompts in chunks of 77 tokens, 75 of the text (+ start, end token)
+CLIP_CHUNK_TOKENS = 75
+# pre-tokenization of the CLIP tokenizer (words, single digits, punctuation runs)
+_CLIP_WORDS = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|[^\s\w]+", re.IGNORECASE)
+# long (rare) words are split into several BPE tokens, counted generously
+# (rather underestimated than cutting text the host would encode)
+_CHARS_PER_TOKEN = 10
+
+
+def _word_tokens(word: str) -> int:
+    return math.ceil(len(word) / _CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    # estimate of the CLIP token count (without the CLIP vocabulary): words are
+    # one token, long words one token per _CHARS_PER_TOKEN characters
+    return sum(_word_tokens(m.group()) for m in _CLIP_WORDS.finditer(text))
+
+
+def truncate_prompt(text: str, max_tokens: int) -> str:
+    # cut the text after `max_tokens` (estimated) CLIP tokens, at a word boundary
+    n_tokens = 0
+    for m in _CLIP_WORDS.finditer(text):
+        n_tokens += _word_tokens(m.group())
+        if n_tokens > max_tokens:
+            text = text[: m.start()]
+            if text[-1:].isalnum() and m.group()[0].isalnum():
+                text = re.sub(r"\w+$", "", text)  # inside a word (e.g. "4k")
+            return text.rstrip(" ,")
+    return text
+
+
 class GeneratePrompt:
     def __init__(
             self, 
@@ -141,9 +261,13 @@ class GeneratePrompt:
             self._style = style
         else:
             self._style = PromptConstants.NO_STYLE_PRESET 
+        # assembled on first use, again after one of the inputs changed
+        self._prompt: Optional[str] = None
+        self._negativeprompt: Optional[str] = None
 
-        if input_prompt is not None: 
-            self._make_prompt(input_prompt, input_negativeprompt, style)
+    def _assemble(self):
+        if self._prompt is None and self._input_prompt is not None:
+            self._make_prompt(self._input_prompt, self._input_negativeprompt, self._style)
 
     @property
     def input_prompt(self):
@@ -152,11 +276,7 @@ class GeneratePrompt:
     @input_prompt.setter
     def input_prompt(self, input_prompt: str):
         self._input_prompt = input_prompt
-        self._prompt, self._negativeprompt = self._make_prompt(
-            input_prompt=input_prompt,
-            input_negativeprompt=self._input_negativeprompt,
-            style=self._style
-        ) 
+        self._prompt = self._negativeprompt = None
 
     @property
     def input_negativeprompt(self):
@@ -165,14 +285,11 @@ class GeneratePrompt:
     @input_negativeprompt.setter
     def input_negativeprompt(self, input_negativeprompt: str):
         self._input_negativeprompt = input_negativeprompt
-        self._prompt, self._negativeprompt = self._make_prompt(
-            input_prompt=self._input_prompt,
-            input_negativeprompt=input_negativeprompt,
-            style=self._style
-        )
+        self._prompt = self._negativeprompt = None
 
     @property
     def prompt(self):
+        self._assemble()
         return self._prompt
 
     @prompt.setter
@@ -181,6 +298,7 @@ class GeneratePrompt:
 
     @property
     def negativeprompt(self):
+        self._assemble()
         return self._negativeprompt
 
     @negativeprompt.setter
@@ -194,63 +312,32 @@ class GeneratePrompt:
     @style.setter
     def style(self, style: str):
         self._style = style
-        self._prompt, self._negativeprompt = self._make_prompt(
-            input_prompt=self._input_prompt,
-            input_negativeprompt=self._input_negativeprompt,
-            style=style
-        )
+        self._prompt = self._negativeprompt = None
 
     def _make_prompt(self, input_prompt: str, input_negativeprompt: str, style: str):
-        self._prompt = (
-            PromptConstants.cast["preprompt"].get(
-                style, 
-                PromptConstants.cast["preprompt"]["default"]
-            ) +
-            input_prompt +
-            PromptConstants.cast["afterprompt"].get(
-                style, 
-                PromptConstants.cast["afterprompt"]["default"]
-            )
+        preprompt, afterprompt, negative_template = _STYLE_PARTS.get(
+            style, _DEFAULT_STYLE_PARTS
         )
-        self._negativeprompt = (
-            input_negativeprompt + 
-            (", " if input_negativeprompt else "") + 
-            PromptConstants.cast["negativeprompt_template"].get(
-                style, 
-                PromptConstants.cast["negativeprompt_template"]["default"]
-            ) 
+        prompt = preprompt + input_prompt + afterprompt
+        negativeprompt = (
+            input_negativeprompt
+            + (", " if input_negativeprompt else "")
+            + negative_template
         )
+
+        # text after the last CLIP chunk would only be encoded to be cut by the host
+        from app.settings import Settings  # (app.settings imports app.utils)
+
+        max_chunks = Settings.server.prompt_max_chunks or 0
+        if max_chunks > 0:
+            prompt = truncate_prompt(prompt, max_chunks * CLIP_CHUNK_TOKENS)
+            negativeprompt = truncate_prompt(negativeprompt, max_chunks * CLIP_CHUNK_TOKENS)
+
+        self._prompt, self._negativeprompt = prompt, negativeprompt
         return self._prompt, self._negativeprompt
 
     def _random_prompt(self):
-        # This generates a random prompt using a finetuned gpt 2. Uses the transformers library.
-        prompt_beginnings = [
-            "landscape of", "a beautiful", "digital concept art", "a", 
-            "abstract", "highly detailed", "landscape", "fantasy", 
-            "isometric", "Greg Rutkowski", "makoto shinkai", 
-            "undergrowth, lush", "volumetric lighting", "4k", 
-            "by", "dreamlike", "surreal", "lust city", "By Brad Rigney", "vivid colors"
-        ]
-        prompt = random.choice(prompt_beginnings)  
-        temperature = 0.9  
-        top_k = 50              
-        max_length = 50        
-        repitition_penalty = 1.15
-        num_return_sequences=1  
-        input_ids = tokenizer(prompt, return_tensors='pt').input_ids
-
-        output = model.generate(
-            input_ids,
-            do_sample=True,
-            temperature=temperature,
-            top_k=top_k,
-            max_length=max_length,
-            num_return_sequences=num_return_sequences,
-            repetition_penalty=repitition_penalty,
-        )
-
-        self._prompt = str(tokenizer.decode(output[0], skip_special_tokens=True) + ", colorful, sharp focus")
-        self._negativeprompt = "monochrome, nsfw, nude, borders, low quality, low resolution, greyscale"
+        self._prompt, self._negativeprompt = generate_random_prompts(1)[0]
         return self._prompt, self._negativeprompt
 
     def make_prompt(
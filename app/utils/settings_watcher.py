@@ -0,0 +1,193 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.settings import Settings, _Settings, ModelType
+from app.utils.logger import logger
+
+__all__ = ["SettingsWatcher"]
+
+# settings only read at startup (SD hosts, Discord login, slash command name,
+# the folders the image storage and the workflows were loaded from), a changed
+# value is kept at its current value until the bot is restarted
+RESTART_SETTINGS = {
+    "server": [
+        "host",
+        "port",
+        "sd_api_type",
+        "backends",
+        "discord_bot_key",
+        "bot_command",
+        "settings_watch_interval",
+    ],
+    "files": [
+        "image_folder",
+        "workflows_folder",
+    ],
+}
+
+SettingsListener = Callable[[_Settings, _Settings], None]  # (old, new)
+
+
+# Hot reload of bot_settings.json (and the .env file)
+# - the files are polled for a changed mtime every `settings_watch_interval` seconds
+# - a new snapshot is built and validated (pydantic, commands, workflows, models)
+#   completely before it is applied, an invalid file is logged and ignored
+# - the snapshot is applied in one step (Settings.apply), running jobs keep the
+#   model definitions they were started with
+# - listeners are called with (old, new) after a snapshot was applied,
+#   e.g. to resize the task queue workers / max_jobs
+class _SettingsWatcher:
+    def __init__(self):
+        self.logger = logger
+        self.json_file: Optional[str] = None
+        self.dot_env: Optional[str] = None
+        self.reload_count = 0
+        self.last_error: Optional[str] = None
+        self._mtimes: Tuple[Optional[int], ...] = ()
+        self._listeners: List[SettingsListener] = []
+        self._lock = threading.Lock()
+        self._watch_thread: threading.Thread = None
+        self._stop = threading.Event()
+
+    def add_listener(self, listener: SettingsListener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: SettingsListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _stat(self) -> Tuple[Optional[int], ...]:
+        mtimes = []
+        for path in (self.json_file, self.dot_env):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns if path else None)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def watch(self, json_file: Optional[str], dot_env: Optional[str] = None):
+        # set the files, the current contents are assumed to be loaded
+        self.json_file = json_file
+        self.dot_env = dot_env
+        self._mtimes = self._stat()
+
+    def check(self) -> bool:
+        # reloads the settings when a file changed, returns True if applied
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+        # remember the change also for an invalid file (logged once, not every poll)
+        self._mtimes = mtimes
+        return self.reload()
+
+    # ---------------------------------------
+    # reload
+    # ---------------------------------------
+    def load(self) -> _Settings:
+        # new settings snapshot from the files, raises on invalid settings
+        new_settings = _Settings(json_file=self.json_file, dot_env=self.dot_env)
+        self.validate(new_settings)
+        return new_settings
+
+    def validate(self, new_settings: _Settings):
+        for section, names in RESTART_SETTINGS.items():
+            old, new = getattr(Settings, section), getattr(new_settings, section)
+            for name in names:
+                if getattr(old, name) != getattr(new, name):
+                    self.logger.warning(
+                        f"Setting {section}.{name} changed, restart the bot to apply"
+                    )
+                    setattr(new, name, getattr(old, name))
+
+        new_settings.check_for_valid_workflows(
+            workflow_folder=new_settings.files.workflows_folder, purge_and_warn=False
+        )
+
+        # models are checked against the SD hosts, as at startup
+        from app.sd_apis.model_inventory import ModelInventory
+
+        valid_models = [ModelInventory.names(t) for t in ModelType]
+        if None not in valid_models:
+            new_settings.check_for_valid_models(
+                *valid_models, keep_missing=new_settings.server.keep_missing_models
+            )
+
+        # slash command choices are registered with Discord at startup
+        new_commands = self._command_models(new_settings)
+        for name, old_models in self._command_models(Settings).items():
+            new_models = new_commands.get(name, {})
+            if removed := set(old_models) - set(new_models):
+                raise ValueError(
+                    f"Models {sorted(removed)} removed from '{name}', still offered by "
+                    f"the registered commands (restart the bot to remove)"
+                )
+            if added := set(new_models) - set(old_models):
+                self.logger.warning(
+                    f"Models {sorted(added)} added to '{name}', restart the bot to "
+                    f"offer them in the slash command choices"
+                )
+
+    @staticmethod
+    def _command_models(settings: _Settings) -> Dict[str, Dict]:
+        return {
+            k: v.models for k, v in settings.__dict__.items() if hasattr(v, "models")
+        }
+
+    def reload(self) -> bool:
+        try:
+            new_settings = self.load()
+        except Exception as e:
+            self.last_error = str(e)
+            self.logger.error(f"Invalid settings, reload ignored: {e}")
+            return False
+
+        with self._lock:
+            old_settings = Settings.model_copy()  # shallow, keeps the old sub-models
+            Settings.apply(new_settings)
+            self.reload_count += 1
+            self.last_error = None
+
+        self.logger.info(f"Settings reloaded from {self.json_file}")
+        for listener in list(self._listeners):
+            try:
+                listener(old_settings, Settings)
+            except Exception as e:
+                self.logger.error(f"Settings listener {listener!r} failed: {e}")
+        return True
+
+    # ---------------------------------------
+    # background watch
+    # ---------------------------------------
+    def start(
+        self,
+        json_file: Optional[str],
+        dot_env: Optional[str] = None,
+        interval: Optional[int] = None,
+    ):
+        interval = interval or Settings.server.settings_watch_interval
+        if self._watch_thread is not None or not interval or json_file is None:
+            return
+
+        self.watch(json_file, dot_env)
+
+        def _watch_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception as e:
+                    self.logger.error(f"Settings watch failed: {e}")
+
+        self._stop.clear()
+        self._watch_thread = threading.Thread(
+            target=_watch_loop, name="settings-watcher", daemon=True
+        )
+        self._watch_thread.start()
+        self.logger.info(f"Watching {json_file} for changes, interval={interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self._watch_thread = None
+
+
+SettingsWatcher = _SettingsWatcher()  # singleton instance
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import contextlib
+from typing import List, Tuple
+
+__all__ = ["StartupProfile"]
+
+
+# Startup (import-time) profile of the bot, enabled with BOT_PROFILE_STARTUP=1
+# - `phase` measures the wall time of a startup step and the modules it imported
+# - `report` lists the phases with the heaviest newly imported packages
+# (for a per-module breakdown, run with `python -X importtime bot.py`)
+class _StartupProfile:
+    def __init__(self):
+        self.enabled = os.getenv("BOT_PROFILE_STARTUP", "0") == "1"
+        self._t0 = time.perf_counter()
+        self._phases: List[Tuple[str, float, List[str]]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        modules = set(sys.modules.keys())
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            new_modules = [m for m in sys.modules.keys() if m not in modules]
+            self._phases.append((name, time.perf_counter() - start, new_modules))
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def report(self) -> str:
+        lines = [f"Startup profile ({self.elapsed * 1000:.0f} ms since first import):"]
+        for name, duration, modules in self._phases:
+            packages = sorted({m.split(".")[0] for m in modules if not m.startswith("_")})
+            if len(packages) > 12:
+                packages = packages[:12] + ["..."]
+            lines.append(
+                f"  {name:<24} {duration * 1000:>8.1f} ms  {len(modules):>5} modules"
+                f"  [{', '.join(packages)}]"
+            )
+        return "\n".join(lines)
+
+
+StartupProfile = _StartupProfile()  # singleton instance
@@ -6,6 +6,7 @@ from app.settings import Settings
 from app.utils.logger import logger
 from app.utils.image_file import VideoContainer
 from app.views.generate_animation_2step import VaryAnimationButton, RetryAnimationButton
+from app.views.view_helpers import RetainedFilesView
 from app.sd_apis.abstract_api import AbstractAPI
 
 
@@ -15,7 +16,7 @@ from app.sd_apis.abstract_api import AbstractAPI
 # ----------------------------------------------
 # The main view
 # ----------------------------------------------
-class GenerateAnimationView1Step(discord.ui.View):
+class GenerateAnimationView1Step(RetainedFilesView):
 
     def __init__(
         self,
@@ -32,6 +33,7 @@ class GenerateAnimationView1Step(discord.ui.View):
         self.images = images
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(*images)
 
         # row 0: variation buttons
         labels = (
@@ -14,7 +14,10 @@ from app.views.generate_image import VaryImageButton, RetryImageButton
 from app.views.view_helpers import (
     create_animation,
     idler_message,
+    wait_for_task,
+    LivePreview,
     ItemSelect,
+    RetainedFilesView,
 )
 from app.utils.helpers import random_seed, load_workflow_and_map
 
@@ -27,7 +30,7 @@ from app.sd_apis.abstract_api import AbstractAPI
 # ----------------------------------------------
 # The main view
 # ----------------------------------------------
-class GenerateAnimationPreviewView(discord.ui.View):
+class GenerateAnimationPreviewView(RetainedFilesView):
 
     def __init__(
         self,
@@ -45,6 +48,7 @@ class GenerateAnimationPreviewView(discord.ui.View):
         self.images = images
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(*images)
 
         # row 0: variation buttons
         labels = (
@@ -148,7 +152,7 @@ class ToAnimationButton(discord.ui.Button):
         )
 
 
-class GenerateAnimationView2step(discord.ui.View):
+class GenerateAnimationView2step(RetainedFilesView):
 
     def __init__(
         self,
@@ -164,6 +168,7 @@ class GenerateAnimationView2step(discord.ui.View):
         self.image = image
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(image)
 
         # row 0: select video format type
         def set_format_type(value: str):
@@ -313,6 +318,7 @@ class VaryAnimationButton(discord.ui.Button):
             delete_after=1800,
         )
         itask = asyncio.create_task(idler_message(message, interaction))
+        preview = LivePreview.create(interaction)
 
         var_image = self.image.copy()
         var_image.image.create_file_name()
@@ -329,18 +335,25 @@ class VaryAnimationButton(discord.ui.Button):
         task = await AsyncTaskQueue.create_and_add_task(
             create_animation,
             args=(var_image, self.sd_api),
+            kwargs={"on_preview": preview},
             task_owner=interaction.user.id,
+            affinity_key=var_image.model_def.sd_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
             itask.cancel()
+            if preview is not None:
+                preview.close()
             await interaction.edit_original_response(
                 content="Failed to create task for image, queue full.", delete_after=4
             )
             return
 
-        var_image.image: ImageFile = await task.wait_result()
-        itask.cancel()
+        var_image.image: ImageFile = await wait_for_task(task, interaction, itask)
+        if preview is not None:
+            preview.close()
+        if var_image.image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(var_image.image.image_filename)}"
         )
@@ -398,6 +411,7 @@ class RetryAnimationButton(discord.ui.Button):
             delete_after=1800,
         )
         itask = asyncio.create_task(idler_message(message, interaction))
+        preview = LivePreview.create(interaction)
 
         var_image = self.image.copy()
         var_image.image.create_file_name()
@@ -406,20 +420,27 @@ class RetryAnimationButton(discord.ui.Button):
         task = await AsyncTaskQueue.create_and_add_task(
             create_animation,
             args=(var_image, self.sd_api),
+            kwargs={"on_preview": preview},
             task_owner=interaction.user.id,
+            affinity_key=var_image.model_def.sd_model,
         )
 
         #task = "ok"
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
             itask.cancel()
+            if preview is not None:
+                preview.close()
             await interaction.edit_original_response(
                 content="Failed to create task for image, queue full.", delete_after=4
             )
             return
 
-        var_image.image: ImageFile = await task.wait_result()
-        itask.cancel()
+        var_image.image: ImageFile = await wait_for_task(task, interaction, itask)
+        if preview is not None:
+            preview.close()
+        if var_image.image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(var_image.image.image_filename)}"
         )
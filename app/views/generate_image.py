@@ -3,15 +3,22 @@ import random
 import discord
 import asyncio
 import logging
-from typing import List, cast
+from typing import List
 
 from app.settings import Settings
 from app.utils.logger import logger
-from app.utils.async_task_queue import AsyncTaskQueue, Task 
+from app.utils.async_task_queue import AsyncTaskQueue
 from app.utils.image_file import ImageFile, ImageContainer
 from app.utils.image_count import ImageCount
 from app.utils.helpers import random_seed, CARDINALS
-from app.views.view_helpers import create_image, idler_message
+from app.views.view_helpers import (
+    create_image,
+    idler_message,
+    wait_for_task,
+    wait_for_tasks,
+    IncrementalDelivery,
+    RetainedFilesView,
+)
 
 from app.sd_apis.abstract_api import AbstractAPI
 
@@ -22,7 +29,7 @@ from app.sd_apis.abstract_api import AbstractAPI
 # ----------------------------------------------
 # The main view
 # ----------------------------------------------
-class GenerateImageView(discord.ui.View):
+class GenerateImageView(RetainedFilesView):
 
     def __init__(
         self,
@@ -39,6 +46,7 @@ class GenerateImageView(discord.ui.View):
         self.images = images
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(*images)
 
         # row 0: upscale buttons
         labels = (
@@ -140,6 +148,7 @@ class UpscaleButton(discord.ui.Button):
             process_image,
             args=(self.image.image, self.sd_api),
             task_owner=interaction.user.id,
+            affinity_key=model_def.upscaler_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
@@ -149,8 +158,9 @@ class UpscaleButton(discord.ui.Button):
             )
             return
 
-        upscaled_image: ImageFile = await task.wait_result()
-        itask.cancel()
+        upscaled_image: ImageFile = await wait_for_task(task, interaction, itask)
+        if upscaled_image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(upscaled_image.image_filename)}"
         )
@@ -198,6 +208,7 @@ class VaryImageButton(discord.ui.Button):
             create_image,
             args=(var_image, self.sd_api),
             task_owner=interaction.user.id,
+            affinity_key=var_image.model_def.sd_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
@@ -207,8 +218,9 @@ class VaryImageButton(discord.ui.Button):
             )
             return
 
-        var_image.image: ImageFile = await task.wait_result()
-        itask.cancel()
+        var_image.image: ImageFile = await wait_for_task(task, interaction, itask)
+        if var_image.image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(var_image.image.image_filename)}"
         )
@@ -277,6 +289,7 @@ class RetryImageButton(discord.ui.Button):
                 process_image,
                 args=(i, new_image, interaction),
                 task_owner=interaction.user.id,
+                affinity_key=model_def.sd_model,
             )
             if task is not None:
                 tasks.append(task)
@@ -290,17 +303,16 @@ class RetryImageButton(discord.ui.Button):
                 return
 
         # wait for all tasks to complete
-        new_images: List[ImageContainer] = []
-        for task in tasks:
-            task = cast(Task, task)
-            new_image = await task.wait_result()
-            new_images.append(new_image)
-            self._logger.info(
-                f"Generated Image {ImageCount.increment()}: {os.path.basename(new_image.image.image_filename)}"
-            )
+        new_images: List[ImageContainer] = await wait_for_tasks(
+            tasks,
+            interaction,
+            delivery=IncrementalDelivery.create(interaction, model_def.n_images),
+        )
+        if new_images is None:
+            return
 
         embed = discord.Embed(
-            title=f"Generated {model_def.n_images} random images using these settings:",
+            title=f"Generated {len(new_images)} random images using these settings:",
             description=(
                 f"Prompt: `{self.image.prompt}`\n"
                 f"Negative Prompt: `{self.image.negative_prompt}`\n"
@@ -320,7 +332,7 @@ class RetryImageButton(discord.ui.Button):
 # ----------------------------------------------
 # Upscale only view
 # ----------------------------------------------:
-class UpscaleOnlyView(discord.ui.View):
+class UpscaleOnlyView(RetainedFilesView):
 
     def __init__(
         self,
@@ -336,6 +348,7 @@ class UpscaleOnlyView(discord.ui.View):
         self.image = image
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(image)
 
     @discord.ui.button(label="Upscale", style=discord.ButtonStyle.primary, emoji="🖼️")
     async def button_upscale(self, button, interaction: discord.Interaction):
@@ -355,6 +368,7 @@ class UpscaleOnlyView(discord.ui.View):
             process_image,
             args=(self.image.image, self.sd_api),
             task_owner=interaction.user.id,
+            affinity_key=model_def.upscaler_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
@@ -364,8 +378,9 @@ class UpscaleOnlyView(discord.ui.View):
             )
             return
 
-        upscaled_image: ImageFile = await task.wait_result()
-        itask.cancel()
+        upscaled_image: ImageFile = await wait_for_task(task, interaction, itask)
+        if upscaled_image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(upscaled_image.image_filename)}"
         )
@@ -10,7 +10,14 @@ from app.utils.async_task_queue import AsyncTaskQueue
 from app.utils.image_file import ImageFile, VideoContainer
 from app.utils.image_count import ImageCount
 from app.utils.helpers import random_seed
-from app.views.view_helpers import create_video, idler_message, ItemSelect
+from app.views.view_helpers import (
+    create_video,
+    idler_message,
+    wait_for_task,
+    LivePreview,
+    ItemSelect,
+    RetainedFilesView,
+)
 
 from app.sd_apis.abstract_api import AbstractAPI
 
@@ -21,7 +28,7 @@ from app.sd_apis.abstract_api import AbstractAPI
 # ----------------------------------------------
 # The main view
 # ----------------------------------------------
-class GenerateVideoView(discord.ui.View):
+class GenerateVideoView(RetainedFilesView):
 
     def __init__(
         self,
@@ -38,6 +45,7 @@ class GenerateVideoView(discord.ui.View):
         self.image = image
         self.sd_api = sd_api
         self._logger = logger
+        self.retain_images(image)
 
         # row 0: select motion amount
         def set_motion_amount(value: int | str):
@@ -167,6 +175,7 @@ class VaryVideoButton(discord.ui.Button):
             delete_after=1800,
         )
         itask = asyncio.create_task(idler_message(message, interaction))
+        preview = LivePreview.create(interaction)
 
         var_image = self.image.copy()
         var_image.image.create_file_name()
@@ -183,18 +192,25 @@ class VaryVideoButton(discord.ui.Button):
         task = await AsyncTaskQueue.create_and_add_task(
             create_video,
             args=(var_image, self.sd_api),
+            kwargs={"on_preview": preview},
             task_owner=interaction.user.id,
+            affinity_key=var_image.model_def.sd_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
             itask.cancel()
+            if preview is not None:
+                preview.close()
             await interaction.edit_original_response(
                 content="Failed to create task for image, queue full.", delete_after=4
             )
             return
 
-        var_image.image: ImageFile = await task.wait_result()
-        itask.cancel()
+        var_image.image: ImageFile = await wait_for_task(task, interaction, itask)
+        if preview is not None:
+            preview.close()
+        if var_image.image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(var_image.image.image_filename)}"
         )
@@ -252,6 +268,7 @@ class RetryVideoButton(discord.ui.Button):
             delete_after=1800,
         )
         itask = asyncio.create_task(idler_message(message, interaction))
+        preview = LivePreview.create(interaction)
 
         var_image = self.image.copy()
         var_image.image.create_file_name()
@@ -259,18 +276,25 @@ class RetryVideoButton(discord.ui.Button):
         task = await AsyncTaskQueue.create_and_add_task(
             create_video,
             args=(var_image, self.sd_api),
+            kwargs={"on_preview": preview},
             task_owner=interaction.user.id,
+            affinity_key=var_image.model_def.sd_model,
         )
         if task is None:
             self._logger.error("Failed to create task for image, queue full.")
             itask.cancel()
+            if preview is not None:
+                preview.close()
             await interaction.edit_original_response(
                 content="Failed to create task for image, queue full.", delete_after=4
             )
             return
 
-        var_image.image: ImageFile = await task.wait_result()
-        itask.cancel()
+        var_image.image: ImageFile = await wait_for_task(task, interaction, itask)
+        if preview is not None:
+            preview.close()
+        if var_image.image is None:
+            return
         self._logger.info(
             f"Generated Image {ImageCount.increment()}: {os.path.basename(var_image.image.image_filename)}"
         )
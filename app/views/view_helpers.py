@@ -1,10 +1,50 @@
+import io
+import os
+import time
 import discord
 import asyncio
-from typing import Callable
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+from PIL import Image
 from app.settings import Settings
 from app.settings import UpscalerSingleModel
-from app.sd_apis.abstract_api import AbstractAPI
+from app.utils.logger import logger
+from app.utils.image_count import ImageCount
+from app.utils.async_task_queue import Task, as_completed
+from app.sd_apis.abstract_api import AbstractAPI, PreviewCallback
 from app.utils.image_file import ImageContainer, VideoContainer, ImageFile
+from app.utils.image_storage import ImageStorage
+
+
+# ----------------------------------------------
+# View base class, holding references to files
+# ----------------------------------------------
+class RetainedFilesView(discord.ui.View):
+    # Files shown in the view are needed by its buttons (upscale, retry etc.),
+    # these are protected from the image storage GC until the view times out
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._retained_files: List[str] = []
+
+    def retain_images(self, *images: ImageContainer | VideoContainer | ImageFile):
+        for image in images:
+            files = (
+                [image]
+                if isinstance(image, ImageFile)
+                else [image.image, getattr(image, "image_in", None)]
+            )
+            for f in files:
+                if f is not None and f.image_filename is not None:
+                    self._retained_files.append(f.image_filename)
+                    ImageStorage.acquire(f.image_filename)
+
+    def release_images(self):
+        ImageStorage.release(*self._retained_files)
+        self._retained_files = []
+
+    async def on_timeout(self):
+        self.release_images()
+        await super().on_timeout()
 
 
 # ----------------------------------------------
@@ -49,11 +89,183 @@ async def idler_message(
         await asyncio.sleep(interval)
 
 
+# Live sampler previews in the (ephemeral) status message of a job
+# - called by the SD api in the job thread (on_preview callback), the preview is
+#   decoded and downscaled there, only the Discord edit runs on the event loop
+# - throttled to one edit every `preview_every_steps` sampler steps and at most
+#   every `preview_min_interval` seconds; frames arriving while an edit is still
+#   in flight are dropped (never queued behind a slow Discord)
+# - the idler message keeps editing the text, the preview only replaces the attachment
+class LivePreview:
+    def __init__(
+        self,
+        interaction: discord.Interaction,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        every_steps: Optional[int] = None,
+        min_interval: Optional[float] = None,
+        max_size: Optional[int] = None,
+    ):
+        server = Settings.server
+        self.interaction = interaction
+        self.loop = loop or asyncio.get_running_loop()
+        self.every_steps = max(every_steps or server.preview_every_steps or 1, 1)
+        self.min_interval = (
+            server.preview_min_interval if min_interval is None else min_interval
+        ) or 0
+        self.max_size = max_size or server.preview_max_size or 256
+        self.sent = 0
+        self.closed = False
+        self._last_step: Optional[int] = None
+        self._last_sent_at = 0.0
+        self._pending: Optional[Future] = None
+
+    @classmethod
+    def create(cls, interaction: discord.Interaction) -> Optional["LivePreview"]:
+        # None if live previews are disabled (opt-in)
+        if not Settings.server.live_previews:
+            return None
+        return cls(interaction)
+
+    def _due(self, progress: Optional[Tuple[int, int]]) -> bool:
+        if self._pending is not None and not self._pending.done():
+            return False
+        if time.monotonic() - self._last_sent_at < self.min_interval:
+            return False
+        if progress is None or progress[0] is None:
+            return True
+        step, last = progress[0], self._last_step
+        # a lower step is the next sampler node (e.g. a second pass)
+        return last is None or step < last or step - last >= self.every_steps
+
+    def downscale(self, data: bytes) -> bytes:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((self.max_size, self.max_size))
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=80)
+        return buffer.getvalue()
+
+    def __call__(self, data: bytes, ext: str, progress: Optional[Tuple[int, int]]):
+        if self.closed or not self._due(progress):
+            return
+        if progress is not None:
+            self._last_step = progress[0]
+        self._last_sent_at = time.monotonic()
+        try:
+            preview = self.downscale(data)
+        except Exception as e:
+            logger.warning(f"Invalid preview image: {e}")
+            return
+        self._pending = asyncio.run_coroutine_threadsafe(self._send(preview), self.loop)
+
+    async def _send(self, preview: bytes):
+        if self.closed:
+            return
+        try:
+            await self.interaction.edit_original_response(
+                file=discord.File(io.BytesIO(preview), "preview.jpg"),
+                attachments=[],
+            )
+            self.sent += 1
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to send a preview: {e}")
+
+    def close(self):
+        # no previews after the result was sent
+        self.closed = True
+        if self._pending is not None:
+            self._pending.cancel()
+
+
+# Incremental delivery of a batch of images
+# - each image is edited into the (ephemeral) status message as soon as it is done,
+#   so the first one is seen after one generation instead of after the whole batch
+# - the status message shows the images finished so far, the message with the
+#   grid view (upscale / variation / retry buttons) is still sent at the end
+class IncrementalDelivery:
+    def __init__(self, interaction: discord.Interaction, n_images: int):
+        self.interaction = interaction
+        self.n_images = n_images
+        self.images: List[ImageContainer] = []
+
+    @classmethod
+    def create(
+        cls, interaction: discord.Interaction, n_images: int
+    ) -> Optional["IncrementalDelivery"]:
+        # None if disabled (opt-in) or for a single image
+        if not Settings.server.incremental_delivery or n_images < 2:
+            return None
+        return cls(interaction, n_images)
+
+    async def __call__(self, image: ImageContainer):
+        self.images.append(image)
+        try:
+            await self.interaction.edit_original_response(
+                content=f"Generated {len(self.images)} of {self.n_images} images...",
+                files=[discord.File(i.image.image_filename) for i in self.images],
+                attachments=[],
+            )
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to deliver an image: {e}")
+
+
+# Waits for the tasks of a batch, logging each one as soon as it is done
+# - the results are returned in submission order, failed or cancelled
+#   tasks (result None) are left out
+# - returns None (and tells the user) when no task produced a result
+async def wait_for_tasks(
+    tasks: List[Task],
+    interaction: discord.Interaction,
+    kind: str = "Image",
+    delivery: Optional[IncrementalDelivery] = None,
+) -> Optional[List[ImageContainer | VideoContainer]]:
+    async for task in as_completed(tasks):
+        result = task.result
+        if result is None:
+            logger.error(f"{kind} task {task.state}: {task.error!r}")
+            continue
+        logger.info(
+            f"Generated {kind} {ImageCount.increment()}: {os.path.basename(result.image.image_filename)}"
+        )
+        if delivery is not None:
+            await delivery(result)
+
+    results = [task.result for task in tasks if task.result is not None]
+    if not results:
+        try:
+            await interaction.edit_original_response(
+                content="Generation failed, please try again", delete_after=4
+            )
+        except discord.errors.NotFound:
+            pass
+        return None
+    return results
+
+
+async def wait_for_task(
+    task: Task,
+    interaction: discord.Interaction,
+    itask: Optional[asyncio.Task] = None,
+) -> Optional[ImageFile]:
+    # result of a single task; the idler message (itask) is stopped, when the task
+    # failed or was cancelled the user is told and None is returned
+    result = await task.wait_result()
+    if itask is not None:
+        itask.cancel()
+    if result is None:
+        try:
+            await interaction.edit_original_response(
+                content="Generation failed, please try again", delete_after=4
+            )
+        except discord.errors.NotFound:
+            pass
+    return result
+
+
 # -------------------------------
 # Image processing functions
 # -------------------------------
-def create_image(image: ImageContainer, sd_api: AbstractAPI) -> ImageFile:
-    return sd_api.generate_image(
+def _image_request(image: ImageContainer) -> Dict:
+    return dict(
         prompt=image.prompt,
         negativeprompt=image.negative_prompt,
         seed=image.seed,
@@ -67,7 +279,25 @@ def create_image(image: ImageContainer, sd_api: AbstractAPI) -> ImageFile:
     )
 
 
-def create_video(video_def: VideoContainer, sd_api: AbstractAPI) -> ImageFile:
+def create_image(
+    image: ImageContainer, sd_api: AbstractAPI, on_preview: PreviewCallback = None
+) -> ImageFile:
+    return sd_api.generate_image(**_image_request(image), on_preview=on_preview)
+
+
+# batch of compatible images (same model, workflow and size) in one request
+def create_image_batch(images: List[ImageContainer], sd_api: AbstractAPI) -> List[ImageFile]:
+    return sd_api.generate_image_batch([_image_request(image) for image in images])
+
+
+# images with the same key can be batched by the task queue
+def image_batch_key(image: ImageContainer, workflow_api_file: str) -> Tuple:
+    return (workflow_api_file, image.model_def.sd_model, image.width, image.height)
+
+
+def create_video(
+    video_def: VideoContainer, sd_api: AbstractAPI, on_preview: PreviewCallback = None
+) -> ImageFile:
     return sd_api.generate_image(
         image_file=video_def.image_in.image_filename,
         sd_model=video_def.model_def.sd_model,
@@ -84,10 +314,13 @@ def create_video(video_def: VideoContainer, sd_api: AbstractAPI) -> ImageFile:
         motion_bucket_id=video_def.motion_bucket_id,
         workflow=video_def.workflow,
         workflow_map=video_def.workflow_map,
+        on_preview=on_preview,
     )
 
 
-def create_animation(video_def: VideoContainer, sd_api: AbstractAPI) -> ImageFile:
+def create_animation(
+    video_def: VideoContainer, sd_api: AbstractAPI, on_preview: PreviewCallback = None
+) -> ImageFile:
     return sd_api.generate_image(
         image_file=video_def.image_in.image_filename if video_def.image_in else None,
         sd_model=video_def.model_def.sd_model,
@@ -107,6 +340,7 @@ def create_animation(video_def: VideoContainer, sd_api: AbstractAPI) -> ImageFil
         workflow=video_def.workflow,
         workflow_map=video_def.workflow_map,
         animation_model=video_def.animation_model,
+        on_preview=on_preview,
     )
 
 
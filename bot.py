@@ -1,54 +1,64 @@
 import os
 import sys
 from app.utils.logger import logger
+from app.utils.startup_profile import StartupProfile
 
-# Clear terminal
-os.system("clear")
+# Clear terminal (BOT_CLEAR_TERMINAL=0 to keep it)
+if os.getenv("BOT_CLEAR_TERMINAL", "1") == "1" and sys.stdout.isatty():
+    os.system("clear")
 
 # load settings first, since it is required by the other modules
-from app.settings import Settings, GroupCommands
-from app.utils.helpers import get_env_and_settings_paths
+with StartupProfile.phase("settings"):
+    from app.settings import Settings, GroupCommands, ModelType
+    from app.utils.helpers import get_env_and_settings_paths
 
-dotenv_path, settings_path = get_env_and_settings_paths()
-Settings.reload(dot_env=dotenv_path, json_file=settings_path)
+    dotenv_path, settings_path = get_env_and_settings_paths()
+    Settings.reload(dot_env=dotenv_path, json_file=settings_path)
 
-# Set the URL of the SD API host, initialize the API
+# Set the URLs of the SD API hosts, initialize the APIs
 # (this required first to check models before TypeDefs
 #  are initialized in the commands modules)
-from app.sd_apis.api_handler import Sd
-
-webui_url = (
-    f"{Settings.server.host}:{Settings.server.port}"  # URL/Port of the SD API host
-)
-Sd.api_configure(webui_url, Settings.server.sd_api_type)
-logger.info(f"Started App, using api={Sd.api_type}")
-
-# check SD URL
-if not Sd.api.check_sd_host():
-    logger.error(
-        f"Could not establish connection to SD host. Please check your settings."
-    )
-    sys.exit(1)
-
-# check for valid model and workflow definitions
-if not Settings.check_for_valid_models(
-    valid_checkpoints=Sd.get_valid_checkpoints(),
-    valid_loras=Sd.get_valid_loras(),
-    valid_upscalers=Sd.get_valid_upscalers(),
-):
-    logger.warning(f"Invalid model definition in bot_settings.json, models removed")
-
-if not Settings.check_for_valid_workflows(
-    workflow_folder=Settings.files.workflows_folder
-):
-    logger.warning(f"Invalid workflow definition in bot_settings.json, models removed")
-
-from app.commands.bot_handler import Bot
-from app.utils.async_task_queue import AsyncTaskQueue
-from app.commands.txt2img_cmds import Txt2ImageCommands
-from app.commands.img2img_cmds import Img2ImageCommands, UpscalerCommands
-from app.commands.img2vid_cmds import Img2VideoCommands
-from app.commands.txt2vid_cmds import Txt2Video1StepCommands, Txt2Video2StepCommands
+with StartupProfile.phase("sd apis"):
+    from app.sd_apis.api_handler import Sd
+    from app.sd_apis.model_inventory import ModelInventory
+    from app.sd_apis.backend_health import BackendHealth
+
+    Sd.configure_backends(Settings.server.get_backends())
+    logger.info(f"Started App, using api={Sd.api_type}, hosts={list(Sd.apis.keys())}")
+
+# check SD URLs and discover the models of all hosts
+# (queried in parallel, results are cached for model_cache_ttl seconds)
+with StartupProfile.phase("model discovery"):
+    if not ModelInventory.discover(Sd.apis):
+        logger.error(
+            f"Could not establish connection to SD host. Please check your settings."
+        )
+        sys.exit(1)
+
+    # check for valid model and workflow definitions
+    valid_models = [ModelInventory.names(t) for t in ModelType]
+    if None in valid_models:
+        logger.warning(f"SD host does not list its models, model definitions not checked")
+    elif not Settings.check_for_valid_models(
+        *valid_models, keep_missing=Settings.server.keep_missing_models
+    ):
+        logger.warning(f"Invalid model definition in bot_settings.json")
+
+    # keep the model inventory up to date (used to route jobs to hosts with the model)
+    ModelInventory.start_refresh(Sd.apis)
+    # probe the hosts, jobs are not sent to hosts that are down
+    BackendHealth.start(Sd.apis)
+
+    if not Settings.check_for_valid_workflows(
+        workflow_folder=Settings.files.workflows_folder
+    ):
+        logger.warning(f"Invalid workflow definition in bot_settings.json, models removed")
+
+with StartupProfile.phase("bot"):
+    from app.commands.bot_handler import Bot
+    from app.utils.async_task_queue import AsyncTaskQueue
+    from app.utils.image_storage import ImageStorage
+    from app.utils.settings_watcher import SettingsWatcher
 
 
 # upfront checks
@@ -66,11 +76,28 @@ if model_def.upscaler_model is not None and not Sd.api.set_upscaler_model(
     logger.error(f"Failed to set upscaler on SD host. Please check your settings.")
     sys.exit(1)
 
-# check task queue
+# start removing old / excess files from the image folder
+ImageStorage.start_gc()
+
+# check task queue (default one worker per SD host)
+AsyncTaskQueue.num_workers = Settings.server.num_workers or len(Sd.apis)
 logger.info(
     f"TaskQueue started with n_workers={AsyncTaskQueue.num_workers}, max_jobs={AsyncTaskQueue.max_jobs}"
 )
 
+
+# hot settings reload: queue limits and workers are resized live
+def apply_queue_settings(old_settings, new_settings):
+    AsyncTaskQueue.max_jobs = new_settings.server.max_jobs
+    AsyncTaskQueue.num_workers = new_settings.server.num_workers or len(Sd.apis)
+    logger.info(
+        f"TaskQueue resized to n_workers={AsyncTaskQueue.num_workers}, max_jobs={AsyncTaskQueue.max_jobs}"
+    )
+
+
+SettingsWatcher.add_listener(apply_queue_settings)
+SettingsWatcher.start(json_file=settings_path, dot_env=dotenv_path)
+
 # Initialize the bot, organization is as follows:
 # Layers:
 # Bot                    : instance
@@ -85,46 +112,76 @@ Bot.configure(
 # Add subgroups
 # specific command binding occurs in the individual command files
 # sub_group (sub_group_commands are contained therein)
+# (command modules are only imported when the command is enabled)
 
 # txt2img
 if Settings.has_command(GroupCommands.txt2img):
-    txt2img_group = Bot.create_subgroup(
-        GroupCommands.txt2img.name, "Create image using prompt"
-    )
-    Txt2ImageCommands(txt2img_group)
+    with StartupProfile.phase("txt2img commands"):
+        from app.commands.txt2img_cmds import Txt2ImageCommands
+
+        txt2img_group = Bot.create_subgroup(
+            GroupCommands.txt2img.name, "Create image using prompt"
+        )
+        Txt2ImageCommands(txt2img_group)
 
 # img2img
 if Settings.has_command(GroupCommands.img2img):
-    img2img_group = Bot.create_subgroup(
-        GroupCommands.img2img.name, "Create image from image"
-    )
-    Img2ImageCommands(img2img_group)
+    with StartupProfile.phase("img2img commands"):
+        from app.commands.img2img_cmds import Img2ImageCommands
+
+        img2img_group = Bot.create_subgroup(
+            GroupCommands.img2img.name, "Create image from image"
+        )
+        Img2ImageCommands(img2img_group)
 
 # img2vid
 if Settings.has_command(GroupCommands.img2vid):
-    img2vid_group = Bot.create_subgroup(
-        GroupCommands.img2vid.name, "Create video from image"
-    )
-    Img2VideoCommands(img2vid_group)
+    with StartupProfile.phase("img2vid commands"):
+        from app.commands.img2vid_cmds import Img2VideoCommands
+
+        img2vid_group = Bot.create_subgroup(
+            GroupCommands.img2vid.name, "Create video from image"
+        )
+        Img2VideoCommands(img2vid_group)
 
 # txt2vid1step
 if Settings.has_command(GroupCommands.txt2vid1step):
-    txt2vid1step_group = Bot.create_subgroup(
-        GroupCommands.txt2vid1step.name, "Create quick animation from text"
-    )
-    Txt2Video1StepCommands(txt2vid1step_group)
+    with StartupProfile.phase("txt2vid1step commands"):
+        from app.commands.txt2vid_cmds import Txt2Video1StepCommands
+
+        txt2vid1step_group = Bot.create_subgroup(
+            GroupCommands.txt2vid1step.name, "Create quick animation from text"
+        )
+        Txt2Video1StepCommands(txt2vid1step_group)
 
 # txt2vid2step
 if Settings.has_command(GroupCommands.txt2vid2step):
-    txt2vid2step_group = Bot.create_subgroup(
-        GroupCommands.txt2vid2step.name, "Create animation from text"
-    )
-    Txt2Video2StepCommands(txt2vid2step_group)
+    with StartupProfile.phase("txt2vid2step commands"):
+        from app.commands.txt2vid_cmds import Txt2Video2StepCommands
+
+        txt2vid2step_group = Bot.create_subgroup(
+            GroupCommands.txt2vid2step.name, "Create animation from text"
+        )
+        Txt2Video2StepCommands(txt2vid2step_group)
 
 # upscaler
 if Settings.has_command(GroupCommands.upscaler):
-    upscale_group = Bot.create_subgroup(GroupCommands.upscaler.name, "Upscale image")
-    UpscalerCommands(upscale_group)
+    with StartupProfile.phase("upscaler commands"):
+        from app.commands.img2img_cmds import UpscalerCommands
+
+        upscale_group = Bot.create_subgroup(GroupCommands.upscaler.name, "Upscale image")
+        UpscalerCommands(upscale_group)
+
+# random prompts are generated in the background (used by the random commands)
+if Settings.has_command(GroupCommands.txt2img) or Settings.has_command(
+    GroupCommands.txt2vid2step
+):
+    from app.utils.prompt_pool import PromptPool
+
+    PromptPool.start()
+
+if StartupProfile.enabled:
+    logger.info(StartupProfile.report())
 
 logger.info("-" * 80)
 logger.info(f"Bot is running")